@@ -68,7 +68,7 @@ SERVICE_ORDER = [
     "svc_candles",
     "svc_chain_snap",
     "svc_strategy_core",
-    "svc_rr_builder",      # oneshot – may not appear if not tracked
+    "svc_rr_builder",
     "svc_kpi_eod",         # oneshot – may not appear if not tracked
 ]
 
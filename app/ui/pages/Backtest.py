@@ -18,7 +18,7 @@ if not user:
     st.stop()
 
 st.title("Backtest")
-st.caption("Run offline backtests; this page lists orders/results if present.")
+st.caption("Run offline backtests with services\\backtest\\svc_backtest.py; this page lists orders/results if present.")
 
 if not DB_PATH.exists():
     st.error(f"Database not found at: {DB_PATH}")
@@ -49,7 +49,7 @@ with sqlite3.connect(DB_PATH) as conn:
         st.stop()
 
     # Try to find a time-like column to order by
-    time_candidates = ["ts", "time", "timestamp", "created_at"]
+    time_candidates = ["ts_entry", "ts", "time", "timestamp", "created_at"]
     tcol = next((c for c in time_candidates if c in cols), None)
 
     order_clause = f"ORDER BY {tcol} DESC" if tcol else "ORDER BY ROWID DESC"
@@ -20,6 +20,14 @@ try:
 except Exception:
     yaml = None
 
+import sys
+if r"C:\teevra18" not in sys.path:
+    sys.path.append(r"C:\teevra18")
+try:
+    from teevra.strategy_registry import compile_spec, spec_from_lab  # rule compiler shared with M7/backtests
+except Exception:
+    compile_spec = spec_from_lab = None
+
 
 # --- Resolve DB from teevra18.config.json (fallback to C:\teevra18\data\teevra18.db)
 def _resolve_db_path():
@@ -349,6 +357,39 @@ def import_universe_and_indicators(file_path: Path):
         conn.close()
 
 
+def _preview_strategy(conn: sqlite3.Connection, cs, table: str = "candles_1m", limit: int = 200):
+    """Run a compiled strategy over the last bars of every instrument (same evaluator as M7)."""
+    import numpy as np
+    bars = None
+    try:
+        from teevra import candles_latest as cl   # last-K bars kept by the candle writer
+        tf = table.split("_", 1)[1]
+        if cs.bars_needed <= cl.K and cl.has_latest(conn, tf):
+            bars = cl.latest_bars(conn, tf, cs.bars_needed)
+            sids = list(bars["sid"])
+    except ImportError:
+        pass
+    if bars is None:
+        rows = conn.execute(
+            f"""
+            SELECT instrument_id, t_start, open, high, low, close FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY instrument_id ORDER BY t_start DESC) AS rn
+                FROM {table}
+            ) WHERE rn <= ? ORDER BY instrument_id, t_start
+            """, (cs.bars_needed,)).fetchall()
+        by_sid = {}
+        for r in rows:
+            by_sid.setdefault(r[0], []).append(r[2:])
+        sids = [k for k, v in by_sid.items() if len(v) == cs.bars_needed]
+        if not sids:
+            return []
+        arr = np.array([by_sid[k] for k in sids], dtype=float)
+        bars = {"o": arr[:, :, 0], "h": arr[:, :, 1], "l": arr[:, :, 2], "c": arr[:, :, 3]}
+    side = cs.evaluate(bars)
+    return [{"instrument_id": sid, "side": {1: "LONG", -1: "SHORT"}[int(sd)], "close": float(c)}
+            for sid, sd, c in zip(sids, side, bars["c"][:, -1]) if sd][:limit]
+
+
 # --- Main UI ---------------------------------------------------------------
 mode = st.radio("Choose Mode", ["Graphical", "Script"], horizontal=True)
 
@@ -430,7 +471,8 @@ if mode == "Graphical":
 else:
     st.caption(
         "Paste YAML or JSON mapping of indicator -> {params: {...}}. "
-        "Names like ‘Bollinger Bands’ normalize to BBANDS."
+        "Names like ‘Bollinger Bands’ normalize to BBANDS. "
+        "Add a `rules` block (long/short/stop_long/stop_short) to make it a runnable strategy."
     )
     example = """# YAML example
 EMA:
@@ -454,6 +496,7 @@ Bollinger Bands:
                 cfg = yaml.safe_load(script_text)
             if not isinstance(cfg, dict) or not cfg:
                 raise ValueError("Config must be a non-empty mapping of indicators to params.")
+            rules = cfg.pop("rules", None)
             norm_cfg = {}
             for k, v in cfg.items():
                 k2u = k.strip().upper().replace("-", " ").replace("_", " ")
@@ -461,6 +504,11 @@ Bollinger Bands:
                 norm_cfg[k2n] = v
 
             strategy_id = f"lab_{uuid4().hex[:8]}"
+            if rules:
+                if compile_spec is None:
+                    raise RuntimeError("Rule compiler unavailable (teevra.strategy_registry import failed).")
+                norm_cfg["rules"] = rules
+                compile_spec(strategy_id, spec_from_lab(norm_cfg))  # raises on bad rules
 
             # 1) Save in Lab catalog
             cur.execute(
@@ -476,6 +524,22 @@ Bollinger Bands:
         except Exception as e:
             st.error(f"Validation failed: {e}")
 
+    if st.button("Preview rules on latest candles", disabled=(not script_text.strip() or compile_spec is None)):
+        try:
+            try:
+                pcfg = json.loads(script_text)
+            except Exception:
+                if yaml is None:
+                    raise RuntimeError("YAML not available. Run: pip install pyyaml")
+                pcfg = yaml.safe_load(script_text)
+            spec = spec_from_lab(pcfg)
+            if not spec:
+                raise ValueError("Add a `rules` block to preview.")
+            cs = compile_spec("preview", spec)
+            st.dataframe(_preview_strategy(conn, cs), use_container_width=True)
+        except Exception as e:
+            st.error(f"Preview failed: {e}")
+
 st.divider()
 
 # ------------------------
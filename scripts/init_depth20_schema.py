@@ -1,4 +1,8 @@
-﻿import os, sqlite3
+﻿import os, sys, sqlite3
+
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+from teevra.depth_store import ensure_schema as ensure_books_schema
 
 db = r"C:\teevra18\data\teevra18.db"
 os.makedirs(os.path.dirname(db), exist_ok=True)
@@ -32,6 +36,9 @@ CREATE INDEX IF NOT EXISTS idx_d20_sid_time ON depth20_levels(security_id, ts_re
 CREATE INDEX IF NOT EXISTS idx_d20_side_lvl ON depth20_levels(side, level);
 """)
 
+# compact one-row-per-book table written by svc-depth20 (DEPTH20_STORE=books)
+ensure_books_schema(con)
+
 con.commit()
 con.close()
-print("depth20_levels ready.")
+print("depth20_levels / depth20_books ready.")
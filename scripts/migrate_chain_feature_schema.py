@@ -21,7 +21,8 @@ CREATE TABLE IF NOT EXISTS option_chain_features (
   iv_atm_pe     REAL,
   iv_skew       REAL,
   atm_delta_ce  REAL,
-  atm_delta_pe  REAL
+  atm_delta_pe  REAL,
+  max_pain      REAL
 );
 CREATE UNIQUE INDEX IF NOT EXISTS uq_och_feat ON option_chain_features(ts_fetch_utc, underlying, expiry);
 CREATE INDEX IF NOT EXISTS ix_och_feat_und_exp ON option_chain_features(underlying, expiry);
@@ -1,12 +1,24 @@
 # monitor_depth.py
-import sqlite3, pandas as pd
+import sys, sqlite3, pandas as pd
+
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+from teevra.depth_store import has_books, latest_books, books_to_levels
 
 con = sqlite3.connect(r"C:\teevra18\data\teevra18.db")
-df = pd.read_sql_query("""
-SELECT substr(ts_recv_utc,12,12) as t, security_id, side, level, price, qty, orders, latency_ms
-FROM depth20_levels
-ORDER BY ts_recv_utc DESC, security_id, side, level
-LIMIT 40
-""", con)
-print(df)
+if has_books(con):
+    # newest full book per security in one fetch, shown in the old levels layout
+    bk = latest_books(con)
+    df = pd.DataFrame(books_to_levels(bk), columns=["t", "security_id", "side", "level", "price", "qty", "orders"])
+    df["t"] = df["t"].str.slice(11, 23)
+    print(df.sort_values(["t", "security_id", "side", "level"], ascending=[False, True, True, True]).head(40)
+            .reset_index(drop=True))
+else:
+    df = pd.read_sql_query("""
+    SELECT substr(ts_recv_utc,12,12) as t, security_id, side, level, price, qty, orders, latency_ms
+    FROM depth20_levels
+    ORDER BY ts_recv_utc DESC, security_id, side, level
+    LIMIT 40
+    """, con)
+    print(df)
 con.close()
@@ -1,4 +1,8 @@
-import sqlite3, pandas as pd, os
+import sqlite3, pandas as pd, os, sys
+
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+from teevra.depth_store import has_books, latest_books, books_to_levels
 
 DB = r"C:\teevra18\data\teevra18.db"
 
@@ -16,10 +20,24 @@ def sanity_check(con):
         print("depth20_levels rows:", cnt, "latest ts:", last_ts)
     except sqlite3.OperationalError as e:
         print("Table check error:", e)
+    try:
+        cur.execute("SELECT COUNT(*), SUM(is_key), MAX(ts_recv_utc) FROM depth20_books")
+        cnt, keys, last_ts = cur.fetchone()
+        print("depth20_books rows:", cnt, "keyframes:", keys, "latest ts:", last_ts)
+    except sqlite3.OperationalError as e:
+        print("Table check error:", e)
     print()
 
 def quick_view(con):
     print("== Quick View (last 40 rows) ==")
+    if has_books(con):
+        df = pd.DataFrame(books_to_levels(latest_books(con)),
+                          columns=["t", "security_id", "side", "level", "price", "qty", "orders"])
+        df["t"] = df["t"].str.slice(11, 23)
+        print(df.sort_values(["t", "security_id", "side", "level"], ascending=[False, True, True, True])
+                .head(40).reset_index(drop=True))
+        print()
+        return
     sql = """
     SELECT substr(ts_recv_utc,12,12) as t, security_id, side, level, price, qty, orders, latency_ms
     FROM depth20_levels
@@ -32,6 +50,33 @@ def quick_view(con):
 
 def health_view(con):
     print("== Health View ==")
+    if has_books(con):
+        # one row per book: pressures/latency are plain columns, no per-level GROUP BY
+        summary = pd.read_sql_query("""
+        SELECT COUNT(*) AS rows_total, SUM(is_key) AS keyframes,
+               SUM(length(bid_levels) + length(ask_levels)) / 16 AS levels_stored,
+               MIN(ts_recv_utc) AS first_ts, MAX(ts_recv_utc) AS last_ts
+        FROM depth20_books
+        """, con)
+        print("Summary:")
+        print(summary)
+        latest = pd.read_sql_query("""
+        WITH latest AS (
+          SELECT security_id, MAX(ts_recv_utc) AS ts FROM depth20_books GROUP BY security_id
+        )
+        SELECT d.security_id, d.ts_recv_utc,
+               d.top5_bid_qty AS bid5, d.top5_ask_qty AS ask5,
+               ROUND(d.pressure_1_5,4) AS pressure_1_5,
+               ROUND(d.latency_ms,1) AS latency_ms
+        FROM depth20_books d
+        JOIN latest l ON l.security_id=d.security_id AND l.ts=d.ts_recv_utc
+        ORDER BY d.ts_recv_utc DESC
+        LIMIT 10
+        """, con)
+        print("\nLatest per security:")
+        print(latest)
+        print()
+        return
     summary = pd.read_sql_query("""
     SELECT COUNT(*) AS rows_total,
            MIN(ts_recv_utc) AS first_ts,
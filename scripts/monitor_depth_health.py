@@ -1,32 +1,51 @@
-import sqlite3, pandas as pd
+import sys, sqlite3, pandas as pd
+
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+from teevra.depth_store import has_books, latest_books
 
 DB = r"C:\teevra18\data\teevra18.db"
 con = sqlite3.connect(DB)
 
-summary = pd.read_sql_query("""
-SELECT COUNT(*) AS rows_total,
-       MIN(ts_recv_utc) AS first_ts,
-       MAX(ts_recv_utc) AS last_ts
-FROM depth20_levels
-""", con)
+if has_books(con):
+    summary = pd.read_sql_query("""
+    SELECT COUNT(*) AS rows_total, SUM(is_key) AS keyframes,
+           MIN(ts_recv_utc) AS first_ts,
+           MAX(ts_recv_utc) AS last_ts
+    FROM depth20_books
+    """, con)
+    # newest book per security rebuilt from its keyframe (delta rows carry only changed levels)
+    bk = latest_books(con)
+    latest = pd.DataFrame({
+        "security_id": bk["security_id"], "ts_recv_utc": bk["ts"],
+        "bid5": bk["top5_bid"], "ask5": bk["top5_ask"],
+        "pressure_1_5": bk["p_1_5"].round(4), "avg_latency_ms": bk["latency_ms"].round(1),
+    }).sort_values("ts_recv_utc", ascending=False).head(10).reset_index(drop=True)
+else:
+    summary = pd.read_sql_query("""
+    SELECT COUNT(*) AS rows_total,
+           MIN(ts_recv_utc) AS first_ts,
+           MAX(ts_recv_utc) AS last_ts
+    FROM depth20_levels
+    """, con)
 
-latest = pd.read_sql_query("""
-WITH latest AS (
-  SELECT security_id, MAX(ts_recv_utc) AS ts
-  FROM depth20_levels
-  GROUP BY security_id
-)
-SELECT d.security_id, d.ts_recv_utc,
-       MAX(d.top5_bid_qty)  AS bid5,
-       MAX(d.top5_ask_qty)  AS ask5,
-       ROUND(MAX(d.pressure_1_5),4) AS pressure_1_5,
-       ROUND(AVG(d.latency_ms),1)   AS avg_latency_ms
-FROM depth20_levels d
-JOIN latest l ON l.security_id=d.security_id AND l.ts=d.ts_recv_utc
-GROUP BY d.security_id, d.ts_recv_utc
-ORDER BY d.ts_recv_utc DESC
-LIMIT 10
-""", con)
+    latest = pd.read_sql_query("""
+    WITH latest AS (
+      SELECT security_id, MAX(ts_recv_utc) AS ts
+      FROM depth20_levels
+      GROUP BY security_id
+    )
+    SELECT d.security_id, d.ts_recv_utc,
+           MAX(d.top5_bid_qty)  AS bid5,
+           MAX(d.top5_ask_qty)  AS ask5,
+           ROUND(MAX(d.pressure_1_5),4) AS pressure_1_5,
+           ROUND(AVG(d.latency_ms),1)   AS avg_latency_ms
+    FROM depth20_levels d
+    JOIN latest l ON l.security_id=d.security_id AND l.ts=d.ts_recv_utc
+    GROUP BY d.security_id, d.ts_recv_utc
+    ORDER BY d.ts_recv_utc DESC
+    LIMIT 10
+    """, con)
 
 print("== Summary ==")
 print(summary)
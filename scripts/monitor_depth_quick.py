@@ -1,14 +1,28 @@
-import sqlite3, pandas as pd
+import sys, sqlite3, pandas as pd
+
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+from teevra.depth_store import has_books, latest_books, books_to_levels
 
 DB = r"C:\teevra18\data\teevra18.db"
 con = sqlite3.connect(DB)
 
-sql = """
-SELECT substr(ts_recv_utc,12,12) as t, security_id, side, level, price, qty, orders, latency_ms
-FROM depth20_levels
-ORDER BY ts_recv_utc DESC, security_id, side, level
-LIMIT 40
-"""
-df = pd.read_sql_query(sql, con)
+if has_books(con):
+    # newest full book per security, shown in the old levels layout
+    bk = latest_books(con)
+    df = pd.DataFrame(books_to_levels(bk), columns=["t", "security_id", "side", "level", "price", "qty", "orders"])
+    lat = dict(zip(bk["security_id"].tolist(), bk["latency_ms"].tolist()))
+    df["latency_ms"] = df["security_id"].map(lat)
+    df["t"] = df["t"].str.slice(11, 23)
+    df = (df.sort_values(["t", "security_id", "side", "level"], ascending=[False, True, True, True])
+            .head(40).reset_index(drop=True))
+else:
+    sql = """
+    SELECT substr(ts_recv_utc,12,12) as t, security_id, side, level, price, qty, orders, latency_ms
+    FROM depth20_levels
+    ORDER BY ts_recv_utc DESC, security_id, side, level
+    LIMIT 40
+    """
+    df = pd.read_sql_query(sql, con)
 print(df)
 con.close()
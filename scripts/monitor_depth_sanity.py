@@ -20,4 +20,11 @@ try:
 except sqlite3.OperationalError as e:
     print("Table check error:", e)
 
+try:
+    cur.execute("SELECT COUNT(*), SUM(is_key), MAX(ts_recv_utc) FROM depth20_books")
+    cnt, keys, last_ts = cur.fetchone()
+    print("depth20_books rows:", cnt, "keyframes:", keys, "latest ts:", last_ts)
+except sqlite3.OperationalError as e:
+    print("Table check error:", e)
+
 con.close()
@@ -78,12 +78,12 @@ REQUIRED = {
     "svc_depth20.py":           {"autostart": False, "args": [],              "oneshot": False},  # M3
     "svc_candles.py":           {"autostart": True,  "args": ["follow"],      "oneshot": False},  # M4
     "svc_chain_snap.py":        {"autostart": True,  "args": ["follow"],      "oneshot": False},  # M5
+    "svc_rr_builder.py":        {"autostart": True,  "args": ["follow"],      "oneshot": False},  # M8
 
     # Strategy runs once per trigger (don’t track as daemon)
     "svc_strategy_core.py":     {"autostart": True,  "args": ["generate"],    "oneshot": True},   # M7
 
     # One-shot batchers
-    "svc_rr_builder.py":        {"autostart": True,  "args": [],              "oneshot": True},   # M8
     "svc_kpi_eod.py":           {"autostart": True,  "args": [],              "oneshot": True},   # M10
 
     # Optional/manual
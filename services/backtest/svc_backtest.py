@@ -0,0 +1,427 @@
+# C:\teevra18\services\backtest\svc_backtest.py
+"""
+Event-driven backtester: replays bars through the live M7 -> M8 -> M9 chain.
+
+  M7  strategy rules from teevra.strategy_registry (same compiled evaluators as
+      svc_strategy_core), plus the M7 hard gates (SL/lot cap, min RR).
+  M8  charges-aware validation from teevra.charges (rr_profiles row, LOT_SIZE,
+      effective risk / effective RR; LONG only unless --allow-short).
+  M9  paper fill/exit rules from teevra.fill_sim (shared with m9_worker): fill
+      at the first price after the signal (next bar open) plus depth-20
+      slippage, abort on >30% slippage vs entry, SL/TP priced off the planned
+      entry, first touch along the bar's O-L-H-C / O-H-L-C path (tie -> SL),
+      TP at the barrier, SL at the touching price less slippage, round-trip charges.
+
+Bars come from candles_<tf> (instrument_id, t_start epoch s), from the
+compacted Parquet tick partitions, or from the feeder's LTP history
+(teevra.ltp_store); tick sources are rolled up to bars on load. Everything is
+held as (instruments x bars) matrices; each bar is one vectorised step over
+the whole universe, so a year of 1m bars for the ladder runs in minutes.
+
+Usage:
+  python C:\\teevra18\\services\\backtest\\svc_backtest.py --from 2025-01-01 --to 2025-12-31
+  python ...\\svc_backtest.py --strategies BO2 --source ticks --from 2025-09-01 --to 2025-09-05 --dry-run
+"""
+from common.bootstrap import init_runtime
+init_runtime()
+import os, sys, json, time, sqlite3, argparse
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(r"C:\teevra18")
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from teevra.strategy_registry import REGISTRY, LONG
+from teevra import ltp_store, fill_sim, charges
+
+DB  = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
+CFG = Path(r"C:\teevra18\configs\m7_strategy.json")
+LOCAL_TZ = os.getenv("TZ", "Asia/Kolkata")
+TICKS_DIR = Path(os.getenv("DATA_DIR", r"C:\teevra18\data")) / "parquet" / "ticks"
+
+RR_PROFILE = "BASELINE_V2"
+MAX_SLIP_PCT = 0.30          # m9_worker M9Engine.fill slippage guard
+
+FLAT, PENDING, FILLED = 0, 1, 2
+
+BACKTEST_DDL = """
+CREATE TABLE IF NOT EXISTS backtest_orders (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  run_id TEXT NOT NULL,
+  symbol TEXT NOT NULL,
+  strategy_id TEXT NOT NULL,
+  side TEXT NOT NULL CHECK (side IN ('BUY','SELL')),
+  ts_entry TEXT, ts_exit TEXT,
+  entry REAL, exit REAL,
+  qty INTEGER NOT NULL DEFAULT 1,
+  pnl REAL, rr REAL, sl REAL, tp REAL,
+  tags TEXT
+);
+"""
+
+
+# -------------------- Bar sources --------------------
+def _to_matrix(sid, t, o, h, l, c) -> dict:
+    """Long rows -> {"sid": (m,), "ts": (T,), "o"/"h"/"l"/"c": (m,T)}; missing bars are NaN."""
+    sids, si = np.unique(np.asarray(sid).astype(str), return_inverse=True)
+    ts, ti = np.unique(np.asarray(t, dtype=np.int64), return_inverse=True)
+    out = {"sid": sids.astype(object), "ts": ts}
+    for key, col in (("o", o), ("h", h), ("l", l), ("c", c)):
+        mat = np.full((len(sids), len(ts)), np.nan)
+        mat[si, ti] = np.asarray(col, dtype=np.float64)
+        out[key] = mat
+    return out
+
+def load_candles(conn, table="candles_1m", sids=None, start=None, end=None) -> dict:
+    """candles_<tf> rows in [start, end) epoch seconds, as bar matrices."""
+    where, params = [], []
+    if start is not None:
+        where.append("t_start >= ?"); params.append(int(start))
+    if end is not None:
+        where.append("t_start < ?"); params.append(int(end))
+    if sids:
+        where.append(f"instrument_id IN ({','.join('?' * len(sids))})"); params.extend(map(str, sids))
+    sql = f"SELECT instrument_id, t_start, open, high, low, close FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    df = pd.read_sql_query(sql, conn, params=params)
+    return _to_matrix(df["instrument_id"], df["t_start"], df["open"], df["high"], df["low"], df["close"])
+
+def load_tick_bars(ds_from: str, ds_to: str, sids=None, minutes=1, root=TICKS_DIR) -> dict:
+    """Compacted Parquet ticks (ds=/exchange_segment=/security_id=) rolled up to local-time bars."""
+    import pyarrow.dataset as ds
+    dset = ds.dataset(str(root), format="parquet", partitioning="hive")
+    flt = (ds.field("ds") >= ds_from) & (ds.field("ds") <= ds_to)
+    if sids:
+        flt = flt & ds.field("security_id").isin([int(s) for s in sids])
+    tbl = dset.to_table(columns=["security_id", "ts_utc", "ltp"], filter=flt & ds.field("ltp").is_valid())
+    if not tbl.num_rows:
+        return _to_matrix([], [], [], [], [], [])
+    sid = tbl.column("security_id").to_numpy()
+    t = np.array(tbl.column("ts_utc").to_pylist(), dtype="datetime64[s]").astype(np.int64)
+    px = tbl.column("ltp").to_numpy()
+    return _roll_bars(sid, t, px, minutes)
+
+def load_ltp_bars(conn, start, end, sids=None, minutes=1) -> dict:
+    """Feeder LTP history (teevra.ltp_store) rolled up to bars; option symbols map back to ids via symbol_map."""
+    sym_of = symbol_map(conn)
+    sid_of = {v: k for k, v in sym_of.items()}
+    want = [sym_of.get(str(s), str(s)) for s in sids] if sids else None
+    sym, ts, px = ltp_store.load_range(conn, want, start * 1000 if start else None, end * 1000 if end else None)
+    if not len(sym):
+        return _to_matrix([], [], [], [], [], [])
+    sid = np.array([sid_of.get(x, x) for x in sym], dtype=str)
+    return _roll_bars(sid, ts // 1000, px, minutes)
+
+def _roll_bars(sid, t, px, minutes):
+    """Long (id, epoch s, price) ticks -> local-time OHLC bar matrices."""
+    off = int(pd.Timestamp(int(t.min()), unit="s", tz="UTC").tz_convert(LOCAL_TZ).utcoffset().total_seconds())
+    step = minutes * 60
+    bucket = ((t + off) // step) * step - off
+    order = np.lexsort((t, bucket, sid))
+    sid, bucket, px = sid[order], bucket[order], px[order]
+    starts = np.flatnonzero(np.r_[True, (sid[1:] != sid[:-1]) | (bucket[1:] != bucket[:-1])])
+    ends = np.r_[starts[1:], len(px)] - 1
+    return _to_matrix(sid[starts], bucket[starts], px[starts],
+                      np.maximum.reduceat(px, starts), np.minimum.reduceat(px, starts), px[ends])
+
+def symbol_map(conn) -> dict:
+    """security_id -> tradable symbol (ltp_subscriptions overrides instrument_master)."""
+    out = {}
+    for sql in ("SELECT security_id, display_name FROM instrument_master",
+                "SELECT token, option_symbol FROM ltp_subscriptions WHERE token IS NOT NULL"):
+        try:
+            out.update({str(k).strip(): v for k, v in conn.execute(sql).fetchall() if v})
+        except sqlite3.Error:
+            pass
+    return out
+
+
+# -------------------- Engine --------------------
+def _instrument_meta(sids, symbols: dict, prof: charges.RrProfile):
+    """Per-instrument symbol, lot size and charges coefficients (prof.coeffs arrays)."""
+    sym = np.array([symbols.get(str(s), str(s)) for s in sids], dtype=object)
+    roots = [charges.infer_root(str(s)) for s in sym]
+    lot = np.array([charges.LOT_SIZE.get(r, 1) for r in roots], dtype=np.float64)
+    return sym, lot, prof.coeffs(roots)
+
+def _local_days(ts):
+    if not len(ts):
+        return np.zeros(0, dtype=np.int64)
+    d = pd.to_datetime(ts, unit="s", utc=True).tz_convert(LOCAL_TZ).normalize()
+    return pd.factorize(d)[0].astype(np.int64)
+
+def run_strategy(cs, data: dict, lot, cm_arr, prof, min_rr=2.0, max_sl_per_lot=1000.0,
+                 day_cap=None, allow_short=False, slip_pct=MAX_SLIP_PCT, slip=None) -> dict:
+    """
+    Replay one compiled strategy over bar matrices. Per bar j (all instruments at once):
+      1. PENDING orders fill at open[j] plus slippage (M9 delayed fill), or are archived
+         on slippage;
+      2. FILLED orders exit on the first SL/TP touch along the bar path (fill_sim.bar_exits);
+      3. FLAT instruments are evaluated on bars [j-N+1 .. j]; fired signals pass the
+         M7 gates and the M8 effective-RR check and become PENDING.
+    slip: (buy_pts, sell_pts) per-instrument arrays from fill_sim.SlippageModel, or None.
+    Returns closed trades as columnar arrays plus counters.
+    """
+    O, H, L, C, ts = data["o"], data["h"], data["l"], data["c"], data["ts"]
+    m, T = C.shape
+    buy_pts, sell_pts = slip if slip is not None else (np.zeros(m), np.zeros(m))
+    N = cs.bars_needed
+    state = np.zeros(m, dtype=np.int8)
+    side = np.zeros(m, dtype=np.int8)
+    entry = np.zeros(m); fill = np.zeros(m); sl = np.zeros(m); tp = np.zeros(m); rr = np.zeros(m)
+    sig_bar = np.zeros(m, dtype=np.int64); fill_bar = np.zeros(m, dtype=np.int64)
+    reason = np.zeros(m, dtype=np.int8)
+    stats = {"signals": 0, "rejected_m7": 0, "rejected_m8": 0, "slippage_aborts": 0, "day_capped": 0}
+    out = {k: [] for k in ("i", "side", "entry", "fill", "sl", "tp", "rr", "exit",
+                           "sig_bar", "fill_bar", "exit_bar", "event")}
+    if not m or T < N:
+        return _finish(out, stats)
+
+    nan_cum = np.concatenate([np.zeros((m, 1), dtype=np.int64), np.cumsum(np.isnan(C), axis=1)], axis=1)
+    days = _local_days(ts)
+    day_count = {}
+
+    def close(idx, px, j, event):
+        for k, v in (("i", idx), ("side", side[idx]), ("entry", entry[idx]), ("fill", fill[idx]),
+                     ("sl", sl[idx]), ("tp", tp[idx]), ("rr", rr[idx]), ("exit", px),
+                     ("sig_bar", sig_bar[idx]), ("fill_bar", fill_bar[idx])):
+            out[k].append(np.asarray(v))
+        out["exit_bar"].append(np.full(len(idx), j, dtype=np.int64))
+        out["event"].append(np.full(len(idx), event, dtype=object))
+        state[idx] = FLAT
+
+    for j in range(N - 1, T):
+        # 1) M9 fill: first price after the signal
+        idx = np.flatnonzero(state == PENDING)
+        if len(idx):
+            px = O[idx, j]
+            have = ~np.isnan(px)
+            idx, px = idx[have], px[have]
+            px = fill_sim.fill_price(px, side[idx], np.where(side[idx] == LONG, buy_pts[idx], sell_pts[idx]))
+            bad = np.where(side[idx] == LONG, px > entry[idx] * (1 + slip_pct), px < entry[idx] * (1 - slip_pct))
+            state[idx[bad]] = FLAT
+            stats["slippage_aborts"] += int(bad.sum())
+            ok = idx[~bad]
+            fill[ok] = px[~bad]
+            fill_bar[ok] = j
+            state[ok] = FILLED
+
+        # 2) M9 SL/TP: first touch along this bar's path (after the open on the fill bar)
+        idx = np.flatnonzero(state == FILLED)
+        if len(idx):
+            ev, px = fill_sim.bar_exits(O[idx, j], H[idx, j], L[idx, j], C[idx, j], side[idx], sl[idx], tp[idx],
+                                        np.where(side[idx] == LONG, sell_pts[idx], buy_pts[idx]),
+                                        skip_open=fill_bar[idx] == j)
+            for code in (fill_sim.SL_HIT, fill_sim.TP_HIT):
+                hit = ev == code
+                if hit.any():
+                    close(idx[hit], px[hit], j, fill_sim.EVENTS[code])
+
+        # 3) M7 evaluation on flat instruments with a full window
+        lo_j = j - N + 1
+        cand = np.flatnonzero((state == FLAT) & (nan_cum[:, j + 1] - nan_cum[:, lo_j] == 0))
+        if not len(cand):
+            continue
+        win = slice(lo_j, j + 1)
+        bars = {"o": O[cand, win], "h": H[cand, win], "l": L[cand, win], "c": C[cand, win]}
+        ns = cs.namespace(bars)
+        s = cs.evaluate(bars, ns)
+        hit = np.flatnonzero(s != 0)
+        if not len(hit):
+            continue
+        stats["signals"] += len(hit)
+        stop = cs.stops(bars, s, ns)[hit]
+        s, ii = s[hit], cand[hit]
+        e = C[ii, j]
+        sl_pts = np.maximum(1e-9, np.where(s == LONG, e - stop, stop - e))
+        tp_pts = min_rr * sl_pts
+
+        # M7 hard gates
+        ok = (sl_pts * lot[ii] <= max_sl_per_lot) & np.isfinite(stop)
+        stats["rejected_m7"] += int((~ok).sum())
+        # M8: effective risk / reward after round-trip charges (1 lot)
+        m8, _, met = charges.validate_batch(prof, e, sl_pts, tp_pts, side=s, allow_short=allow_short,
+                                            qty=lot[ii], cm=charges.take(cm_arr, ii))
+        rr_eff = met["rr_eff"]
+        stats["rejected_m8"] += int((ok & ~m8).sum())
+        ok &= m8
+        if day_cap:
+            d = int(days[j])
+            used = day_count.get(d, 0)
+            room = max(0, int(day_cap) - used)
+            keep = np.flatnonzero(ok)
+            stats["day_capped"] += max(0, len(keep) - room)
+            ok[keep[room:]] = False
+            day_count[d] = used + min(room, len(keep))
+        ii, s, e, sl_pts, tp_pts, rr_eff = ii[ok], s[ok], e[ok], sl_pts[ok], tp_pts[ok], rr_eff[ok]
+        if not len(ii):
+            continue
+
+        # M9 order: SL/TP priced off the planned entry (option premium floors at 0)
+        side[ii] = s
+        entry[ii] = e
+        sl[ii] = np.maximum(np.where(s == LONG, e - sl_pts, e + sl_pts), 0.0)
+        tp[ii] = np.maximum(np.where(s == LONG, e + tp_pts, e - tp_pts), 0.0)
+        rr[ii] = rr_eff
+        sig_bar[ii] = j
+        state[ii] = PENDING
+
+    # end of data: mark open positions to the last close, drop unfilled orders
+    idx = np.flatnonzero(state == FILLED)
+    if len(idx):
+        last = T - 1 - np.argmax(~np.isnan(C[idx, ::-1]), axis=1)
+        close(idx, C[idx, last], T - 1, "END")
+    return _finish(out, stats)
+
+def _finish(out, stats):
+    res = {k: (np.concatenate(v) if v else np.zeros(0)) for k, v in out.items()}
+    res["stats"] = stats
+    return res
+
+def trade_rows(run_id, strat_id, res, data, sym, lot, cm_arr) -> list:
+    """Closed trades -> backtest_orders dicts with M9 P&L (gross, charges, net)."""
+    if not len(res["i"]):
+        return []
+    i = res["i"].astype(np.int64)
+    qty = lot[i]
+    sgn = np.where(res["side"] == LONG, 1.0, -1.0)
+    gross = (res["exit"] - res["fill"]) * qty * sgn
+    fees = charges.roundtrip_charges(res["fill"], res["exit"], qty, charges.take(cm_arr, i), res["side"])
+    net = gross - fees
+    ts = data["ts"]
+    fmt = lambda k: pd.to_datetime(ts[res[k].astype(np.int64)], unit="s").strftime("%Y-%m-%d %H:%M:%S")
+    t_sig, t_fill, t_exit = fmt("sig_bar"), fmt("fill_bar"), fmt("exit_bar")
+    rows = []
+    for k in range(len(i)):
+        po_side = "BUY" if res["side"][k] == LONG else "SELL"
+        rows.append({
+            "run_id": run_id, "symbol": sym[i[k]], "strategy_id": strat_id, "side": po_side,
+            "ts_entry": t_fill[k], "ts_exit": t_exit[k], "ts": t_fill[k],
+            "entry": float(res["fill"][k]), "price": float(res["fill"][k]), "exit": float(res["exit"][k]),
+            "qty": int(qty[k]), "pnl": float(net[k]), "rr": float(res["rr"][k]),
+            "sl": float(res["sl"][k]), "tp": float(res["tp"][k]), "notes": res["event"][k],
+            "tags": json.dumps({"event": res["event"][k], "security_id": str(data["sid"][i[k]]),
+                                "ts_signal": t_sig[k], "planned_entry": float(res["entry"][k]),
+                                "pnl_gross": round(float(gross[k]), 2), "charges": round(float(fees[k]), 2)}),
+        })
+    return rows
+
+def write_orders(conn, rows: list) -> int:
+    """Insert into whichever backtest_orders layout exists (init_db or ensure_backtest_table)."""
+    conn.execute(BACKTEST_DDL)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(backtest_orders)").fetchall() if r[1] != "id"]
+    cols = [c for c in cols if rows and c in rows[0]]
+    if not rows or not cols:
+        return 0
+    conn.executemany(f"INSERT INTO backtest_orders({','.join(cols)}) VALUES({','.join('?' * len(cols))})",
+                     [tuple(r[c] for c in cols) for r in rows])
+    return len(rows)
+
+def new_run_id(conn, params: dict):
+    """runs.id when the runs table exists (kind='backtest'), else a timestamp label."""
+    try:
+        cur = conn.execute("INSERT INTO runs(kind, status, params_json, notes) VALUES('backtest','running',?,?)",
+                           (json.dumps(params), "svc_backtest"))
+        return cur.lastrowid
+    except sqlite3.Error:
+        return datetime.now(timezone.utc).strftime("BT-%Y%m%d-%H%M%S")
+
+def summarise(rows: list) -> dict:
+    pnl = np.array([r["pnl"] for r in rows], dtype=np.float64)
+    if not len(pnl):
+        return {"trades": 0, "net": 0.0, "win_rate": 0.0, "max_dd": 0.0}
+    eq = np.cumsum(pnl)
+    return {"trades": int(len(pnl)), "net": round(float(pnl.sum()), 2),
+            "win_rate": round(float((pnl > 0).mean()), 4),
+            "max_dd": round(float((np.maximum.accumulate(np.r_[0.0, eq]) - np.r_[0.0, eq]).max()), 2)}
+
+
+# -------------------- Main --------------------
+def _epoch(day: str):
+    return int(pd.Timestamp(day, tz=LOCAL_TZ).tz_convert("UTC").timestamp()) if day else None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=str(DB))
+    ap.add_argument("--strategies", default=None, help="comma list; default = enabled ids in m7_strategy.json")
+    ap.add_argument("--source", choices=["candles", "ticks", "ltp"], default="candles")
+    ap.add_argument("--tf", default="1m", help="candles table suffix / tick bar size (1m,5m,15m,60m)")
+    ap.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD (local)")
+    ap.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD (local, inclusive)")
+    ap.add_argument("--sids", default=None, help="comma list of instrument ids")
+    ap.add_argument("--profile", default=RR_PROFILE)
+    ap.add_argument("--allow-short", action="store_true", help="M8 v2 rejects SHORT; allow it here")
+    ap.add_argument("--no-depth-slip", action="store_true", help="fill at the tape price (no depth-20 slippage)")
+    ap.add_argument("--dry-run", action="store_true", help="print KPIs, do not write backtest_orders")
+    args = ap.parse_args()
+
+    cfg = json.loads(CFG.read_text(encoding="utf-8-sig")) if CFG.exists() else {}
+    risk = cfg.get("risk", {})
+    min_rr = float(risk.get("min_rr", 2.0))
+    max_sl = float(risk.get("max_sl_per_lot", 1000.0))
+    day_cap = risk.get("max_trades_per_day")
+    groups_cfg = cfg.get("groups", [])
+    REGISTRY.load_config(groups_cfg)
+
+    sids = [s.strip() for s in args.sids.split(",")] if args.sids else None
+    start = _epoch(args.date_from)
+    end = _epoch(args.date_to) + 86400
+
+    with sqlite3.connect(args.db) as conn:
+        REGISTRY.load_catalog(conn)
+        if args.strategies:
+            ids = [s.strip() for s in args.strategies.split(",") if s.strip()]
+        else:
+            ids = [st.get("id", "NA") for grp in groups_cfg if grp.get("enabled", True)
+                   for st in grp.get("strategies", []) if st.get("enabled", True)]
+        strategies = [(i, REGISTRY.get(i)) for i in ids]
+        for i, cs in strategies:
+            if cs is None:
+                print(f"[WARN] strategy {i} not registered; skipped")
+        strategies = [(i, cs) for i, cs in strategies if cs is not None]
+
+        t0 = time.perf_counter()
+        if args.source == "ticks":
+            data = load_tick_bars(args.date_from, args.date_to, sids, minutes=int(args.tf.rstrip("m")))
+        elif args.source == "ltp":
+            data = load_ltp_bars(conn, start, end, sids, minutes=int(args.tf.rstrip("m")))
+        else:
+            data = load_candles(conn, f"candles_{args.tf}", sids, start, end)
+        m, T = data["c"].shape
+        print(f"[OK] loaded {m} instruments x {T} bars from {args.source} in {time.perf_counter() - t0:.1f}s")
+
+        prof = charges.load_profile_or_default(conn, args.profile)
+        sym, lot, cm_arr = _instrument_meta(data["sid"], symbol_map(conn), prof)
+        slip = None
+        if not args.no_depth_slip:
+            sm = fill_sim.SlippageModel.load(conn, dict(zip(sym, data["sid"])))
+            slip = (sm.points(list(sym), lot, True), sm.points(list(sym), lot, False))
+        params = {"strategies": [i for i, _ in strategies], "source": args.source, "tf": args.tf,
+                  "from": args.date_from, "to": args.date_to, "sids": sids, "profile": args.profile,
+                  "allow_short": args.allow_short, "depth_slip": not args.no_depth_slip}
+        run_id = None if args.dry_run else new_run_id(conn, params)
+
+        total = 0
+        for strat_id, cs in strategies:
+            t1 = time.perf_counter()
+            res = run_strategy(cs, data, lot, cm_arr, prof, min_rr, max_sl, day_cap, args.allow_short, slip=slip)
+            rows = trade_rows(run_id, strat_id, res, data, sym, lot, cm_arr)
+            k = summarise(rows)
+            print(f"[OK] {strat_id}: trades={k['trades']} net={k['net']:.2f} win={k['win_rate']:.2%} "
+                  f"maxDD={k['max_dd']:.2f} | {res['stats']} | {time.perf_counter() - t1:.1f}s")
+            if not args.dry_run:
+                total += write_orders(conn, rows)
+        if not args.dry_run:
+            try:
+                conn.execute("UPDATE runs SET status='done', ended_at=datetime('now') WHERE id=?", (run_id,))
+            except sqlite3.Error:
+                pass
+            conn.commit()
+            print(f"[OK] run {run_id}: wrote {total} backtest_orders rows")
+
+if __name__ == "__main__":
+    main()
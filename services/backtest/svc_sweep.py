@@ -0,0 +1,307 @@
+# C:\teevra18\services\backtest\svc_sweep.py
+"""
+Parameter sweep over a strategy config, fanned out across a process pool.
+
+The base strategy comes from the config's params (strategy_params via
+core.config_store): "strategy_id" names a registry strategy, or a "rules"
+block makes one (see teevra.strategy_registry.spec_from_lab). Each grid
+combination is applied on top of the base params:
+
+  <input name>=N          sets that input's length (e.g. ema_fast=9)
+  inputs.<name>.<field>=V dotted path into the spec
+  rr_min / sl_max_per_lot / max_trades_per_day   M7 gate overrides
+  anything else numeric   becomes a constant usable in the rules (e.g. rsi_buy=40)
+
+Bars are loaded once by the parent and saved as .npy under
+data\\cache\\sweep\\<sweep_id>; every worker memory-maps them in its
+initializer instead of re-reading SQLite. One KPI row per combination is
+upserted into kpi_sweep, which carries the kpi_daily columns (trade_date='ALL')
+plus sweep_id / combo_id / params_json.
+
+Usage:
+  python C:\\teevra18\\services\\backtest\\svc_sweep.py --config-id 3 --from 2025-01-01 --to 2025-12-31 ^
+         --grid ema_fast=5:13:2 --grid ema_slow=21,34,55 --grid rr_min=1.5,2.0 --workers 8
+"""
+from common.bootstrap import init_runtime
+init_runtime()
+import os, json, time, shutil, sqlite3, argparse, itertools
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from svc_backtest import (DB, CFG, RR_PROFILE, REGISTRY, load_candles, load_tick_bars,
+                          symbol_map, _instrument_meta, _epoch, run_strategy)
+from core.config_store import ConfigStore
+from teevra.strategy_registry import compile_spec, spec_from_lab, LONG
+from teevra import charges
+
+CACHE_DIR = Path(os.getenv("DATA_DIR", r"C:\teevra18\data")) / "cache" / "sweep"
+GATE_KEYS = ("rr_min", "sl_max_per_lot", "max_trades_per_day")
+
+KPI_SWEEP_DDL = """
+CREATE TABLE IF NOT EXISTS kpi_sweep (
+  sweep_id TEXT NOT NULL,
+  combo_id INTEGER NOT NULL,
+  config_id INTEGER,
+  params_json TEXT,
+  trade_date TEXT NOT NULL,
+  group_name TEXT NOT NULL,
+  strategy_id TEXT NOT NULL,
+  trades_total INTEGER,
+  wins INTEGER,
+  losses INTEGER,
+  win_rate REAL,
+  avg_rr REAL,
+  gross_pnl REAL,
+  fees REAL,
+  net_pnl REAL,
+  max_drawdown REAL,
+  avg_trade_duration_sec REAL,
+  kpi_json TEXT,
+  created_at_utc TEXT NOT NULL,
+  PRIMARY KEY (sweep_id, combo_id)
+);
+"""
+
+
+# -------------------- Grid / spec --------------------
+def _num(v: str):
+    v = v.strip()
+    try:
+        return int(v)
+    except ValueError:
+        return float(v)
+
+def parse_grid(items) -> dict:
+    """["k=a:b:step", "k=v1,v2"] -> {k: [values]}; ranges are inclusive."""
+    grid = {}
+    for item in items or []:
+        key, _, rhs = item.partition("=")
+        if not rhs:
+            raise ValueError(f"bad --grid '{item}' (want key=start:stop:step or key=v1,v2)")
+        if ":" in rhs:
+            a, b, *s = [_num(x) for x in rhs.split(":")]
+            step = s[0] if s else 1
+            vals = list(np.arange(a, b + step / 2.0, step))
+            vals = [int(x) if all(isinstance(y, int) for y in (a, b, step)) else round(float(x), 10) for x in vals]
+        else:
+            vals = [_num(x) for x in rhs.split(",") if x.strip()]
+        grid[key.strip()] = vals
+    return grid
+
+def expand(grid: dict) -> list:
+    keys = list(grid)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(grid[k] for k in keys))]
+
+def apply_params(spec: dict, params: dict) -> dict:
+    """Overlay scalar params on a registry spec (see module docstring)."""
+    spec = json.loads(json.dumps(spec))
+    inputs = spec.setdefault("inputs", {})
+    consts = {}
+    for k, v in params.items():
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or k in GATE_KEYS:
+            continue
+        if "." in k:
+            node, *path, leaf = k.split(".")
+            cur = spec.setdefault(node, {})
+            for p in path:
+                cur = cur.setdefault(p, {})
+            cur[leaf] = v
+        elif k in inputs:
+            inputs[k]["length"] = int(v)
+        else:
+            consts[k] = repr(v)
+    if consts:
+        spec["vars"] = {**consts, **{k: e for k, e in (spec.get("vars") or {}).items() if k not in consts}}
+    return spec
+
+def base_spec(params: dict, strategy_id: str = None):
+    """(strategy id, spec) from --strategy, params["strategy_id"] or a Lab "rules" block."""
+    sid = strategy_id or params.get("strategy_id")
+    if sid:
+        spec = REGISTRY.specs.get(str(sid))
+        if spec is None:
+            raise RuntimeError(f"strategy '{sid}' is not registered (builtins, m7_strategy.json, strategies_catalog)")
+        return str(sid), spec
+    spec = spec_from_lab({k: v for k, v in params.items() if isinstance(v, dict)})   # scalars are overlays
+    if not spec:
+        raise RuntimeError("config has neither strategy_id nor a rules block; pass --strategy")
+    return "CFG", spec
+
+
+# -------------------- KPIs --------------------
+def trade_kpis(res: dict, ts, lot, cm_arr) -> dict:
+    """kpi_daily-style aggregates for one run_strategy() result."""
+    i = res["i"].astype(np.int64)
+    n = len(i)
+    if not n:
+        return {"trades_total": 0, "wins": 0, "losses": 0, "win_rate": 0.0, "avg_rr": None, "gross_pnl": 0.0,
+                "fees": 0.0, "net_pnl": 0.0, "max_drawdown": 0.0, "avg_trade_duration_sec": 0.0,
+                "profit_factor": 0.0, "expectancy": 0.0, "sharpe_daily": 0.0}
+    qty = lot[i]
+    sgn = np.where(res["side"] == LONG, 1.0, -1.0)
+    gross = (res["exit"] - res["fill"]) * qty * sgn
+    fees = charges.roundtrip_charges(res["fill"], res["exit"], qty, charges.take(cm_arr, i), res["side"])
+    net = gross - fees
+    t_exit = ts[res["exit_bar"].astype(np.int64)]
+    t_fill = ts[res["fill_bar"].astype(np.int64)]
+    order = np.argsort(t_exit, kind="stable")
+    eq = np.cumsum(net[order])
+    gp, gl = float(net[net > 0].sum()), float(net[net <= 0].sum())
+    daily = pd.Series(net[order]).groupby(t_exit[order] // 86400).sum()
+    sd = float(daily.std()) if len(daily) > 1 else 0.0
+    wins = int((net > 0).sum())
+    return {
+        "trades_total": int(n), "wins": wins, "losses": int(n - wins),
+        "win_rate": wins / n, "avg_rr": float(np.mean(res["rr"])),
+        "gross_pnl": float(gross.sum()), "fees": float(fees.sum()), "net_pnl": float(net.sum()),
+        "max_drawdown": float((eq - np.maximum.accumulate(eq)).min()),   # same sign as svc_kpi_eod
+        "avg_trade_duration_sec": float((t_exit - t_fill).mean()),
+        "profit_factor": gp / abs(gl) if gl < 0 else (float("inf") if gp > 0 else 0.0),
+        "expectancy": float(net.mean()),
+        "sharpe_daily": float(daily.mean() / sd * np.sqrt(252)) if sd > 0 else 0.0,
+    }
+
+
+# -------------------- Worker --------------------
+_W = {}
+
+def _init_worker(cache_dir: str, lot, cm_arr, prof, gates, allow_short):
+    d = Path(cache_dir)
+    _W["data"] = {k: np.load(d / f"{k}.npy", mmap_mode="r") for k in ("o", "h", "l", "c")}
+    _W["data"]["ts"] = np.load(d / "ts.npy")
+    _W.update(lot=lot, cm_arr=cm_arr, prof=prof, gates=gates, allow_short=allow_short)
+
+def _run_combo(task):
+    combo_id, strategy_id, spec, params = task
+    g = {**_W["gates"], **{k: v for k, v in params.items() if k in GATE_KEYS}}
+    t0 = time.perf_counter()
+    try:
+        cs = compile_spec(f"{strategy_id}#{combo_id}", apply_params(spec, params))
+        res = run_strategy(cs, _W["data"], _W["lot"], _W["cm_arr"], _W["prof"], float(g["rr_min"]),
+                           float(g["sl_max_per_lot"]), g.get("max_trades_per_day"), _W["allow_short"])
+        k = trade_kpis(res, _W["data"]["ts"], _W["lot"], _W["cm_arr"])
+        k["stats"] = res["stats"]
+    except Exception as e:
+        k = {"error": repr(e)}
+    k["secs"] = round(time.perf_counter() - t0, 3)
+    return combo_id, params, k
+
+
+# -------------------- Parent --------------------
+def cache_bars(data: dict, sweep_id: str) -> Path:
+    d = CACHE_DIR / sweep_id
+    d.mkdir(parents=True, exist_ok=True)
+    for k in ("o", "h", "l", "c", "ts"):
+        np.save(d / f"{k}.npy", np.ascontiguousarray(data[k]))
+    return d
+
+def kpi_row(sweep_id, config_id, strategy_id, combo_id, params, k, date_from, date_to) -> dict:
+    extra = {x: k.get(x) for x in ("profit_factor", "expectancy", "sharpe_daily", "stats", "secs", "error") if x in k}
+    return {
+        "sweep_id": sweep_id, "combo_id": combo_id, "config_id": config_id,
+        "params_json": json.dumps(params, sort_keys=True),
+        "trade_date": "ALL", "group_name": f"SWEEP:{sweep_id}", "strategy_id": strategy_id,
+        **{c: k.get(c) for c in ("trades_total", "wins", "losses", "win_rate", "avg_rr", "gross_pnl",
+                                 "fees", "net_pnl", "max_drawdown", "avg_trade_duration_sec")},
+        "kpi_json": json.dumps({"from": date_from, "to": date_to, **extra}, default=str),
+        "created_at_utc": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+def upsert_kpis(conn, rows: list):
+    if not rows:
+        return
+    cols = list(rows[0])
+    upd = ",".join(f"{c}=excluded.{c}" for c in cols if c not in ("sweep_id", "combo_id"))
+    conn.executemany(f"INSERT INTO kpi_sweep({','.join(cols)}) VALUES({','.join('?' * len(cols))}) "
+                     f"ON CONFLICT(sweep_id, combo_id) DO UPDATE SET {upd}",
+                     [tuple(r[c] for c in cols) for r in rows])
+    conn.commit()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=str(DB))
+    ap.add_argument("--config-id", type=int, required=True, help="strategy_configs.id (params via ConfigStore)")
+    ap.add_argument("--strategy", default=None, help="registry id; default params['strategy_id'] or rules block")
+    ap.add_argument("--grid", action="append", default=[], help="key=start:stop:step or key=v1,v2 (repeatable)")
+    ap.add_argument("--source", choices=["candles", "ticks"], default="candles")
+    ap.add_argument("--tf", default="1m")
+    ap.add_argument("--from", dest="date_from", required=True)
+    ap.add_argument("--to", dest="date_to", required=True)
+    ap.add_argument("--sids", default=None)
+    ap.add_argument("--profile", default=RR_PROFILE)
+    ap.add_argument("--allow-short", action="store_true")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--top", type=int, default=10, help="print the best N combinations by net_pnl")
+    ap.add_argument("--keep-cache", action="store_true", help="keep the memory-mapped bar files")
+    args = ap.parse_args()
+
+    bundle = ConfigStore(args.db).get_config_bundle(args.config_id)
+    params0 = bundle["params"]
+    pol = bundle.get("policies") or {}
+    cfg = json.loads(CFG.read_text(encoding="utf-8-sig")) if CFG.exists() else {}
+    risk = cfg.get("risk", {})
+    REGISTRY.load_config(cfg.get("groups", []))
+    gates = {"rr_min": float(pol.get("rr_min") or risk.get("min_rr", 2.0)),
+             "sl_max_per_lot": float(pol.get("sl_max_per_lot") or risk.get("max_sl_per_lot", 1000.0)),
+             "max_trades_per_day": pol.get("max_trades_per_day") or risk.get("max_trades_per_day")}
+    gates.update({k: v for k, v in params0.items() if k in GATE_KEYS})
+
+    grid = parse_grid(args.grid)
+    combos = [{**params0, **c} for c in expand(grid)] if grid else [dict(params0)]
+    sids = [s.strip() for s in args.sids.split(",")] if args.sids else None
+    sweep_id = f"SW{args.config_id}-{dt.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+    with sqlite3.connect(args.db) as conn:
+        conn.execute(KPI_SWEEP_DDL)
+        REGISTRY.load_catalog(conn)
+        strategy_id, spec = base_spec(params0, args.strategy)
+        for c in combos[:1]:
+            compile_spec(strategy_id, apply_params(spec, c))   # fail fast on a bad spec/param
+
+        t0 = time.perf_counter()
+        if args.source == "ticks":
+            data = load_tick_bars(args.date_from, args.date_to, sids, minutes=int(args.tf.rstrip("m")))
+        else:
+            data = load_candles(conn, f"candles_{args.tf}", sids, _epoch(args.date_from), _epoch(args.date_to) + 86400)
+        prof = charges.load_profile_or_default(conn, args.profile)
+        _, lot, cm_arr = _instrument_meta(data["sid"], symbol_map(conn), prof)
+        cache = cache_bars(data, sweep_id)
+        m, T = data["c"].shape
+        del data
+        print(f"[OK] {sweep_id}: {len(combos)} combos x {m} instruments x {T} bars; "
+              f"bars cached in {time.perf_counter() - t0:.1f}s -> {cache}")
+
+        tasks = [(n, strategy_id, spec, c) for n, c in enumerate(combos)]
+        chunk = max(1, len(tasks) // (max(1, args.workers) * 4))
+        rows, done, t1 = [], 0, time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                     initargs=(str(cache), lot, cm_arr, prof, gates, args.allow_short)) as ex:
+                for combo_id, params, k in ex.map(_run_combo, tasks, chunksize=chunk):
+                    if "error" in k:
+                        print(f"[WARN] combo {combo_id} {params}: {k['error']}")
+                    rows.append(kpi_row(sweep_id, args.config_id, strategy_id, combo_id, params, k,
+                                        args.date_from, args.date_to))
+                    done += 1
+                    if len(rows) >= 200:
+                        upsert_kpis(conn, rows); rows = []
+                        print(f"[..] {done}/{len(tasks)} combos, {time.perf_counter() - t1:.0f}s")
+            upsert_kpis(conn, rows)
+        finally:
+            if not args.keep_cache:
+                shutil.rmtree(cache, ignore_errors=True)
+        print(f"[OK] {sweep_id}: {done} combos in {time.perf_counter() - t1:.1f}s -> kpi_sweep")
+
+        best = conn.execute("""
+            SELECT combo_id, params_json, trades_total, win_rate, net_pnl, max_drawdown
+            FROM kpi_sweep WHERE sweep_id=? ORDER BY net_pnl DESC LIMIT ?
+        """, (sweep_id, args.top)).fetchall()
+        for cid, pj, n, wr, net, mdd in best:
+            p = {k: v for k, v in json.loads(pj).items() if k in grid}
+            print(f"  #{cid:<5} net={net or 0:>12.2f} trades={n or 0:<6} win={(wr or 0):.1%} mdd={mdd or 0:.2f} {p}")
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ init_runtime()
 import os, argparse, sqlite3
 from pathlib import Path
 import pandas as pd
+from teevra.candles_latest import ensure_schema as ensure_latest_schema, refresh_latest
 
 try:
     from dotenv import load_dotenv
@@ -71,6 +72,8 @@ def ensure_schema(con: sqlite3.Connection):
         if has_col(table, "t_start"):
             con.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_t ON {table}(t_start);")
 
+    ensure_latest_schema(con)
+
     con.execute("""
     CREATE TABLE IF NOT EXISTS candles_checkpoint (
         key TEXT PRIMARY KEY,
@@ -134,14 +137,26 @@ def upsert_candles(con: sqlite3.Connection, df: pd.DataFrame, tf_table: str):
     """
     cur = con.cursor()
     cur.executemany(q, rows)
-    return cur.rowcount
+    n = cur.rowcount
+    refresh_latest(con, tf_table.split("_", 1)[1], rows)
+    return n
 
 def rollup_minutes(con: sqlite3.Connection, df_ticks: pd.DataFrame):
     spec = {"1m":1, "5m":5, "15m":15, "60m":60}
     counts = {}
-    for tf, mins in spec.items():
-        dfc = aggregate_to_candles(df_ticks, mins)
-        counts[tf] = upsert_candles(con, dfc, f"candles_{tf}")
+    own_txn = not con.in_transaction
+    if own_txn:
+        con.execute("BEGIN")   # candles_<tf> + candles_latest land together
+    try:
+        for tf, mins in spec.items():
+            dfc = aggregate_to_candles(df_ticks, mins)
+            counts[tf] = upsert_candles(con, dfc, f"candles_{tf}")
+        if own_txn:
+            con.execute("COMMIT")
+    except Exception:
+        if own_txn:
+            con.execute("ROLLBACK")
+        raise
     return counts
 
 def get_ticks_iter(con, where_sql="", params=()):
@@ -184,27 +199,212 @@ def set_ck(con, key, value):
     ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=datetime('now')
     """, (key, str(int(value))))
 
+# ---- Incremental follow state ------------------------------------------------
+DERIVED_TF   = (("5m", 5), ("15m", 15), ("60m", 60))
+CLOSE_GRACE_MS = int(os.getenv("CANDLE_CLOSE_GRACE_MS", "2000"))
+
+_tz_cache = {}
+def _local_offset_s(ts_s: int) -> int:
+    # utc offset of LOCAL_TZ, cached per UTC hour (IST is fixed, but stay tz-correct)
+    hour = ts_s // 3600
+    off = _tz_cache.get(hour)
+    if off is None:
+        from datetime import datetime, timezone
+        from zoneinfo import ZoneInfo
+        dt = datetime.fromtimestamp(hour * 3600, tz=timezone.utc).astimezone(ZoneInfo(LOCAL_TZ))
+        off = int(dt.utcoffset().total_seconds())
+        if len(_tz_cache) > 4096:
+            _tz_cache.clear()
+        _tz_cache[hour] = off
+    return off
+
+def bucket_start(ts_s: int, minutes: int) -> int:
+    """Scalar twin of floor_to_bucket(): local-time floor, returned as UTC epoch seconds."""
+    off = _local_offset_s(ts_s)
+    step = minutes * 60
+    return ((ts_s + off) // step) * step - off
+
+class _Bar:
+    __slots__ = ("t_start", "open", "high", "low", "close", "volume", "trades", "pv")
+
+    def __init__(self, t_start, o, h, l, c, v, n, pv):
+        self.t_start = t_start
+        self.open, self.high, self.low, self.close = o, h, l, c
+        self.volume, self.trades, self.pv = v, n, pv
+
+    def fold(self, o, h, l, c, v, n, pv):
+        # merge a later partial/closed bar of the same bucket into this one
+        if h > self.high: self.high = h
+        if l < self.low:  self.low = l
+        self.close = c
+        self.volume += v; self.trades += n; self.pv += pv
+
+    def row(self, instrument_id, t_start=None):
+        vwap = (self.pv / self.volume) if self.volume else None
+        return (instrument_id, self.t_start if t_start is None else t_start,
+                self.open, self.high, self.low, self.close, self.volume, self.trades, vwap)
+
+class CandleAggregator:
+    """
+    In-memory OHLCV/VWAP state for follow mode.
+
+    Only the open 1m bar per instrument is touched by new ticks. When a 1m bar
+    closes it is emitted once and folded into the open 5m/15m/60m bars, which
+    are in turn emitted once when their bucket rolls over. A bar closes either
+    when the instrument trades in a later bucket or when the tick watermark
+    passes the bucket end (+ CANDLE_CLOSE_GRACE_MS), so quiet instruments flush too.
+    """
+
+    def __init__(self):
+        self.open_1m = {}                             # instrument_id -> _Bar
+        self.open_tf = {tf: {} for tf, _ in DERIVED_TF}  # tf -> instrument_id -> _Bar
+        self.closed = {tf: [] for tf in ("1m",) + tuple(tf for tf, _ in DERIVED_TF)}
+        self.dirty = set()                            # instruments with an updated open bar
+        self.watermark_ms = 0
+
+    # -- ingestion -------------------------------------------------------------
+    def add_ticks(self, df_ticks: pd.DataFrame):
+        """Fold a batch of new ticks (any order) into state; O(len(df_ticks))."""
+        if df_ticks.empty:
+            return
+        self.watermark_ms = max(self.watermark_ms, int(df_ticks["ts_event_ms"].max()))
+        # one vectorised pass turns the batch into partial 1m bars, then fold per bar
+        part = aggregate_to_candles(df_ticks, 1).sort_values(["instrument_id", "t_start"])
+        for iid, t0, o, h, l, c, v, n, vwap in part.itertuples(index=False, name=None):
+            t0 = int(t0); v = float(v); n = int(n)
+            pv = float(vwap) * v if v else 0.0
+            bar = self.open_1m.get(iid)
+            if bar is not None and t0 < bar.t_start:
+                continue  # late tick for an already-emitted bucket
+            if bar is not None and t0 > bar.t_start:
+                self._close_1m(iid, bar)
+                bar = None
+            if bar is None:
+                self.open_1m[iid] = _Bar(t0, float(o), float(h), float(l), float(c), v, n, pv)
+            else:
+                bar.fold(float(o), float(h), float(l), float(c), v, n, pv)
+            self.dirty.add(iid)
+        self._close_by_watermark()
+
+    def _close_1m(self, iid, bar: _Bar):
+        self.closed["1m"].append(bar.row(iid))
+        for tf, mins in DERIVED_TF:
+            t_tf = bucket_start(bar.t_start, mins)
+            cur = self.open_tf[tf].get(iid)
+            if cur is not None and cur.t_start != t_tf:
+                self.closed[tf].append(cur.row(iid))
+                cur = None
+            if cur is None:
+                self.open_tf[tf][iid] = _Bar(t_tf, bar.open, bar.high, bar.low, bar.close,
+                                             bar.volume, bar.trades, bar.pv)
+            else:
+                cur.fold(bar.open, bar.high, bar.low, bar.close, bar.volume, bar.trades, bar.pv)
+
+    def _close_by_watermark(self):
+        cutoff_s = (self.watermark_ms - CLOSE_GRACE_MS) // 1000
+        for iid in [k for k, b in self.open_1m.items() if b.t_start + 60 <= cutoff_s]:
+            self._close_1m(iid, self.open_1m.pop(iid))
+        for tf, mins in DERIVED_TF:
+            book = self.open_tf[tf]
+            for iid in [k for k, b in book.items() if b.t_start + mins * 60 <= cutoff_s]:
+                if iid in self.open_1m and bucket_start(self.open_1m[iid].t_start, mins) == book[iid].t_start:
+                    continue  # its last 1m bar is still forming
+                self.closed[tf].append(book.pop(iid).row(iid))
+
+    # -- output ----------------------------------------------------------------
+    def _open_rows(self):
+        """Current forming bars for instruments touched since the last drain."""
+        out = {tf: [] for tf in self.closed}
+        for iid in self.dirty:
+            b1 = self.open_1m.get(iid)
+            if b1 is None:
+                # 1m bar closed on the watermark; refresh the derived bars it was folded into
+                for tf, _ in DERIVED_TF:
+                    acc = self.open_tf[tf].get(iid)
+                    if acc is not None:
+                        out[tf].append(acc.row(iid))
+                continue
+            out["1m"].append(b1.row(iid))
+            for tf, mins in DERIVED_TF:
+                t_tf = bucket_start(b1.t_start, mins)
+                acc = self.open_tf[tf].get(iid)
+                if acc is not None and acc.t_start == t_tf:
+                    m = _Bar(acc.t_start, acc.open, acc.high, acc.low, acc.close,
+                             acc.volume, acc.trades, acc.pv)
+                    m.fold(b1.open, b1.high, b1.low, b1.close, b1.volume, b1.trades, b1.pv)
+                    out[tf].append(m.row(iid))
+                else:
+                    out[tf].append(b1.row(iid, t_start=t_tf))
+        return out
+
+    def drain(self, include_open=True):
+        """Return {tf: [rows]} to UPSERT: closed bars once, plus dirty forming bars."""
+        out = {tf: rows for tf, rows in self.closed.items()}
+        self.closed = {tf: [] for tf in out}
+        if include_open:
+            for tf, rows in self._open_rows().items():
+                out[tf] = out[tf] + rows
+        self.dirty.clear()
+        return out
+
+_UPSERT_SQL = """
+    INSERT INTO {table}
+        (instrument_id, t_start, open, high, low, close, volume, trades, vwap)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(instrument_id, t_start) DO UPDATE SET
+        open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close,
+        volume=excluded.volume, trades=excluded.trades, vwap=excluded.vwap;
+"""
+
+def write_rows(con: sqlite3.Connection, rows_by_tf: dict):
+    counts = {}
+    for tf, rows in rows_by_tf.items():
+        if rows:
+            con.executemany(_UPSERT_SQL.format(table=f"candles_{tf}"), rows)
+            refresh_latest(con, tf, rows)
+        counts[tf] = len(rows)
+    return counts
+
 def follow(con: sqlite3.Connection, poll_ms=1500, lookback_ms=600000):
     import time as _t
     key = "candles_last_ts"
     last = get_ck(con, key)
+    if last is not None:
+        # warm start: replay from the open 60m bucket so every forming bar is complete
+        last = bucket_start(last // 1000, 60) * 1000
+    agg = CandleAggregator()
+    seen_at_last = 0   # rows at ts == last already applied (view timestamps are 1s-granular)
     while True:
         try:
             if last is None:
                 m = con.execute("SELECT MAX(ts_event_ms) FROM ticks_for_candles").fetchone()[0]
                 if m is None:
                     _t.sleep(poll_ms/1000); continue
-                last = max(0, int(m) - lookback_ms)
+                last = bucket_start(max(0, int(m) - lookback_ms) // 1000, 60) * 1000
             rows = con.execute("""
                 SELECT instrument_id, ts_event_ms, price, qty
                 FROM ticks_for_candles WHERE ts_event_ms >= ?
                 ORDER BY ts_event_ms ASC
             """, (last,)).fetchall()
+            skip = 0
+            while skip < len(rows) and skip < seen_at_last and rows[skip][1] == last:
+                skip += 1
+            rows = rows[skip:]
             if rows:
                 df = pd.DataFrame(rows, columns=["instrument_id","ts_event_ms","price","qty"])
-                rollup_minutes(con, df)
-                last = int(df["ts_event_ms"].max())
-                set_ck(con, key, last)
+                agg.add_ticks(df)
+                new_last = int(rows[-1][1])
+                tail = sum(1 for r in rows if r[1] == new_last)
+                seen_at_last = (seen_at_last + tail) if new_last == last else tail
+                last = new_last
+                con.execute("BEGIN")
+                try:
+                    write_rows(con, agg.drain())
+                    set_ck(con, key, last)
+                    con.execute("COMMIT")
+                except Exception:
+                    con.execute("ROLLBACK")
+                    raise
             _t.sleep(poll_ms/1000)
         except KeyboardInterrupt:
             print("Stopped."); break
@@ -1,8 +1,12 @@
 ﻿from common.bootstrap import init_runtime
 init_runtime()
-import os, sys, json, time, sqlite3, argparse, datetime as dt
+import os, sys, json, time, sqlite3, argparse, asyncio, threading, datetime as dt
 from pathlib import Path
+from zoneinfo import ZoneInfo
+import numpy as np
 import requests
+from teevra import chain_store
+from teevra.greeks import fill_missing, year_fraction
 
 DB_PATH = Path(os.getenv('DB_PATH', r'C:\teevra18\data\teevra18.db'))
 CONF_PATH = Path(r'C:\teevra18\config\underlyings_chain.json')
@@ -15,7 +19,16 @@ HDR = {'Content-Type':'application/json'}
 if CID and TOK:
     HDR.update({'client-id':CID, 'access-token':TOK})
 
-RATE_GAP = 3.2  # >= 3 seconds per API
+RATE_GAP = float(os.getenv('CHAIN_RATE_GAP', '3.2'))   # >= 3 seconds per API
+RATE_BURST = int(os.getenv('CHAIN_RATE_BURST', '1'))
+RETRY_429 = int(os.getenv('CHAIN_RETRY_429', '2'))
+IST = ZoneInfo('Asia/Kolkata')
+
+# change-only persistence (teevra.chain_store): CHAIN_DELTA=0 writes every leg every cycle
+DELTA_FILTER = chain_store.ChainDeltaFilter()
+KEEP_JSON = os.getenv('CHAIN_KEEP_JSON', '0') == '1'
+# solve IV / greeks for legs the broker sent as 0/null (teevra.greeks); broker values are kept
+FILL_GREEKS = os.getenv('CHAIN_FILL_GREEKS', '1') == '1'
 
 def u(s): return (s or '').strip().upper()
 
@@ -42,11 +55,78 @@ def get_underlyings(group, cfg):
             if und and sid: out.append((und, int(sid), seg))
     return out
 
-def expirylist(secid, seg):
-    url = f'{BASE}/v2/optionchain/expirylist'
-    r = requests.post(url, headers=HDR, json={'UnderlyingScrip': secid, 'UnderlyingSeg': seg}, timeout=25)
-    r.raise_for_status()
-    return r.json().get('data',[]) or []
+# ---------- HTTP / rate limiting ----------
+_tls = threading.local()
+
+def _session():
+    # one keep-alive session per worker thread (requests.Session is not thread-safe)
+    sess = getattr(_tls, 'sess', None)
+    if sess is None:
+        sess = _tls.sess = requests.Session()
+        sess.headers.update(HDR)
+    return sess
+
+def _post(path, body, timeout):
+    return _session().post(f'{BASE}{path}', json=body, timeout=timeout)
+
+class TokenBucket:
+    """Async token bucket: `burst` calls at once, then one every `gap` seconds."""
+    def __init__(self, gap=RATE_GAP, burst=RATE_BURST):
+        self.gap = float(gap)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.t_last = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # follow mode runs one event loop per sweep; the lock belongs to a loop
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.t_last) / self.gap)
+                self.t_last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) * self.gap)
+
+    def penalise(self):
+        # after a 429 the server-side window restarts; drain what we thought we had
+        self.tokens = min(self.tokens, 0.0)
+        self.t_last = time.monotonic()
+
+# Dhan limits each API separately, so expirylist and optionchain calls overlap.
+BUCKETS = {'expirylist': TokenBucket(), 'optionchain': TokenBucket()}
+PATHS = {'expirylist': '/v2/optionchain/expirylist', 'optionchain': '/v2/optionchain'}
+
+async def _call(api, body, timeout):
+    bucket = BUCKETS[api]
+    for attempt in range(RETRY_429 + 1):
+        await bucket.acquire()
+        r = await asyncio.to_thread(_post, PATHS[api], body, timeout)
+        if r.status_code == 429 and attempt < RETRY_429:
+            bucket.penalise()
+            continue
+        r.raise_for_status()
+        return r.json()
+
+# expiry lists change at most once a day: {(scrip, seg): (ist_date, [expiries])}
+_EXPIRY_CACHE = {}
+
+async def expirylist_cached(secid, seg):
+    today = dt.datetime.now(IST).date()
+    hit = _EXPIRY_CACHE.get((secid, seg))
+    if hit and hit[0] == today:
+        return hit[1]
+    js = await _call('expirylist', {'UnderlyingScrip': secid, 'UnderlyingSeg': seg}, 25)
+    exps = js.get('data',[]) or []
+    if exps:
+        _EXPIRY_CACHE[(secid, seg)] = (today, exps)
+    return exps
 
 def classify_expiry(date_str):
     d = dt.date.fromisoformat(date_str)
@@ -69,15 +149,9 @@ def pick_expiries(exp_list, mode):
         return res
     return exp_list[:1]
 
-def fetch_chain(secid, seg, expiry):
-    url = f'{BASE}/v2/optionchain'
-    body = {'UnderlyingScrip': secid, 'UnderlyingSeg': seg, 'Expiry': expiry}
-    r = requests.post(url, headers=HDR, json=body, timeout=30)
-    if r.status_code == 429:
-        time.sleep(3.6)
-        r = requests.post(url, headers=HDR, json=body, timeout=30)
-    r.raise_for_status()
-    return r.json().get('data',{}) or {}
+async def fetch_chain_async(secid, seg, expiry):
+    js = await _call('optionchain', {'UnderlyingScrip': secid, 'UnderlyingSeg': seg, 'Expiry': expiry}, 30)
+    return js.get('data',{}) or {}
 
 # ---------- DB helpers ----------
 def table_info(conn, table):
@@ -181,6 +255,102 @@ def opslog_insert_adaptive(ts, component, status, rows, warns, extra):
         c.commit()
 
 # ---------- core run ----------
+_GREEK_COLS = ('implied_volatility', 'delta', 'gamma', 'theta', 'vega')
+
+def fill_greeks(rows, pos, expiry, now_ts):
+    """Batch-solve missing IV/greeks for one chain in place. Returns (iv_filled, greeks_filled)."""
+    if not rows:
+        return 0, 0
+    col = lambda name: np.array([chain_store.as_float(r[pos[name]]) for r in rows])
+    now = dt.datetime.fromisoformat(now_ts.replace('Z', '+00:00'))
+    is_call = np.array([r[pos['side']] == 'CE' for r in rows])
+    res = fill_missing(col('ltp'), col('last_price'), col('strike'), year_fraction(expiry, now), is_call,
+                       *(col(c) for c in _GREEK_COLS))
+    for name, arr in zip(_GREEK_COLS, res[:5]):
+        i = pos[name]
+        for r, v in zip(rows, arr.tolist()):
+            if r[i] in (None, 0, 0.0) and v == v:
+                r[i] = v
+    return res[5], res[6]
+
+def chain_rows(col_list, tmeta, ts, und, uscrip, seg, exp, data):
+    """All CE/PE legs of one chain response -> (insert rows, zero_greeks, zero_iv)."""
+    oc = data.get('oc') or {}
+    last_price = data.get('last_price')
+    rows = []; zero_g = 0; zero_iv = 0
+    for k, rec in oc.items():
+        try:
+            strike = float(k)
+        except:
+            try: strike = float(f'{float(k):.6f}')
+            except: continue
+        for side, leg in (('CE', rec.get('ce')), ('PE', rec.get('pe'))):
+            if not leg: continue
+            rows.append(row_values(col_list, tmeta, ts, und, uscrip, seg, exp, last_price, strike, side, leg))
+            g = (leg.get('greeks') or {}) if isinstance(leg, dict) else {}
+            if (g.get('delta') in (None,0)) and (g.get('gamma') in (None,0)) and (g.get('vega') in (None,0)): zero_g += 1
+            iv = leg.get('implied_volatility')
+            if iv in (None,0,0.0): zero_iv += 1
+    return rows, zero_g, zero_iv
+
+async def _sweep(conn, ulys, expiries_mode, now_ts, warns):
+    sql, col_list, tmeta = build_insert_plan(conn)
+    chain_store.ensure_schema(conn)
+    pos = {c: i for i, c in enumerate(col_list)}
+    tracked = [pos[k] for k in chain_store.TRACKED]
+    i_json = pos.get('chain_json') if (DELTA_FILTER.delta and not KEEP_JSON) else None
+    blank_json = '' if i_json is not None and tmeta.get('chain_json', {}).get('notnull') else None
+    stored = [0, 0]     # legs written, legs fetched
+
+    def store(und, uscrip, seg, exp, data):
+        rows, zero_g, zero_iv = chain_rows(col_list, tmeta, now_ts, und, uscrip, seg, exp, data)
+        tot = len(rows)
+        n_iv = n_g = 0
+        if FILL_GREEKS and zero_g + zero_iv:
+            n_iv, n_g = fill_greeks(rows, pos, exp, now_ts)
+        keys = [(r[pos['strike']], r[pos['side']]) for r in rows]
+        vals = [[chain_store.as_float(r[i]) for i in tracked] for r in rows]
+        idx, is_key = DELTA_FILTER.filter(und, exp, keys, vals)
+        out = [rows[i] for i in idx.tolist()]
+        if i_json is not None:
+            # parsed columns already hold the leg; the raw blob is only kept on request
+            for r in out:
+                r[i_json] = blank_json
+        # one executemany + commit per chain, on the loop thread (the only one touching conn)
+        conn.executemany(sql, out)
+        conn.execute(chain_store.CYCLE_SQL, (und, exp, now_ts, data.get('last_price'), int(is_key), tot, len(out)))
+        conn.commit()
+        stored[0] += len(out)
+        stored[1] += tot
+        # warn on what is still missing after the solver ran
+        zg_pct = ((zero_g - n_g)*100/tot) if tot else 0.0
+        zi_pct = ((zero_iv - n_iv)*100/tot) if tot else 0.0
+        if zg_pct > 30: warns.append(f'{und}@{exp}: zero_greeks {zg_pct:.1f}%')
+        if zi_pct > 40: warns.append(f'{und}@{exp}: zero_iv {zi_pct:.1f}%')
+        print(f'[OK] {und} {exp}: stored {len(out)}/{tot} rows{" (key)" if is_key else ""}  '
+              f'(zero_g={zero_g}/{tot} zero_iv={zero_iv}/{tot}  solved iv={n_iv} greeks={n_g})')
+
+    async def one_chain(und, uscrip, seg, exp):
+        try:
+            data = await fetch_chain_async(uscrip, seg, exp)
+        except requests.exceptions.RequestException as e:
+            print(f'[ERR] {und} {exp}: optionchain {e}'); return
+        store(und, uscrip, seg, exp, data)
+
+    async def one_underlying(und, uscrip, seg):
+        try:
+            exps = await expirylist_cached(uscrip, seg)
+        except requests.exceptions.RequestException as e:
+            print(f'[ERR] {und}: expirylist {e}'); return
+        picks = pick_expiries(exps, expiries_mode)
+        if not picks:
+            print(f'[ERR] {und}: no expiries (mode={expiries_mode})'); return
+        await asyncio.gather(*(one_chain(und, uscrip, seg, exp) for exp in picks))
+
+    # every underlying is in flight at once; the buckets decide the actual call order/pace
+    await asyncio.gather(*(one_underlying(*x) for x in ulys))
+    return stored
+
 def run_once(group, expiries_mode):
     cfg = load_config()
     ulys = get_underlyings(group, cfg)
@@ -188,70 +358,21 @@ def run_once(group, expiries_mode):
         print(f'[ERR] group={group} has no enabled underlyings'); return 1
 
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    total_rows = 0
     warns = []
     now_ts = dt.datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+    t0 = time.time()
 
     with sqlite3.connect(DB_PATH) as conn:
-        sql, col_list, tmeta = build_insert_plan(conn)
-        cur = conn.cursor()
-        last_call = 0.0
-
-        for (und, uscrip, seg) in ulys:
-            wait = RATE_GAP - (time.time() - last_call)
-            if wait > 0: time.sleep(wait)
-            try:
-                exps = expirylist(uscrip, seg)
-            except requests.exceptions.HTTPError as e:
-                print(f'[ERR] {und}: expirylist {e}')
-                last_call = time.time(); continue
-            last_call = time.time()
-            picks = pick_expiries(exps, expiries_mode)
-            if not picks:
-                print(f'[ERR] {und}: no expiries (mode={expiries_mode})'); continue
-
-            for exp in picks:
-                wait = RATE_GAP - (time.time() - last_call)
-                if wait > 0: time.sleep(wait)
-                try:
-                    data = fetch_chain(uscrip, seg, exp)
-                except requests.exceptions.HTTPError as e:
-                    print(f'[ERR] {und} {exp}: optionchain {e}')
-                    last_call = time.time(); continue
-                last_call = time.time()
-
-                oc = data.get('oc') or {}
-                last_price = data.get('last_price')
-                n = 0; zero_g = 0; zero_iv = 0; tot = 0
-                for k, rec in oc.items():
-                    try:
-                        strike = float(k)
-                    except:
-                        try: strike = float(f'{float(k):.6f}')
-                        except: continue
-                    for side, leg in (('CE', rec.get('ce')), ('PE', rec.get('pe'))):
-                        if not leg: continue
-                        vals = row_values(col_list, tmeta, now_ts, und, uscrip, seg, exp, last_price, strike, side, leg)
-                        cur.execute(sql, vals)
-                        n += 1; tot += 1
-                        g = (leg.get('greeks') or {}) if isinstance(leg, dict) else {}
-                        if (g.get('delta') in (None,0)) and (g.get('gamma') in (None,0)) and (g.get('vega') in (None,0)): zero_g += 1
-                        iv = leg.get('implied_volatility')
-                        if iv in (None,0,0.0): zero_iv += 1
-                conn.commit()
-                total_rows += n
-                zg_pct = (zero_g*100/tot) if tot else 0.0
-                zi_pct = (zero_iv*100/tot) if tot else 0.0
-                if zg_pct > 30: warns.append(f'{und}@{exp}: zero_greeks {zg_pct:.1f}%')
-                if zi_pct > 40: warns.append(f'{und}@{exp}: zero_iv {zi_pct:.1f}%')
-                print(f'[OK] {und} {exp}: stored {n} rows  (zero_g={zero_g}/{tot} {zg_pct:.1f}%  zero_iv={zi_pct:.1f}%)')
+        total_rows, fetched = asyncio.run(_sweep(conn, ulys, expiries_mode, now_ts, warns))
+    print(f'[INFO] sweep {group}: {total_rows}/{fetched} legs written in {time.time()-t0:.1f}s')
 
     try:
-        opslog_insert_adaptive(now_ts, 'chain', 'ok' if total_rows>0 else 'warn', total_rows, warns, {'group':group,'expiries':expiries_mode})
+        opslog_insert_adaptive(now_ts, 'chain', 'ok' if fetched>0 else 'warn', total_rows, warns,
+                               {'group':group,'expiries':expiries_mode,'legs_fetched':fetched})
     except Exception as e:
         print('[WARN] ops_log insert failed:', e)
 
-    return 0 if total_rows>0 else 2
+    return 0 if fetched>0 else 2
 
 def follow_loop(group, expiries_mode, poll_s):
     print('Follow loop started. Ctrl+C to stop.')
@@ -3,19 +3,25 @@
 # - Forces NSE_EQ / NSE_FNO mapping (won't mix BSE)
 # - Trims uneven arrays safely (no pandas length errors)
 # - Accepts manual (--security-id ...) or CSV+symbols (NSE filtered)
+# - Plans every (securityId, timeframe, window) call into the hist_jobs table and runs
+#   them on a thread pool behind one rate limiter; re-running the same command resumes
+#   (done jobs are skipped, pending/failed/interrupted ones are retried)
 
+from __future__ import annotations
 from common.bootstrap import init_runtime
 init_runtime()
-from __future__ import annotations
-import os, sys, time, json, re
+import os, sys, time, json, re, sqlite3, hashlib, threading
 import argparse
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
 import requests
 from dotenv import load_dotenv
 
+from teevra import instruments, history_store
+
 try:
     from tqdm import tqdm
 except Exception:
@@ -25,6 +31,7 @@ except Exception:
 PROJECT_ROOT = Path(os.getenv("PROJECT_ROOT", r"C:\teevra18"))
 DATA_DIR     = Path(os.getenv("DATA_DIR", r"C:\teevra18\data"))
 HIST_DIR     = DATA_DIR / "history"
+DB_PATH      = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
 ENV_PATH     = PROJECT_ROOT / ".env"
 DEFAULT_BASE = os.getenv("DHAN_REST_BASE", "https://api.dhan.co").rstrip("/")
 
@@ -36,6 +43,10 @@ if not DHAN_TOKEN:
 
 HEADERS = {"Content-Type": "application/json", "Accept": "application/json", "access-token": DHAN_TOKEN}
 
+WORKERS       = int(os.getenv("HIST_WORKERS", "4"))
+RATE_PER_SEC  = float(os.getenv("HIST_RATE_PER_SEC", "4"))    # shared by all workers (Dhan data APIs: 5/s)
+INTRADAY_DAYS = int(os.getenv("HIST_INTRADAY_DAYS", "90"))    # max window per intraday call
+
 def parse_date(d: str, with_time=False) -> str:
     d = d.strip()
     return (d + " 00:00:00") if (with_time and len(d) == 10) else (d[:10] if not with_time else d)
@@ -49,19 +60,47 @@ def sanitize_symbol(s: str) -> str:
     s = re.sub(r'\s+', "_", s.strip())
     return s[:80] if s else "UNKNOWN"
 
-def map_exchange_segment(seg:str, instrument:str) -> str:
-    s, i = N(seg), N(instrument)
-    if s in {"E","EQ","CM","EQUITY","CASH"}: return "NSE_EQ"
-    if s in {"D","FO","FNO","F&O","DERIVATIVE","DERIVATIVES"}: return "NSE_FNO"
-    if i.startswith("OPT") or i.startswith("FUT"): return "NSE_FNO"
-    return "NSE_EQ"
+class RateLimiter:
+    """Thread-safe spacing of calls: at most `per_sec` starts per second across all workers."""
+
+    def __init__(self, per_sec: float):
+        self.gap = 1.0 / per_sec if per_sec > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.gap
+        if at > now:
+            time.sleep(at - now)
+
+    def penalise(self, secs: float):
+        # after a 429 push every worker back, not just the one that hit it
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + secs)
+
+LIMITER = RateLimiter(RATE_PER_SEC)
+_tls = threading.local()
+
+def _session():
+    # one keep-alive session per worker thread (requests.Session is not thread-safe)
+    sess = getattr(_tls, "sess", None)
+    if sess is None:
+        sess = _tls.sess = requests.Session()
+        sess.headers.update(HEADERS)
+    return sess
 
 def dh_post(endpoint: str, body: dict, retries=3, pause=0.5) -> dict:
     url = f"{DHAN_BASE}{endpoint}"
     last = None
     for attempt in range(1, retries + 1):
-        r = requests.post(url, headers=HEADERS, data=json.dumps(body), timeout=30)
+        LIMITER.acquire()
+        r = _session().post(url, data=json.dumps(body), timeout=30)
         last = r
+        if r.status_code == 429:
+            LIMITER.penalise(pause * 4 * attempt)
         if r.status_code == 200:
             try:
                 return r.json()
@@ -179,77 +218,168 @@ def write_partition(df: pd.DataFrame, root: Path, meta: dict, from_s: str, to_s:
 
 
 def load_universe_nse(csv_path: str, wanted_symbols: list[str] | None = None) -> pd.DataFrame:
-    df = pd.read_csv(csv_path, dtype=str, low_memory=False)
-    # NSE only
-    df = df[df["EXCH_ID"].astype(str).str.upper() == "NSE"]
+    # parsed once into the shared memory-mapped master cache (teevra.instruments)
+    df = instruments.master(csv_path).frame()
+    df = df[df["exch_id"] == "NSE"]
     if df.empty:
         print("[ERROR] Your CSV has 0 NSE rows. Provide a master with EXCH_ID=NSE.")
         return pd.DataFrame(columns=["securityId","exchangeSegment","instrument","symbol","expiryCode"])
-    # Build display symbol
-    name_cols = [c for c in ["TRADING_SYMBOL","SYMBOL_NAME","DISPLAY_NAME","UNDERLYING_SYMBOL","SYMBOL"] if c in df.columns]
-    if name_cols:
-        sym = df[name_cols[0]].fillna("").astype(str)
-        for c in name_cols[1:]:
-            sym = sym.where(sym != "", df[c].fillna("").astype(str))
-    else:
-        sym = df["SECURITY_ID"].astype(str)
-    # Map segment
-    df["exchangeSegment"] = df.apply(lambda r: map_exchange_segment(r["SEGMENT"], r.get("INSTRUMENT","")), axis=1)
+    # this loader only talks NSE_EQ / NSE_FNO (index rows keep going out as NSE_EQ)
+    seg = df["exchange_segment"].where(df["exchange_segment"] == "NSE_FNO", "NSE_EQ")
     out = pd.DataFrame({
-        "securityId": df["SECURITY_ID"].astype(str),
-        "exchangeSegment": df["exchangeSegment"].astype(str),
-        "instrument": df["INSTRUMENT"].astype(str) if "INSTRUMENT" in df.columns else df["INSTRUMENT_TYPE"].astype(str),
-        "symbol": sym.astype(str),
+        "securityId": df["security_id"].astype(str),
+        "exchangeSegment": seg,
+        "instrument": df["instrument"].where(df["instrument"] != "", df["instrument_type"]),
+        "symbol": df["symbol"],
         "expiryCode": "0",
     })
     if wanted_symbols:
         wanted = [N(x) for x in wanted_symbols if x]
-        norm_sym = out["symbol"].map(N)
+        norm_sym = instruments.norm_keys(out["symbol"])
         mask = pd.Series(False, index=out.index)
         for w in wanted:
-            mask = mask | (norm_sym == w) | norm_sym.str.contains(w, na=False)
+            mask = mask | (norm_sym == w) | norm_sym.str.contains(w, na=False, regex=False)
         out = out[mask]
     return out.drop_duplicates(subset=["securityId"]).reset_index(drop=True)
 
-def run_single(securityId: str, segment: str, instrument: str, mode: str,
-               date_from: str, date_to: str, interval: int | None, oi: bool,
-               symbol: str | None, expiryCode: str | int | None):
+# ---- job queue ---------------------------------------------------------------
+JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS hist_jobs (
+  job_id      TEXT PRIMARY KEY,          -- sha1 of the request identity (instrument, tf, window, oi)
+  plan_id     TEXT NOT NULL,             -- same CLI invocation -> same plan
+  security_id TEXT NOT NULL,
+  segment     TEXT NOT NULL,
+  instrument  TEXT NOT NULL,
+  symbol      TEXT,
+  expiry_code INTEGER NOT NULL DEFAULT 0,
+  timeframe   TEXT NOT NULL,
+  oi          INTEGER NOT NULL DEFAULT 0,
+  date_from   TEXT NOT NULL,
+  date_to     TEXT NOT NULL,
+  status      TEXT NOT NULL DEFAULT 'pending',   -- pending | running | done | failed
+  attempts    INTEGER NOT NULL DEFAULT 0,
+  rows        INTEGER,
+  files       TEXT,                       -- JSON list of written parquet paths
+  error       TEXT,
+  updated_utc TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_hist_jobs_plan ON hist_jobs(plan_id, status);
+"""
+
+class JobStore:
+    """hist_jobs on the main DB; one connection shared by the workers behind a lock (low write rate)."""
+
+    def __init__(self, db_path: Path = DB_PATH):
+        self.con = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL;")
+        self.con.executescript(JOBS_DDL)
+        self.lock = threading.Lock()
+
+    def add(self, plan_id: str, jobs: list[dict]) -> int:
+        with self.lock, self.con:
+            before = self.con.total_changes
+            self.con.executemany("""
+                INSERT OR IGNORE INTO hist_jobs(job_id, plan_id, security_id, segment, instrument, symbol,
+                    expiry_code, timeframe, oi, date_from, date_to, updated_utc)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,datetime('now'))""",
+                [(j["job_id"], plan_id, j["securityId"], j["segment"], j["instrument"], j["symbol"],
+                  j["expiryCode"], j["timeframe"], int(j["oi"]), j["fromDate"], j["toDate"]) for j in jobs])
+            return self.con.total_changes - before
+
+    def todo(self, job_ids: list[str], redo: bool = False) -> set[str]:
+        """Subset of job_ids still to run (anything not done; 'running' means a previous run died)."""
+        with self.lock:
+            done = set()
+            for k in range(0, len(job_ids), 500):
+                part = job_ids[k:k + 500]
+                done.update(r[0] for r in self.con.execute(
+                    f"SELECT job_id FROM hist_jobs WHERE status='done' AND job_id IN ({','.join('?' * len(part))})", part))
+        return set(job_ids) if redo else set(job_ids) - done
+
+    def mark(self, job_id: str, status: str, rows=None, files=None, error=None):
+        with self.lock, self.con:
+            self.con.execute("""
+                UPDATE hist_jobs SET status=?, rows=COALESCE(?, rows), files=COALESCE(?, files), error=?,
+                    attempts=attempts + (?='running'), updated_utc=datetime('now')
+                WHERE job_id=?""",
+                (status, rows, None if files is None else json.dumps([str(p) for p in files]), error, status, job_id))
+
+    def summary(self, plan_id: str | None = None):
+        sql = "SELECT status, COUNT(*), COALESCE(SUM(rows),0) FROM hist_jobs"
+        args = ()
+        if plan_id:
+            sql, args = sql + " WHERE plan_id=?", (plan_id,)
+        with self.lock:
+            return self.con.execute(sql + " GROUP BY status ORDER BY status", args).fetchall()
+
+def _job_id(*parts) -> str:
+    return hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:20]
+
+def plan_jobs(securityId: str, segment: str, instrument: str, mode: str,
+              date_from: str, date_to: str, interval: int | None, oi: bool,
+              symbol: str | None, expiryCode: str | int | None) -> list[dict]:
+    """Every API call one instrument needs: one daily window, or INTRADAY_DAYS chunks for intraday."""
     tf = "1d" if mode == "daily" else f"{interval}m"
     # enforce NSE only
     if segment not in ("NSE_EQ","NSE_FNO","NSE_CURRENCY"):
         raise ValueError(f"[FATAL] Non-NSE segment '{segment}' not allowed in this loader.")
-    meta = {
-        "securityId": securityId, "symbol": symbol or str(securityId),
+    base = {
+        "securityId": str(securityId), "symbol": symbol or str(securityId),
         "segment": segment, "instrument": instrument,
         "expiryCode": int(expiryCode) if (expiryCode not in (None,"","0","NaN")) else 0,
-        "timeframe": tf,
+        "timeframe": tf, "oi": bool(oi), "interval": interval,
     }
-    def base_body():
-        b = {"securityId": str(securityId), "exchangeSegment": segment, "instrument": instrument, "oi": bool(oi)}
-        if meta["expiryCode"] > 0: b["expiryCode"] = meta["expiryCode"]
-        return b
-
     if mode == "daily":
-        body = base_body() | {"fromDate": parse_date(date_from, with_time=False), "toDate": parse_date(date_to, with_time=False)}
-        payload = dh_post("/v2/charts/historical", body)
-        df = to_frame(payload, meta)
-        return df.shape[0], write_partition(df, HIST_DIR, meta, body["fromDate"], body["toDate"])
+        windows = [(parse_date(date_from, with_time=False), parse_date(date_to, with_time=False))]
     else:
-        max_days = 90
         f = dt.datetime.strptime(parse_date(date_from, True), "%Y-%m-%d %H:%M:%S")
         t = dt.datetime.strptime(parse_date(date_to,   True), "%Y-%m-%d %H:%M:%S")
-        total_rows, all_files = 0, []
-        for (a,b) in tqdm(list(_chunks(f,t,max_days)), desc=f"{meta['symbol']} {tf}"):
-            body = base_body() | {
-                "interval": str(interval),
-                "fromDate": a.strftime("%Y-%m-%d %H:%M:%S"),
-                "toDate":   b.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            payload = dh_post("/v2/charts/intraday", body)
-            df = to_frame(payload, meta)
-            written = write_partition(df, HIST_DIR, meta, body["fromDate"], body["toDate"])
-            total_rows += df.shape[0]; all_files.extend(written); time.sleep(0.2)
-        return total_rows, all_files
+        windows = [(a.strftime("%Y-%m-%d %H:%M:%S"), b.strftime("%Y-%m-%d %H:%M:%S"))
+                   for a, b in _chunks(f, t, INTRADAY_DAYS)]
+    return [base | {"fromDate": a, "toDate": b,
+                    "job_id": _job_id(base["securityId"], segment, instrument, base["expiryCode"], tf, int(bool(oi)), a, b)}
+            for a, b in windows]
+
+def run_job(job: dict):
+    """One API call -> parquet partitions. Returns (rows, files)."""
+    body = {"securityId": job["securityId"], "exchangeSegment": job["segment"],
+            "instrument": job["instrument"], "oi": job["oi"],
+            "fromDate": job["fromDate"], "toDate": job["toDate"]}
+    if job["expiryCode"] > 0: body["expiryCode"] = job["expiryCode"]
+    if job["timeframe"] == "1d":
+        endpoint = "/v2/charts/historical"
+    else:
+        endpoint = "/v2/charts/intraday"
+        body["interval"] = str(job["interval"])
+    payload = dh_post(endpoint, body)
+    df = to_frame(payload, job)
+    return df.shape[0], write_partition(df, HIST_DIR, job, body["fromDate"], body["toDate"])
+
+def run_jobs(store: JobStore, jobs: list[dict], workers: int = WORKERS):
+    """Execute jobs on a bounded pool; each job's status is persisted as it finishes."""
+    def one(job):
+        store.mark(job["job_id"], "running")
+        try:
+            rows, files = run_job(job)
+        except Exception as e:
+            store.mark(job["job_id"], "failed", error=str(e)[:1000])
+            raise
+        store.mark(job["job_id"], "done", rows=rows, files=files)
+        return rows, files
+
+    total_rows, all_files, failed = 0, [], []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hist") as pool:
+        futs = {pool.submit(one, j): j for j in jobs}
+        for fut in tqdm(as_completed(futs), total=len(futs), desc="jobs"):
+            job = futs[fut]
+            try:
+                rows, files = fut.result()
+            except Exception as e:
+                failed.append(job)
+                print(f"[WARN] {job['symbol']} {job['timeframe']} {job['fromDate']}..{job['toDate']}: {e}")
+                continue
+            total_rows += rows; all_files.extend(files)
+    return total_rows, all_files, failed
 
 def _chunks(start: dt.datetime, end: dt.datetime, max_days: int):
     cur = start; step = dt.timedelta(days=max_days)
@@ -269,6 +399,9 @@ def main():
     ap.add_argument("--from", dest="date_from", type=str, required=True)
     ap.add_argument("--to",   dest="date_to",   type=str, required=True)
     ap.add_argument("--oi", type=str, default="false")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="concurrent API calls (shared rate limit)")
+    ap.add_argument("--redo", action="store_true", help="re-fetch jobs already marked done")
+    ap.add_argument("--compact", action="store_true", help="compact touched months into part-0.parquet + hist_catalog")
     args = ap.parse_args()
 
     include_oi = str(args.oi).lower() in ("1","true","yes","y")
@@ -302,19 +435,33 @@ def main():
 
     ensure_dir(HIST_DIR)
 
-    total_rows, total_files = 0, []
+    jobs = []
     for t in tasks:
-        rows, files = run_single(
+        jobs.extend(plan_jobs(
             securityId=t["securityId"], segment=t["exchangeSegment"], instrument=t["instrument"],
             mode=args.mode, date_from=args.date_from, date_to=args.date_to,
             interval=args.interval, oi=include_oi, symbol=t.get("symbol"), expiryCode=t.get("expiryCode"),
-        )
-        print(f"OK: {t.get('symbol', t['securityId'])} | {t['exchangeSegment']} {t['instrument']} → rows={rows} files={len(files)}")
-        total_rows += rows; total_files.extend(files)
+        ))
+    plan_id = _job_id(*sorted(j["job_id"] for j in jobs))
+    store = JobStore()
+    store.add(plan_id, jobs)
+    todo = store.todo([j["job_id"] for j in jobs], redo=args.redo)
+    pending = [j for j in jobs if j["job_id"] in todo]
+    print(f"[PLAN] {plan_id}: {len(tasks)} instruments, {len(jobs)} jobs, "
+          f"{len(jobs) - len(pending)} already done, {len(pending)} to run on {args.workers} workers @ {RATE_PER_SEC:g}/s")
+
+    total_rows, total_files, failed = run_jobs(store, pending, workers=args.workers)
 
     print("\n=== SUMMARY ==="); print(f"Total rows: {total_rows}"); print(f"Files made: {len(total_files)}")
+    print("Jobs: " + ", ".join(f"{st}={n}" for st, n, _ in store.summary(plan_id)))
     for p in total_files[:10]: print(f"  {p}")
     if len(total_files) > 10: print(f"  ... (+{len(total_files)-10} more)")
+    if args.compact and total_files:
+        stats = history_store.compact(HIST_DIR, dirs={Path(p).parent for p in total_files}, db_path=DB_PATH)
+        print(f"[OK] compacted: {stats}")
+    if failed:
+        print(f"[WARN] {len(failed)} jobs failed; re-run the same command to retry them.")
+        sys.exit(1)
     print("Done.")
 
 if __name__ == "__main__":
@@ -1,13 +1,46 @@
 # C:\teevra18\services\ltp_feeder\build_atm_ladder.py
-import csv, os, sqlite3, sys
-from datetime import datetime
+"""
+Live ATM ladder: keeps ltp_subscriptions / universe_watchlist on the option
+strikes around spot for each underlying.
+
+Spot comes from the ingest pipeline (latest ticks_raw row for the index, else the
+feeder's ltp_ticks). Each (underlying, expiry) keeps its sorted strikes in memory
+with the current ATM index; ATM only moves once spot is HYSTERESIS x strike-gap
+past the midpoint to the next strike, so a spot hovering on a boundary does not
+flap subscriptions. Only legs entering/leaving the ladder are written.
+
+    python services\\ltp_feeder\\build_atm_ladder.py            # follow spot
+    python services\\ltp_feeder\\build_atm_ladder.py --once     # single pass, then exit
+
+Env: LADDER_UNDERLYINGS (NIFTY,BANKNIFTY), LADDER_WIDTH (strikes each side, 10),
+LADDER_EXPIRIES (nearest N, 1), LADDER_HYSTERESIS (0.25), LADDER_POLL_SECS (1).
+"""
+from common.bootstrap import init_runtime
+init_runtime()
+import csv, os, sys, json, time, sqlite3, argparse, datetime as dt
+from bisect import bisect_left
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from teevra import ltp_store
+from teevra.db import put_health
 
 DB  = r"C:\teevra18\data\teevra18.db"
 CSV = r"C:\teevra18\data\dhan_instruments.csv"
+CONF_PATH = Path(r"C:\teevra18\config\underlyings_chain.json")
+
+UNDERLYINGS = [s.strip().upper() for s in os.getenv("LADDER_UNDERLYINGS", "NIFTY,BANKNIFTY").split(",") if s.strip()]
+WIDTH = int(os.getenv("LADDER_WIDTH", "10"))                 # ATM ± WIDTH strikes
+EXPIRIES = int(os.getenv("LADDER_EXPIRIES", "1"))            # nearest N expiries per underlying
+HYSTERESIS = float(os.getenv("LADDER_HYSTERESIS", "0.25"))   # fraction of the strike gap past the midpoint
+POLL_SECS = float(os.getenv("LADDER_POLL_SECS", "1.0"))
+SPOT_MAX_AGE_SECS = float(os.getenv("LADDER_SPOT_MAX_AGE_SECS", "120"))
+RELOAD_SECS = float(os.getenv("LADDER_RELOAD_SECS", "900"))  # re-read CSV / roll expiries
 
-# Strike step assumptions
-STEP = {"NIFTY": 50, "BANKNIFTY": 100}
-K = 10  # ATM ±10 strikes
+IST = ZoneInfo("Asia/Kolkata")
+SEG_CODE = {"IDX_I": 0, "NSE_EQ": 1, "NSE_FNO": 2}           # Dhan annexure (ticks_raw.exchange_segment)
+FNO = SEG_CODE["NSE_FNO"]
+SPOT_DEFAULTS = {"NIFTY": (13, "IDX_I"), "BANKNIFTY": (25, "IDX_I")}
 
 TEMPLATE = """security_id,tradingsymbol,underlying,expiry,strike,option_type,exchange_segment,lot_size
 # Example rows (replace with real SecurityIds)
@@ -41,105 +74,248 @@ def read_master():
         return []
     return rows
 
-def nearest_expiry(rows, underlying):
-    today = datetime.utcnow().date()
-    exp = sorted({datetime.fromisoformat(r["expiry"]).date()
-                  for r in rows
-                  if r.get("underlying")==underlying and r.get("expiry")}, key=lambda d: d)
-    for e in exp:
-        if e >= today:
-            return e.isoformat()
-    return None
-
-def round_to_step(x, step): return int(round(x / step) * step)
-
-def guess_spot_from_options(rows, underlying):
-    return {"NIFTY": 24000, "BANKNIFTY": 50000}.get(underlying, 24000)
-
-def pick_symbols(rows, underlying, spot):
-    step = STEP.get(underlying)
-    if not step:
-        print(f"[WARN] No STEP defined for {underlying}; skipping.")
-        return []
+def spot_instruments():
+    """underlying -> (security_id, segment name) of its spot, from underlyings_chain.json."""
+    out = dict(SPOT_DEFAULTS)
+    try:
+        cfg = json.loads(CONF_PATH.read_text(encoding="utf-8-sig"))
+        for items in cfg.get("groups", {}).values():
+            for it in items:
+                und = (it.get("underlying") or "").strip().upper()
+                if und and it.get("underlying_scrip"):
+                    out[und] = (int(it["underlying_scrip"]), it.get("underlying_seg") or "IDX_I")
+    except (OSError, ValueError) as e:
+        print(f"[WARN] {CONF_PATH}: {e}; using default spot ids")
+    return out
 
-    atm  = round_to_step(spot, step)
-    exp  = nearest_expiry(rows, underlying)
+def ist_today():
+    return dt.datetime.now(IST).date()
 
-    idx = {}
+# ---- strike index ---------------------------------------------------------------
+class StrikeLadder:
+    """Sorted strikes of one (underlying, expiry) with a sticky ATM index."""
+
+    def __init__(self, underlying, expiry, legs):
+        self.underlying, self.expiry = underlying, expiry
+        self.legs = legs                                   # (strike, 'CE'|'PE') -> (symbol, security_id)
+        self.strikes = sorted({k for k, _ in legs})
+        self.atm = None                                    # index into strikes
+
+    def nearest(self, spot):
+        s = self.strikes
+        j = bisect_left(s, spot)
+        if j == len(s) or (j > 0 and spot - s[j - 1] <= s[j] - spot):
+            j -= 1
+        return j
+
+    def recenter(self, spot) -> bool:
+        """Move ATM for this spot; True if it changed."""
+        if not self.strikes:
+            return False
+        j, i = self.nearest(spot), self.atm
+        if i is None or abs(j - i) > 1:
+            changed = j != i
+            self.atm = j
+            return changed
+        if j == i:
+            return False
+        # neighbour strike: only cross once spot is past the midpoint by the hysteresis band
+        lo, hi = sorted((self.strikes[i], self.strikes[j]))
+        band = HYSTERESIS * (hi - lo)
+        mid = 0.5 * (lo + hi)
+        if (j > i and spot >= mid + band) or (j < i and spot <= mid - band):
+            self.atm = j
+            return True
+        return False
+
+    def wanted(self):
+        if self.atm is None:
+            return set()
+        ks = self.strikes[max(0, self.atm - WIDTH): self.atm + WIDTH + 1]
+        return {self.legs[(k, o)] for k in ks for o in ("CE", "PE") if (k, o) in self.legs}
+
+    @property
+    def atm_strike(self):
+        return None if self.atm is None else self.strikes[self.atm]
+
+def build_ladders(rows, underlyings, today, n_expiries=EXPIRIES):
+    """Ladders for the nearest n_expiries (>= today) of each underlying, plus security_id -> symbol of every contract."""
+    by_und = {}
     for r in rows:
-        if r.get("underlying") != underlying: continue
-        try: strike = int(float(r.get("strike","0")))
-        except: continue
-        key = (strike, r.get("option_type"))
-        idx.setdefault(key, []).append(r)
-
-    targets = []
-    for d in range(-K, K+1):
-        strike = atm + d*step
-        for opt in ("CE","PE"):
-            candidates = idx.get((strike,opt), [])
-            if not candidates: continue
-            chosen = None
-            if exp:
-                chosen = next((r for r in candidates if r.get("expiry")==exp), None)
-            if not chosen:  # fallback: nearest future expiry or just first
-                fut = []
-                today = datetime.utcnow().date()
-                for r in candidates:
-                    try:
-                        e = datetime.fromisoformat(r["expiry"]).date()
-                        if e >= today: fut.append((e,r))
-                    except: pass
-                chosen = fut[0][1] if fut else candidates[0]
-            if chosen:
-                targets.append((chosen["tradingsymbol"], chosen["security_id"]))
-
-    if not targets:
-        print(f"[SAFE] No matches for {underlying}. Relaxing — nothing upserted.")
-    elif exp is None:
-        print(f"[WARN] No expiry found for {underlying}; used best-effort strikes.")
-    return sorted(set(targets))
-
-def upsert_subscriptions(pairs):
-    conn = sqlite3.connect(DB)
+        und = r["underlying"].upper()
+        if und not in underlyings:
+            continue
+        try:
+            exp = dt.date.fromisoformat(r["expiry"][:10])
+            strike = float(r["strike"])
+        except ValueError:
+            continue
+        by_und.setdefault(und, {}).setdefault(exp, {})[(strike, r["option_type"])] = (r["tradingsymbol"], str(r["security_id"]))
+    ladders, managed = [], {}
+    for und, exps in by_und.items():
+        for legs in exps.values():
+            managed.update((sid, sym) for sym, sid in legs.values())
+        for exp in sorted(e for e in exps if e >= today)[:n_expiries]:
+            ladders.append(StrikeLadder(und, exp.isoformat(), exps[exp]))
+    return ladders, managed
+
+# ---- spot -------------------------------------------------------------------------
+def _age_secs(ts):
+    t = dt.datetime.fromisoformat(str(ts).replace("Z", ""))
+    return (dt.datetime.utcnow() - t).total_seconds()
+
+def read_spot(conn, underlying, sid, seg):
+    """(ltp, age_secs) from M1 ticks_raw (indexed by security_id, ts_utc), else the feeder's ltp_ticks."""
+    try:
+        r = conn.execute("""SELECT ltp, ts_utc FROM ticks_raw WHERE security_id=? AND exchange_segment=? AND ltp > 0
+                            ORDER BY ts_utc DESC LIMIT 1""", (sid, SEG_CODE.get(seg, 0))).fetchone()
+        if r is not None:
+            return float(r[0]), _age_secs(r[1])
+    except (sqlite3.OperationalError, TypeError, ValueError):   # M1 has never run on this DB
+        pass
+    try:
+        r = ltp_store.latest(conn, underlying)
+    except sqlite3.OperationalError:
+        r = None
+    if r is None or not r[1] or r[1] <= 0:
+        return None, None
+    return float(r[1]), (ltp_store.now_ms() - int(r[0])) / 1000.0
+
+# ---- DB -----------------------------------------------------------------------------
+def ensure_tables(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS ltp_subscriptions(
+        option_symbol TEXT PRIMARY KEY, broker TEXT, token TEXT, exchange TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS universe_watchlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exchange_segment INTEGER NOT NULL,
+        security_id INTEGER NOT NULL,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        is_hot_option INTEGER NOT NULL DEFAULT 0)""")
+
+_WL_ON = """UPDATE universe_watchlist SET is_active=1, is_hot_option=? WHERE exchange_segment=? AND security_id=?"""
+_WL_INS = """INSERT INTO universe_watchlist(exchange_segment, security_id, is_active, is_hot_option)
+    SELECT ?, ?, 1, ? WHERE NOT EXISTS (
+        SELECT 1 FROM universe_watchlist WHERE exchange_segment=? AND security_id=?)"""
+_WL_OFF = """UPDATE universe_watchlist SET is_active=0
+    WHERE exchange_segment=? AND security_id=? AND is_hot_option=1"""
+
+def ensure_spots(conn, spots):
+    """Make sure both feeds carry the underlyings themselves (the ladder follows their LTP)."""
+    with conn:
+        for und, (sid, seg) in spots.items():
+            code = SEG_CODE.get(seg, 0)
+            conn.execute(_WL_INS, (code, sid, 0, code, sid))
+            conn.execute("INSERT OR IGNORE INTO ltp_subscriptions VALUES(?,?,?,?)", (und, "DHAN", str(sid), seg))
+
+def subscribed_in(conn, managed):
+    """security_ids the ladder manages that are live in either table."""
+    subs = {str(r[0]) for r in conn.execute("SELECT token FROM ltp_subscriptions WHERE broker='DHAN'")}
+    wl = {str(r[0]) for r in conn.execute(
+        "SELECT security_id FROM universe_watchlist WHERE exchange_segment=? AND is_active=1 AND is_hot_option=1",
+        (FNO,))}
+    return (subs | wl) & managed.keys()
+
+def apply_diff(conn, add, drop):
+    """add/drop: iterables of (symbol, security_id). One transaction for both tables."""
+    add, drop = list(add), list(drop)
     with conn:
-        conn.execute("""CREATE TABLE IF NOT EXISTS ltp_subscriptions(
-            option_symbol TEXT PRIMARY KEY, broker TEXT, token TEXT, exchange TEXT)""")
-        for sym, sec in pairs:
-            conn.execute("INSERT OR REPLACE INTO ltp_subscriptions VALUES(?,?,?,?)",
-                         (sym, "DHAN", sec, "NFO"))
-    conn.close()
-
-def load_spot_from_db_or_fallback(underlying, rows):
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    q = conn.execute("""SELECT ltp FROM ltp_cache
-        WHERE option_symbol IN ('NIFTY','BANKNIFTY','NIFTY50','BANKNIFTY_INDEX')
-        ORDER BY ts_utc DESC LIMIT 1""").fetchone()
-    conn.close()
-    if q:
-        try: return float(q["ltp"])
-        except: pass
-    return guess_spot_from_options(rows, underlying)
+        conn.executemany("DELETE FROM ltp_subscriptions WHERE token=? AND broker='DHAN'",
+                         [(sid,) for _, sid in drop])
+        conn.executemany("INSERT OR REPLACE INTO ltp_subscriptions VALUES(?,?,?,?)",
+                         [(sym, "DHAN", sid, "NFO") for sym, sid in add])
+        conn.executemany(_WL_OFF, [(FNO, int(sid)) for _, sid in drop])
+        conn.executemany(_WL_ON, [(1, FNO, int(sid)) for _, sid in add])
+        conn.executemany(_WL_INS, [(FNO, int(sid), 1, FNO, int(sid)) for _, sid in add])
+
+# ---- maintainer -------------------------------------------------------------------------
+class LadderMaintainer:
+    def __init__(self, conn, underlyings=UNDERLYINGS):
+        self.conn = conn
+        self.underlyings = set(underlyings)
+        self.spots = {u: s for u, s in spot_instruments().items() if u in self.underlyings}
+        self.ladders, self.managed = [], {}
+        self.current = None                     # {(symbol, sid)} applied; None until first reconcile
+        self.loaded_day = None
+        self.loaded_at = 0.0
+
+    def reload(self):
+        rows = read_master()
+        self.loaded_day, self.loaded_at = ist_today(), time.time()
+        old = {(l.underlying, l.expiry): l.atm_strike for l in self.ladders}
+        self.ladders, self.managed = build_ladders(rows, self.underlyings, self.loaded_day)
+        for l in self.ladders:                  # keep ATM across reloads so a reload is not a re-center
+            k = old.get((l.underlying, l.expiry))
+            if k is not None and k in l.strikes:
+                l.atm = l.strikes.index(k)
+        ensure_spots(self.conn, self.spots)
+        self.current = None                     # re-reconcile against the tables
+        missing = self.underlyings - {l.underlying for l in self.ladders}
+        for und in sorted(missing):
+            print(f"[WARN] {und}: no live expiry in {CSV}")
+        return len(rows)
+
+    def step(self, max_age=SPOT_MAX_AGE_SECS):
+        """One poll: re-center ladders on fresh spots, write only what changed. Returns (added, dropped)."""
+        if self.loaded_day != ist_today() or time.time() - self.loaded_at >= RELOAD_SECS:
+            self.reload()
+        moved = []
+        for und, (sid, seg) in self.spots.items():
+            spot, age = read_spot(self.conn, und, sid, seg)
+            if spot is None or (max_age is not None and age > max_age):
+                continue
+            for l in self.ladders:
+                if l.underlying == und and l.recenter(spot):
+                    moved.append(f"{und} {l.expiry} ATM {l.atm_strike:g} (spot {spot:.2f})")
+        if not moved and self.current is not None:
+            return 0, 0
+        if self.current is None:
+            waiting = sorted({l.underlying for l in self.ladders if l.atm is None})
+            if waiting:
+                # the first reconcile drops every managed leg not wanted, so it needs every ATM
+                print(f"[ATM LADDER] waiting for a fresh spot: {', '.join(waiting)}")
+                return 0, 0
+        wanted = set().union(*(l.wanted() for l in self.ladders))
+        if self.current is None:
+            # first pass after (re)load: re-assert the ladder and clear legs a previous run left behind
+            add = wanted
+            drop = {(self.managed[sid], sid) for sid in subscribed_in(self.conn, self.managed)} - wanted
+        else:
+            add, drop = wanted - self.current, self.current - wanted
+        if add or drop:
+            apply_diff(self.conn, add, drop)
+        self.current = wanted
+        for m in moved:
+            print(f"[ATM LADDER] {m}")
+        if add or drop:
+            print(f"[ATM LADDER] +{len(add)} -{len(drop)} legs (live {len(wanted)})")
+        put_health("ladder_legs", str(len(wanted)))
+        put_health("ladder_atm", json.dumps({f"{l.underlying}:{l.expiry}": l.atm_strike for l in self.ladders}))
+        return len(add), len(drop)
 
 def main():
+    ap = argparse.ArgumentParser(description="ATM ± WIDTH option ladder for ltp_subscriptions / universe_watchlist")
+    ap.add_argument("--once", action="store_true", help="single pass with the latest known spot, then exit")
+    args = ap.parse_args()
     if not ensure_csv_exists_with_template(): sys.exit(0)
-    rows = read_master()
-    if not rows:
+
+    conn = sqlite3.connect(DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    ensure_tables(conn)
+    m = LadderMaintainer(conn)
+    n = m.reload()
+    if not n:
         print(f"[WARN] {CSV} has no valid rows yet. Fill real values & re-run.")
         sys.exit(0)
-
-    total = 0
-    for root in ("NIFTY","BANKNIFTY"):
-        spot = load_spot_from_db_or_fallback(root, rows)
-        pairs = pick_symbols(rows, root, spot)
-        if pairs:
-            upsert_subscriptions(pairs)
-            total += len(pairs)
-            print(f"[ATM LADDER] {root}: upserted {len(pairs)} symbols (spot≈{spot}).")
-        else:
-            print(f"[INFO] {root}: nothing selected. Safe skip.")
-    print(f"[ATM LADDER] Done. Total upserts: {total}")
+    print(f"[ATM LADDER] {len(m.ladders)} ladders from {n} contracts; width ±{WIDTH}, hysteresis {HYSTERESIS:g}")
+    if args.once:
+        m.step(max_age=None)
+        return
+    while True:
+        try:
+            m.step()
+        except sqlite3.Error as e:
+            print(f"[WARN] ladder step: {e}")
+        time.sleep(POLL_SECS)
 
 if __name__ == "__main__":
     main()
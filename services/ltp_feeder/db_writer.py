@@ -1,17 +1,19 @@
 # C:\teevra18\services\ltp_feeder\db_writer.py
-import sqlite3
-from datetime import datetime
+import sqlite3, time
 
 DB = r"C:\teevra18\data\teevra18.db"
 
 def ensure_tables(conn):
+    # same layout as teevra.ltp_store (epoch-ms keys, covering (symbol, ts_ms) index)
     conn.execute("""
-      CREATE TABLE IF NOT EXISTS ltp_cache(
-        option_symbol TEXT,
-        ts_utc TEXT,
-        ltp REAL
+      CREATE TABLE IF NOT EXISTS ltp_ticks(
+        id INTEGER PRIMARY KEY,
+        symbol TEXT NOT NULL,
+        ts_ms INTEGER NOT NULL,
+        ltp REAL NOT NULL
       );
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ltp_ticks_sym_ts ON ltp_ticks(symbol, ts_ms, ltp);")
     conn.execute("""
       CREATE TABLE IF NOT EXISTS ltp_subscriptions(
         option_symbol TEXT PRIMARY KEY,
@@ -29,6 +31,5 @@ def get_subscriptions(conn, broker: str):
     """, (broker,)).fetchall()
 
 def insert_ltp(conn, option_symbol: str, ltp: float):
-    ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    conn.execute("INSERT INTO ltp_cache(option_symbol, ts_utc, ltp) VALUES(?,?,?)",
-                 (option_symbol, ts, float(ltp)))
+    conn.execute("INSERT INTO ltp_ticks(symbol, ts_ms, ltp) VALUES(?,?,?)",
+                 (option_symbol, int(time.time() * 1000), float(ltp)))
@@ -1,7 +1,12 @@
 # C:\teevra18\services\ltp_feeder\feeder_dhan.py
-import os, json, sqlite3, time, math, threading, struct
+from common.bootstrap import init_runtime
+init_runtime()
+import os, json, sqlite3, time, math, threading
 from datetime import datetime, timezone
 from websocket import WebSocketApp
+from teevra import ltp_store
+from teevra.ltp_bus import LtpPublisher
+from teevra.dhan_decode import decode_ticker_frame
 
 DB = r"C:\teevra18\data\teevra18.db"
 WS_BASE = "wss://api-feed.dhan.co"  # v2 WebSocket root (no path)
@@ -40,12 +45,9 @@ def symbol_by_security_id(conn):
     """).fetchall()
     return { (r["token"] or "").strip(): r["option_symbol"] for r in rows if r["token"] }
 
-def upsert_ltp(conn, option_symbol, ltp):
-    conn.execute(
-        "INSERT INTO ltp_cache(option_symbol, ts_utc, ltp) VALUES(?,?,?)",
-        (option_symbol, datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), float(ltp))
-    )
-    conn.commit()
+def append_ltp(rows):
+    # one frame -> one bulk append on the shared writer (committed in batches, epoch-ms keys)
+    ltp_store.submit(rows, DB)
 
 # --- Dhan v2 details -----------------------------------------------------------
 # Docs:
@@ -75,22 +77,10 @@ def chunked(lst, n):
         yield lst[i:i+n]
 
 # --- Decoder for ticker binary -------------------------------------------------
-def parse_ticker_packet(b):
-    # Expect at least 16 bytes
-    if len(b) < 16:
-        return None
-    # Header
-    resp_code = b[0]
-    if resp_code != RESP_CODE_TICKER:
-        return None
-    # int16 message length at [1:3] (big-endian per docs examples appear BE; Dhan uses network order)
-    msg_len = struct.unpack(">H", b[1:3])[0]
-    exch_seg = b[3]  # not used here
-    sec_id   = struct.unpack(">i", b[4:8])[0]  # 32-bit int
-    # Payload
-    ltp      = struct.unpack(">f", b[8:12])[0]
-    # ltt   = struct.unpack(">i", b[12:16])[0]  # last trade time epoch (ignored)
-    return (str(sec_id), float(ltp))
+def parse_ticker_frame(b):
+    # all ticker packets in one message, decoded in one np.frombuffer call
+    d = decode_ticker_frame(b)
+    return list(zip(map(str, d["security_id"].tolist()), d["ltp"].tolist()))
 
 # --- WebSocket callbacks -------------------------------------------------------
 class DhanFeeder:
@@ -98,8 +88,10 @@ class DhanFeeder:
         self.ws = None
         self.url = make_ws_url()
         self.conn = db_conn()
+        ltp_store.ensure_schema(self.conn)
         self.sym_map = symbol_by_security_id(self.conn)   # secId -> symbol
         self.to_subscribe = load_subscriptions(self.conn) # (symbol, secId, exch)
+        self.bus = LtpPublisher()   # push to M9 before the writer commits
         self.active = True
 
     def on_open(self, ws):
@@ -121,20 +113,21 @@ class DhanFeeder:
     def on_message(self, ws, message):
         # message is bytes (binary)
         if isinstance(message, (bytes, bytearray)):
-            parsed = parse_ticker_packet(message)
-            if not parsed:
-                return
-            sec_id, ltp = parsed
-            # Map sec_id back to symbol; if not found, try to refresh once
-            sym = self.sym_map.get(sec_id)
-            if sym is None:
-                self.sym_map = symbol_by_security_id(self.conn)
+            ts_ms = ltp_store.now_ms()
+            rows = []
+            for sec_id, ltp in parse_ticker_frame(message):
+                # Map sec_id back to symbol; if not found, try to refresh once
                 sym = self.sym_map.get(sec_id)
-            if sym:
-                try:
-                    upsert_ltp(self.conn, sym, ltp)
-                except Exception as e:
-                    print("[DHAN] db write error:", repr(e))
+                if sym is None:
+                    self.sym_map = symbol_by_security_id(self.conn)
+                    sym = self.sym_map.get(sec_id)
+                if sym:
+                    rows.append((sym, ts_ms, ltp))
+            try:
+                append_ltp(rows)
+            except Exception as e:
+                print("[DHAN] db write error:", repr(e))
+            self.bus.send(rows)
         else:
             # Some servers may push text admin messages; print for visibility
             print("[DHAN] text:", message)
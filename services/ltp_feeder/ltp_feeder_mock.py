@@ -11,9 +11,13 @@ Run:
 
 Then run your M9 worker loop/once in parallel.
 """
+from common.bootstrap import init_runtime
+init_runtime()
 import sqlite3, argparse, time, random
 from datetime import datetime
 
+from teevra import ltp_store
+
 DB = r"C:\teevra18\data\teevra18.db"
 
 def price_compute(po, mode: str, vol: float):
@@ -46,13 +50,7 @@ def price_compute(po, mode: str, vol: float):
     return round(next_px, 2)
 
 def ensure_ltp_table(conn):
-    conn.execute("""
-      CREATE TABLE IF NOT EXISTS ltp_cache(
-        option_symbol TEXT,
-        ts_utc TEXT,
-        ltp REAL
-      );
-    """)
+    ltp_store.ensure_schema(conn)
 
 def fetch_active_orders(conn):
     # FILLED orders that are not CLOSED yet (state is 'FILLED' until TP/SL hit)
@@ -61,9 +59,9 @@ def fetch_active_orders(conn):
         po.id, po.option_symbol, po.side, po.entry_price, po.fill_price,
         po.sl_price, po.tp_price,
         -- last pushed LTP if any for context
-        (SELECT ltp FROM ltp_cache lc
-           WHERE lc.option_symbol = po.option_symbol
-           ORDER BY lc.ts_utc DESC LIMIT 1) AS last_price
+        (SELECT ltp FROM ltp_ticks lt
+           WHERE lt.symbol = po.option_symbol
+           ORDER BY lt.ts_ms DESC LIMIT 1) AS last_price
       FROM paper_orders po
       WHERE po.state='FILLED'
       ORDER BY po.id ASC
@@ -72,7 +70,7 @@ def fetch_active_orders(conn):
     return rows
 
 def push_ltp(conn, symbol: str, ltp: float):
-    conn.execute("INSERT INTO ltp_cache(option_symbol, ts_utc, ltp) VALUES(?, datetime('now'), ?)", (symbol, ltp))
+    ltp_store.append(conn, [(symbol, ltp_store.now_ms(), ltp)])
 
 def main():
     ap = argparse.ArgumentParser()
@@ -1,8 +1,15 @@
 # C:\teevra18\services\m11\build_features_m11.py
-import os, sqlite3, pandas as pd, numpy as np, yaml
+import os, sys, sqlite3, pandas as pd, numpy as np, yaml
 from datetime import datetime, timezone
 from pathlib import Path
 
+if r"C:\teevra18" not in sys.path:
+    sys.path.insert(0, r"C:\teevra18")
+try:
+    from teevra.candles_latest import has_latest, latest_bars
+except ImportError:
+    has_latest = latest_bars = None
+
 # ---- Config paths ----
 CFG_PATH = Path(r"C:\teevra18\config\m11.yaml")
 OUT_DIR  = Path(r"C:\teevra18\models\m11")
@@ -97,6 +104,20 @@ def try_select_candles(conn: sqlite3.Connection, tbl: str) -> pd.DataFrame:
     """
     return pd.read_sql(sql, conn, parse_dates=["ts_utc"])
 
+def try_select_latest(conn: sqlite3.Connection, tf: str = "1m") -> pd.DataFrame:
+    # newest bar per instrument from candles_latest (universe-sized read); empty if not maintained
+    if has_latest is None or not has_latest(conn, tf):
+        return pd.DataFrame()
+    b = latest_bars(conn, tf, 1)
+    return pd.DataFrame({
+        "ts_utc": pd.to_datetime(b["ts"][:, -1], unit="s"),
+        "instrument": b["sid"],
+        "close": b["c"][:, -1],
+        "ema": None,
+        "vwap": b["vwap"][:, -1],
+        "atr": None,
+    })
+
 def try_read_table(conn: sqlite3.Connection, name: str) -> pd.DataFrame:
     """Read only if it's a TABLE; returns empty DataFrame if absent."""
     try:
@@ -128,7 +149,11 @@ def main():
     # ---- Candles: pick first working table ----
     candles = None
     errors = []
-    for tbl in CANDIDATE_TABLES:
+    df = try_select_latest(conn)
+    if not df.empty:
+        print(f"[INFO] Using table: candles_latest (rows={len(df)})")
+        candles = df
+    for tbl in ([] if candles is not None else CANDIDATE_TABLES):
         try:
             df = try_select_candles(conn, tbl)
             if not df.empty:
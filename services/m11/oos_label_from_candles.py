@@ -18,13 +18,22 @@ with sqlite3.connect(DB) as conn:
         print("[INFO] No unlabeled rows.")
         raise SystemExit(0)
 
-    # Bring in base close at t0
-    base = pd.read_sql("""
+    # Bring in base close at t0 (only the window/instruments the OOS rows can join to)
+    ts_all = pd.to_datetime(oos["ts_utc"], utc=True, errors="coerce").dropna()
+    if ts_all.empty:
+        print("[INFO] No parseable ts_utc on unlabeled rows.")
+        raise SystemExit(0)
+    t_lo = int(ts_all.min().timestamp())
+    t_hi = int(ts_all.max().timestamp()) + 180
+    insts = sorted(oos["instrument"].dropna().astype(str).unique())
+    inst_sql = f" AND instrument_id IN ({','.join('?' * len(insts))})" if 0 < len(insts) <= 900 else ""
+    base = pd.read_sql(f"""
       SELECT instrument_id AS instrument,
              datetime(t_start,'unixepoch') AS ts_utc,
              close
       FROM candles_1m
-    """, conn)
+      WHERE t_start BETWEEN ? AND ?{inst_sql}
+    """, conn, params=[t_lo, t_hi] + (insts if inst_sql else []))
     base["ts_utc"] = pd.to_datetime(base["ts_utc"], utc=True)
 
     # Prepare t+3 joins
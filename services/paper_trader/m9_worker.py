@@ -1,30 +1,36 @@
 # C:\teevra18\services\paper_trader\m9_worker.py
-import sqlite3, argparse, time
-from datetime import datetime, timedelta
-
-# ----------------- Charges model & helper -----------------
-class ChargesModel:
-    def __init__(self, brokerage_per_order=20.0, gst_rate=0.18, stt_sell_rate=0.001,
-                 exch_txn_rate=0.0003503, sebi_rate=0.000001, stamp_buy_rate=0.00003):
-        self.brokerage = brokerage_per_order
-        self.gst = gst_rate
-        self.stt = stt_sell_rate
-        self.exch = exch_txn_rate
-        self.sebi = sebi_rate
-        self.stamp = stamp_buy_rate
-
-def estimate_roundtrip_charges(entry, exit_, qty, cm: ChargesModel):
-    buy_turnover  = float(entry) * int(qty)
-    sell_turnover = max(float(exit_), 0.0) * int(qty)
-    brokerage = cm.brokerage * 2.0
-    exch = cm.exch * (buy_turnover + sell_turnover)
-    sebi = cm.sebi * (buy_turnover + sell_turnover)
-    stt  = cm.stt * sell_turnover
-    stamp= cm.stamp * buy_turnover
-    gst  = cm.gst * (brokerage + exch + sebi)
-    return brokerage + exch + sebi + stt + stamp + gst
-
-CHARGES = ChargesModel()
+"""
+M9 paper trader.
+
+Open orders (PENDING_DELAY / FILLED) are kept in memory, indexed by
+option_symbol. LTP updates arrive on the teevra.ltp_bus push channel from the
+feeder and, as the durable catch-up path, by tailing teevra.ltp_store's
+ltp_ticks past the last seen id. Each batch of ticks is resolved by
+teevra.fill_sim over the whole tick path, for all open orders at once: a
+pending order fills on the first tick at/after delayed_fill_at (plus depth-20
+slippage), a filled order exits on the first tick that touches SL or TP (same
+tick -> SL; a gap through the stop exits at the tick). The backtester uses the
+same rules, so paper and backtest results agree. On start (and for --once),
+ltp_ticks is replayed from the earliest fill time of the open orders, so SL/TP
+touches while M9 was not running are still closed. State transitions are
+queued and written in one transaction per loop pass.
+
+    python services\paper_trader\m9_worker.py              # event loop
+    python services\paper_trader\m9_worker.py --once       # single catch-up pass
+"""
+from common.bootstrap import init_runtime
+init_runtime()
+
+import os, sqlite3, argparse, time, heapq
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from teevra import ltp_store, fill_sim, charges
+from teevra.ltp_bus import LtpSubscriber
+
+CHARGES = charges.DEFAULT
 DB = r"C:\teevra18\data\teevra18.db"
 
 # ----------------- Utilities -----------------
@@ -32,21 +38,13 @@ def view_exists(conn, name: str) -> bool:
     r = conn.execute("SELECT name FROM sqlite_master WHERE type IN ('view','table') AND name=?", (name,)).fetchone()
     return bool(r)
 
-def get_ltp(conn: sqlite3.Connection, option_symbol: str, ts_after_iso: str):
-    # Optional LTP source; if absent, we fallback to entry
-    row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ltp_cache';").fetchone()
-    if not row:
-        return None
-    row = conn.execute("""
-        SELECT ltp FROM ltp_cache
-        WHERE option_symbol=? AND ts_utc >= ?
-        ORDER BY ts_utc ASC
-        LIMIT 1
-    """, (option_symbol, ts_after_iso)).fetchone()
-    return float(row[0]) if row else None
+_OPSLOG_COLS = {}
 
 def _opslog_columns(conn):
-    return {r[1] for r in conn.execute("PRAGMA table_info(ops_log);").fetchall()}
+    cols = _OPSLOG_COLS.get(id(conn))
+    if cols is None:
+        cols = _OPSLOG_COLS[id(conn)] = {r[1] for r in conn.execute("PRAGMA table_info(ops_log);").fetchall()}
+    return cols
 
 def log(conn, level: str, event: str, ref_table: str, ref_id: int, message: str):
     """
@@ -76,10 +74,12 @@ def log(conn, level: str, event: str, ref_table: str, ref_id: int, message: str)
 def fetch_ready_signals(conn, limit: int):
     if not view_exists(conn, "v_signals_ready_for_m9"):
         raise RuntimeError("View v_signals_ready_for_m9 not found. Create it before running M9.")
+    # signals stay PENDING in the view after M9 picks them up, so skip the ones already ordered
     rows = conn.execute("""
         SELECT id, signal_id, option_symbol, underlying_root, side,
                entry_price, sl_points, tp_points, lot_size, lots, ts_utc
-        FROM v_signals_ready_for_m9
+        FROM v_signals_ready_for_m9 v
+        WHERE NOT EXISTS (SELECT 1 FROM paper_orders po WHERE po.signal_row_id = v.id)
         ORDER BY ts_utc ASC
         LIMIT ?
     """, (limit,)).fetchall()
@@ -153,136 +153,289 @@ def create_paper_order(conn, sig):
         f"Created order from signal {sig['signal_id']} (+7s at {delayed_fill_at})")
     return oid
 
-def due_fill_ids(conn):
-    # Use datetime() to parse stored string and be robust to format
-    return conn.execute("""
-        SELECT id FROM paper_orders
-        WHERE state='PENDING_DELAY' AND datetime('now') >= datetime(delayed_fill_at)
-        ORDER BY id ASC
-    """).fetchall()
-
-def filled_ids(conn):
-    return conn.execute("SELECT id FROM paper_orders WHERE state='FILLED'").fetchall()
-
-def try_fill_order(conn, order_id: int):
-    po = conn.execute("SELECT * FROM paper_orders WHERE id=?", (order_id,)).fetchone()
-    if not po or po["state"] != "PENDING_DELAY":
-        return
-    fill_after = po["delayed_fill_at"] or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    ltp = get_ltp(conn, po["option_symbol"], fill_after)
-    fill_price = float(ltp) if ltp is not None else float(po["entry_price"])
-
-    # ----------------- Slippage Guard (NEW) -----------------
-    # Abort fills that are unrealistically far from planned entry.
-    # Default: 30% threshold; tune as needed or make profile-based later.
-    entry = float(po["entry_price"])
-    po_side = (po["side"] or "").upper()  # BUY/SELL
-    max_slip_pct = 0.30  # 30% allowed move vs entry
-
-    # BUY should not fill too far ABOVE entry; SELL should not fill too far BELOW entry.
-    if (po_side == "BUY"  and fill_price > entry * (1 + max_slip_pct)) or \
-       (po_side == "SELL" and fill_price < entry * (1 - max_slip_pct)):
-        conn.execute("UPDATE paper_orders SET state='ARCHIVED', notes='fill_slippage_exceeded' WHERE id=?", (order_id,))
-        log(conn, "WARN", "ARCHIVE", "paper_orders", order_id,
-            f"Aborted fill due to slippage [{po_side}] fill={fill_price:.2f} vs entry={entry:.2f} (>{max_slip_pct*100:.0f}% threshold)")
-        return
-    # --------------------------------------------------------
-
-    conn.execute("""
-        UPDATE paper_orders
-        SET state='FILLED', fill_price=?, filled_ts_utc=datetime('now')
-        WHERE id=?
-    """, (fill_price, order_id))
-    origin = "ltp_cache" if ltp is not None else "entry_fallback"
-    log(conn, "INFO", "FILL", "paper_orders", order_id, f"Filled at {fill_price} ({origin})")
-
-def check_and_close(conn, order_id: int):
-    po = conn.execute("SELECT * FROM paper_orders WHERE id=?", (order_id,)).fetchone()
-    if not po or po["state"] != "FILLED":
-        return
-
-    # read a "current" price; without LTP feed we use fill_price so it won't move
-    now_iso = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    ltp = get_ltp(conn, po["option_symbol"], now_iso)
-    last = float(ltp) if ltp is not None else float(po["fill_price"])
-
-    po_side = (po["side"] or "").upper()  # BUY or SELL
-    hit_event, exit_price = None, None
-
-    if po_side == "BUY":
-        if last >= float(po["tp_price"]):   # TP for BUY
-            hit_event, exit_price = "TP_HIT", float(po["tp_price"])
-        elif last <= float(po["sl_price"]): # SL for BUY
-            hit_event, exit_price = "SL_HIT", float(po["sl_price"])
-    else:  # SELL (SHORT)
-        if last <= float(po["tp_price"]):   # TP for SELL is lower price
-            hit_event, exit_price = "TP_HIT", float(po["tp_price"])
-        elif last >= float(po["sl_price"]): # SL for SELL is higher price
-            hit_event, exit_price = "SL_HIT", float(po["sl_price"])
-
-    if not hit_event:
-        return
-
-    qty = int(po["qty"])
-    fill_price = float(po["fill_price"])
-
-    # P&L: BUY gains when price rises; SELL gains when price falls
-    if po_side == "BUY":
-        pnl_gross = (exit_price - fill_price) * qty
-    else:  # SELL
-        pnl_gross = (fill_price - exit_price) * qty
-
-    # Exit charges & net
-    charges_exit = estimate_roundtrip_charges(fill_price, exit_price, qty, CHARGES)
-    pnl_net = pnl_gross - charges_exit
-
-    conn.execute("""
-        UPDATE paper_orders
-        SET state=?, exit_price=?, closed_ts_utc=datetime('now'),
-            pnl_gross=?, pnl_net=?, charges_at_exit=?
-        WHERE id=?
-    """, (hit_event, exit_price, pnl_gross, pnl_net, charges_exit, order_id))
-    log(conn, "INFO", hit_event, "paper_orders", order_id,
-        f"Closed at {exit_price} [{po_side}], pnl_gross={pnl_gross:.2f}, pnl_net={pnl_net:.2f}, charges={charges_exit:.2f}")
-
-    # Transition to final CLOSED
-    conn.execute("UPDATE paper_orders SET state='CLOSED' WHERE id=?", (order_id,))
-    log(conn, "INFO", "CLOSE", "paper_orders", order_id, "Order CLOSED")
+# ----------------- Event-driven engine -----------------
+FILL_GRACE_SECS = float(os.getenv("M9_FILL_GRACE_SECS", "2.0"))   # wait this long past delayed_fill_at for a tick
+TAIL_SECS       = float(os.getenv("M9_TAIL_SECS", "0.5"))         # ltp_ticks catch-up cadence
+SIGNAL_SECS     = float(os.getenv("M9_SIGNAL_SECS", "1.0"))       # v_signals_ready_for_m9 poll cadence
+SLIP_SECS       = float(os.getenv("M9_SLIP_SECS", "30"))          # depth-20 slippage book refresh
+TAIL_BATCH      = 5000
+MAX_SLIP_PCT    = 0.30
+
+OPEN_ORDER_SQL = """
+    SELECT id, option_symbol, side, qty, entry_price, sl_price, tp_price,
+           fill_price, delayed_fill_at, filled_ts_utc, state
+    FROM paper_orders
+"""
+
+def _epoch(ts: str) -> float:
+    """'YYYY-MM-DD HH:MM:SS' (or ISO with T / offset) as UTC epoch seconds."""
+    d = datetime.fromisoformat((ts or "").replace("Z", "+00:00"))
+    return (d if d.tzinfo else d.replace(tzinfo=timezone.utc)).timestamp()
+
+def _iso(epoch: float) -> str:
+    # millisecond precision: replay/exits restart strictly after filled_ts_utc, like the ltp_ticks ts_ms
+    return datetime.fromtimestamp(round(epoch, 3), timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+class Order:
+    __slots__ = ("id", "symbol", "side", "qty", "entry", "sl", "tp", "fill_at", "fill_price", "filled_at", "state")
+
+    def __init__(self, r):
+        self.id, self.symbol, self.state = int(r["id"]), r["option_symbol"], r["state"]
+        self.side = (r["side"] or "").upper()
+        self.qty = int(r["qty"])
+        self.entry, self.sl, self.tp = float(r["entry_price"]), float(r["sl_price"]), float(r["tp_price"])
+        self.fill_at = _epoch(r["delayed_fill_at"]) if r["delayed_fill_at"] else time.time()
+        self.fill_price = float(r["fill_price"]) if r["fill_price"] is not None else None
+        self.filled_at = _epoch(r["filled_ts_utc"]) if r["filled_ts_utc"] else self.fill_at
+
+def _sim_side(o: Order) -> int:
+    return fill_sim.LONG if o.side == "BUY" else fill_sim.SHORT
+
+class M9Engine:
+    def __init__(self, conn, batch: int = 50, sub=None):
+        self.conn = conn
+        self.batch = batch
+        self.sub = sub
+        self.orders = {}                    # id -> Order (PENDING_DELAY / FILLED only)
+        self.by_symbol = defaultdict(set)   # option_symbol -> order ids
+        self.pending = []                   # heap of (fill_at, id) for the no-tick fallback
+        self.last_ts = {}                   # option_symbol -> newest tick epoch applied
+        self.ops = []                       # (fn, args) written together by flush()
+        self.last_id = 0
+        self.slip = fill_sim.SlippageModel()
+        self.stats = defaultdict(int)
+
+    # ---- state ----
+    def _track(self, rows):
+        for r in rows:
+            o = Order(r)
+            self.orders[o.id] = o
+            self.by_symbol[o.symbol].add(o.id)
+            if o.state == "PENDING_DELAY":
+                heapq.heappush(self.pending, (o.fill_at, o.id))
+
+    def _untrack(self, o: Order):
+        self.orders.pop(o.id, None)
+        ids = self.by_symbol.get(o.symbol)
+        if ids is not None:
+            ids.discard(o.id)
+            if not ids:
+                del self.by_symbol[o.symbol]
+
+    def load_open(self):
+        self._track(self.conn.execute(OPEN_ORDER_SQL + " WHERE state IN ('PENDING_DELAY','FILLED')").fetchall())
+        # live ticks come from here on; ticks up to this id are replayed below instead
+        self.last_id = ltp_store.max_id(self.conn)
+        self.replay()
+
+    def replay(self, orders=None):
+        """
+        Fills/exits that happened while M9 was down (or before a --once pass):
+        replay ltp_ticks for the orders' symbols from their earliest fill / delayed fill time.
+        """
+        orders = list(self.orders.values()) if orders is None else [o for o in orders if o.id in self.orders]
+        if not orders:
+            return
+        since = min(o.filled_at if o.state == "FILLED" else o.fill_at for o in orders)
+        tape = fill_sim.Tape(*ltp_store.load_range(self.conn, {o.symbol for o in orders}, int(since * 1000)))
+        if len(tape):
+            self.apply(tape)
+            self.stats["replayed_ticks"] += len(tape)
+
+    def poll_signals(self):
+        sigs = fetch_ready_signals(self.conn, self.batch)
+        if not sigs:
+            return
+        ids = [create_paper_order(self.conn, s) for s in sigs]
+        self.conn.commit()
+        self._track(self.conn.execute(OPEN_ORDER_SQL + f" WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+        self.stats["created"] += len(ids)
+
+    def refresh_slippage(self):
+        """Latest depth-20 book for every symbol with an open order (token via ltp_subscriptions)."""
+        syms = list(self.by_symbol)
+        if not syms:
+            return
+        try:
+            sids = dict(self.conn.execute(
+                f"SELECT option_symbol, token FROM ltp_subscriptions WHERE option_symbol IN ({','.join('?' * len(syms))})",
+                syms).fetchall())
+        except sqlite3.Error:
+            return
+        self.slip = fill_sim.SlippageModel.load(self.conn, sids)
+
+    # ---- prices ----
+    def tail(self):
+        """New ltp_ticks rows (id > high-water mark) for symbols with open orders."""
+        out = []
+        while True:
+            rows = ltp_store.tail(self.conn, self.last_id, TAIL_BATCH)
+            if not rows:
+                break
+            self.last_id = rows[-1][0]
+            out.extend((r[1], r[2] / 1000.0, float(r[3])) for r in rows if r[1] in self.by_symbol)
+            if len(rows) < TAIL_BATCH:
+                break
+        return out
+
+    def on_ticks(self, ticks):
+        """One batch of (symbol, epoch s, ltp): fills, then SL/TP exits along the whole path."""
+        # drop symbols with nothing open, and older ticks replayed by the tail after the bus delivered them
+        ticks = [t for t in ticks if t[0] in self.by_symbol and t[1] >= self.last_ts.get(t[0], 0.0)]
+        if not ticks:
+            return
+        sym, ts, px = zip(*ticks)
+        self.apply(fill_sim.Tape(sym, np.round(np.asarray(ts) * 1000).astype(np.int64), px))
+
+    def apply(self, tape):
+        for s, (a, b, _) in tape.seg.items():
+            self.last_ts[s] = tape.ts[b - 1] / 1000.0
+        live = [self.orders[oid] for s in tape.seg for oid in self.by_symbol[s]]
+
+        pend = [o for o in live if o.state == "PENDING_DELAY"]
+        if pend:
+            i, price = fill_sim.resolve_fills(tape, [o.symbol for o in pend], [round(o.fill_at * 1000) for o in pend],
+                                              [_sim_side(o) for o in pend], [o.qty for o in pend], self.slip)
+            for o, k, p in zip(pend, i, price):
+                if k >= 0:
+                    self.fill(o, p, "ltp", tape.ts[k] / 1000.0)
+
+        held = [o for o in live if o.state == "FILLED"]
+        if held:
+            ex = fill_sim.resolve_exits(tape, [o.symbol for o in held], [round(o.filled_at * 1000) for o in held],
+                                        [_sim_side(o) for o in held], [o.sl for o in held], [o.tp for o in held],
+                                        [o.qty for o in held], self.slip)
+            for o, ev, p, t in zip(held, ex["event"], ex["price"], ex["ts_ms"]):
+                if ev != fill_sim.NO_HIT:
+                    self.close(o, fill_sim.EVENTS[ev], float(p), t / 1000.0)
+
+    def fill_overdue(self, now: float):
+        # pending orders that saw no tick within the grace window: one DB lookup, else entry
+        caught_up = []
+        while self.pending and self.pending[0][0] + FILL_GRACE_SECS <= now:
+            _, oid = heapq.heappop(self.pending)
+            o = self.orders.get(oid)
+            if o is None or o.state != "PENDING_DELAY":
+                continue
+            row = ltp_store.next_after(self.conn, o.symbol, ltp_store.to_ms(o.fill_at))
+            pts = self.slip.points([o.symbol], o.qty, o.side == "BUY")[0]
+            if row is None:
+                self.fill(o, float(fill_sim.fill_price(o.entry, _sim_side(o), pts)), "entry_fallback")
+                continue
+            # filled at that tick's time, so SL/TP ticks since then still count
+            self.fill(o, float(fill_sim.fill_price(float(row[1]), _sim_side(o), pts)), "ltp", row[0] / 1000.0)
+            caught_up.append(o)
+        self.replay(caught_up)
+
+    # ---- transitions (queued) ----
+    def fill(self, o: Order, price: float, origin: str, ts: float = None):
+        price = float(price)
+        if (o.side == "BUY" and price > o.entry * (1 + MAX_SLIP_PCT)) or \
+           (o.side == "SELL" and price < o.entry * (1 - MAX_SLIP_PCT)):
+            o.state = "ARCHIVED"
+            self._untrack(o)
+            self.ops.append((lambda c, oid: c.execute(
+                "UPDATE paper_orders SET state='ARCHIVED', notes='fill_slippage_exceeded' WHERE id=?", (oid,)), (o.id,)))
+            self.ops.append((log, ("WARN", "ARCHIVE", "paper_orders", o.id,
+                f"Aborted fill due to slippage [{o.side}] fill={price:.2f} vs entry={o.entry:.2f} (>{MAX_SLIP_PCT*100:.0f}% threshold)")))
+            self.stats["archived"] += 1
+            return
+        ts = time.time() if ts is None else ts
+        o.state, o.fill_price, o.filled_at = "FILLED", price, ts
+        self.ops.append((lambda c, p, ts, oid: c.execute(
+            "UPDATE paper_orders SET state='FILLED', fill_price=?, filled_ts_utc=? WHERE id=?", (p, ts, oid)),
+            (price, _iso(ts), o.id)))
+        self.ops.append((log, ("INFO", "FILL", "paper_orders", o.id, f"Filled at {price} ({origin})")))
+        self.stats["filled"] += 1
+
+    def close(self, o: Order, hit: str, exit_price: float, ts: float):
+        pnl_gross = (exit_price - o.fill_price) * o.qty if o.side == "BUY" else (o.fill_price - exit_price) * o.qty
+        fees = float(charges.roundtrip_charges(o.fill_price, exit_price, o.qty, CHARGES, _sim_side(o)))
+        pnl_net = pnl_gross - fees
+        o.state = "CLOSED"
+        self._untrack(o)
+        self.ops.append((lambda c, *a: c.execute("""
+            UPDATE paper_orders
+            SET state='CLOSED', exit_price=?, closed_ts_utc=?, pnl_gross=?, pnl_net=?, charges_at_exit=?
+            WHERE id=?""", a), (exit_price, _iso(ts), pnl_gross, pnl_net, fees, o.id)))
+        self.ops.append((log, ("INFO", hit, "paper_orders", o.id,
+            f"Closed at {exit_price} [{o.side}], pnl_gross={pnl_gross:.2f}, pnl_net={pnl_net:.2f}, charges={fees:.2f}")))
+        self.ops.append((log, ("INFO", "CLOSE", "paper_orders", o.id, "Order CLOSED")))
+        self.stats[hit.lower()] += 1
+
+    def flush(self):
+        if not self.ops:
+            return
+        ops, self.ops = self.ops, []
+        with self.conn:
+            for fn, args in ops:
+                fn(self.conn, *args)
+
+    # ---- loop ----
+    def step(self, ticks=()):
+        if ticks:
+            self.on_ticks(ticks)
+        self.fill_overdue(time.time())
+        self.flush()
+
+    def run(self, once: bool = False):
+        self.load_open()
+        next_sig = next_tail = next_slip = 0.0
+        while True:
+            now = time.time()
+            if now >= next_sig:
+                self.poll_signals()
+                next_sig = now + SIGNAL_SECS
+            if now >= next_slip:
+                self.refresh_slippage()
+                next_slip = now + SLIP_SECS
+            ticks = []
+            if now >= next_tail or once:
+                ticks = self.tail()
+                next_tail = now + TAIL_SECS
+            self.step(ticks)
+            if once:
+                return
+            wait = min(next_sig, next_tail) - time.time()
+            if self.pending:
+                wait = min(wait, self.pending[0][0] + FILL_GRACE_SECS - time.time())
+            wait = max(0.0, wait)
+            if self.sub is not None:
+                # bus ticks are in epoch ms; block on the socket until the next scheduled job
+                self.step([(s, t / 1000.0, p) for s, t, p in self.sub.recv(timeout=wait)])
+            else:
+                time.sleep(wait)
 
 # ----------------- Main loop -----------------
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default=DB)
-    ap.add_argument("--batch", type=int, default=5, help="how many signals to convert this pass")
-    ap.add_argument("--tick", type=float, default=2.0, help="seconds between loop iterations")
-    ap.add_argument("--once", action="store_true", help="run a single pass only")
+    ap.add_argument("--batch", type=int, default=50, help="max signals converted per poll")
+    ap.add_argument("--once", action="store_true", help="run a single catch-up pass only")
+    ap.add_argument("--no-bus", action="store_true", help="ignore the LTP push channel; tail ltp_ticks only")
+    ap.add_argument("--tick", type=float, default=None, help="deprecated; event-driven loop")   # accepted for old launchers
     args = ap.parse_args()
 
-    conn = sqlite3.connect(args.db)
+    conn = sqlite3.connect(args.db, timeout=30)
     conn.row_factory = sqlite3.Row
-
-    # 1) Create orders from ready signals (avoid duplicates)
-    sigs = fetch_ready_signals(conn, args.batch)
-    for s in sigs:
-        exists = conn.execute("SELECT 1 FROM paper_orders WHERE signal_row_id=?", (s["id"],)).fetchone()
-        if exists:
-            continue
-        _ = create_paper_order(conn, s)
-        conn.commit()
-
-    # 2) Fill due orders and check closes
-    if args.once:
-        for r in due_fill_ids(conn):
-            try_fill_order(conn, r["id"]); conn.commit()
-        for r in filled_ids(conn):
-            check_and_close(conn, r["id"]); conn.commit()
-    else:
-        while True:
-            for r in due_fill_ids(conn):
-                try_fill_order(conn, r["id"]); conn.commit()
-            for r in filled_ids(conn):
-                check_and_close(conn, r["id"]); conn.commit()
-            time.sleep(args.tick)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    ltp_store.ensure_schema(conn)
+
+    sub = None
+    if not (args.once or args.no_bus):
+        try:
+            sub = LtpSubscriber()
+        except (OSError, ValueError) as e:
+            print(f"[WARN] LTP bus unavailable ({e}); tailing ltp_ticks every {TAIL_SECS}s")
+
+    eng = M9Engine(conn, batch=args.batch, sub=sub)
+    try:
+        eng.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        eng.flush()
+        print(f"[OK] M9 stats: {dict(eng.stats)} open={len(eng.orders)}")
 
 if __name__ == "__main__":
     main()
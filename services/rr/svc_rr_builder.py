@@ -1,12 +1,30 @@
 # C:\teevra18\services\rr\svc_rr_builder.py
+"""
+M8 RR builder: bands (sl_price / tp_price / rr_ratio) and rr_validated /
+rr_reject_reason for new signals.
+
+Schema checks run once at startup. After that each pass reads only signals
+with rowid above a high-water mark and rr_validated IS NULL, validates the
+whole batch with array ops and writes it back with one executemany in one
+transaction. In follow mode the poll runs every RR_POLL_MS, so a signal
+emitted by M7 is validated well under a second later. Every
+RR_RESCAN_SECS the mark is reset to 0, which picks up rows whose
+rr_validated was cleared by a backfill.
+
+    python services\rr\svc_rr_builder.py                 # one catch-up pass (all pending)
+    python services\rr\svc_rr_builder.py follow          # long-lived service
+"""
 from common.bootstrap import init_runtime
 init_runtime()
 import os
 import sys
+import time
 import sqlite3
 import logging
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
 # --- Project root + lib path ---
@@ -27,6 +45,9 @@ load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
 MAX_SL_PER_LOT = float(os.getenv("MAX_SL_PER_LOT", 1000))
 RR_MIN         = float(os.getenv("RR_MIN", 2.0))
 RR_EPS         = float(os.getenv("RR_EPS", 1e-6))  # tolerance to beat float rounding
+POLL_MS        = int(os.getenv("RR_POLL_MS", 250))
+BATCH          = int(os.getenv("RR_BATCH", 500))
+RESCAN_SECS    = float(os.getenv("RR_RESCAN_SECS", 300))
 
 logging.basicConfig(
     filename=LOG_PATH,
@@ -46,7 +67,7 @@ OPTIONAL_COLS = {
     "entry_price": "REAL",
     "lot_size": "REAL"
 }
-CANDIDATE_KEYS = ["signal_id", "id", "sig_id", "uuid", "guid", "nonce"]
+RR_PROFILE = {"sl_cap_per_lot": MAX_SL_PER_LOT, "rr_min": RR_MIN, "rr_eps": RR_EPS}
 
 # --- Helpers ---
 def ensure_columns(conn, table, required, optional):
@@ -70,19 +91,16 @@ def ensure_columns(conn, table, required, optional):
 
     conn.commit()
 
-def detect_key_column(conn, table="signals"):
-    cur = conn.cursor()
-    cur.execute(f"PRAGMA table_info({table});")
-    cols = [row[1] for row in cur.fetchall()]
-    for name in CANDIDATE_KEYS:
-        if name in cols:
-            return name, False  # not rowid
-    return "rowid", True
+def _col(df, name, numeric=True):
+    if name not in df.columns:
+        return pd.Series(np.nan if numeric else None, index=df.index, dtype=float if numeric else object)
+    return pd.to_numeric(df[name], errors="coerce") if numeric else df[name]
 
-# --- Core validation ---
-def validate_signal(sig, rr_profile):
+# --- Core validation (vectorised) ---
+def validate_frame(sigs: pd.DataFrame, rr_profile) -> pd.DataFrame:
     """
-    Validates one signal and returns (bands_dict, reject_reason_or_None).
+    Validates a batch of signals; returns a frame aligned with sigs:
+    sl_price, tp_price, rr_ratio (NaN when rejected), ok, reason.
 
     PATH A (preferred): use base columns if present -> side, entry, stop, target, rr, sl_per_lot.
     PATH B (fallback): use direction, entry_price, lot_size to derive bands.
@@ -90,106 +108,146 @@ def validate_signal(sig, rr_profile):
     rr_min = rr_profile.get("rr_min", RR_MIN)
     sl_cap = rr_profile.get("sl_cap_per_lot", MAX_SL_PER_LOT)
     eps    = rr_profile.get("rr_eps", RR_EPS)
+    n = len(sigs)
+    reason = np.full(n, None, dtype=object)
 
     # ---------- PATH A ----------
-    base_have = all(k in sig and pd.notna(sig[k]) for k in ("side", "entry", "stop", "target"))
-    if base_have:
-        side   = str(sig["side"]).upper()
-        entry  = float(sig["entry"])
-        stop   = float(sig["stop"])
-        target = float(sig["target"])
-
-        rr_ratio = float(sig["rr"]) if "rr" in sig and pd.notna(sig["rr"]) else (
-            abs((target - entry) / (entry - stop)) if entry != stop else 0.0
-        )
-
-        if "sl_per_lot" in sig and pd.notna(sig["sl_per_lot"]):
-            sl_per_lot = float(sig["sl_per_lot"])
-        else:
-            lot = float(sig["lot_size"]) if "lot_size" in sig and pd.notna(sig["lot_size"]) else 1.0
-            sl_per_lot = abs(entry - stop) * lot
-
-        if sl_per_lot > sl_cap + 1e-9:
-            return None, f"SL exceeds {sl_cap}/lot"
-        if rr_ratio + eps < rr_min:
-            return None, f"RR {rr_ratio:.2f} < {rr_min}"
-
-        return {"sl_price": stop, "tp_price": target, "rr_ratio": rr_ratio}, None
+    entry, stop, target = _col(sigs, "entry").to_numpy(), _col(sigs, "stop").to_numpy(), _col(sigs, "target").to_numpy()
+    side = _col(sigs, "side", numeric=False)
+    path_a = side.notna().to_numpy() & ~np.isnan(entry) & ~np.isnan(stop) & ~np.isnan(target)
+    denom = entry - stop
+    rr_calc = np.abs(np.divide(target - entry, denom, out=np.zeros(n), where=denom != 0))
+    rr_given = _col(sigs, "rr").to_numpy()
+    rr_a = np.where(np.isnan(rr_given), rr_calc, rr_given)
+    lot = _col(sigs, "lot_size").to_numpy()
+    slpl_given = _col(sigs, "sl_per_lot").to_numpy()
+    slpl = np.where(np.isnan(slpl_given), np.abs(denom) * np.where(np.isnan(lot), 1.0, lot), slpl_given)
 
     # ---------- PATH B ----------
-    for f in ("direction", "entry_price", "lot_size"):
-        if f not in sig or pd.isna(sig.get(f)):
-            return None, f"missing_field:{f}"
-
-    entry = float(sig["entry_price"])
-    lots  = max(1.0, float(sig["lot_size"]))
-    direction = str(sig["direction"]).upper()
+    direction = _col(sigs, "direction", numeric=False).astype(str).str.upper().to_numpy()
+    entry_b = _col(sigs, "entry_price").to_numpy()
+    lots = np.maximum(1.0, np.nan_to_num(lot, nan=1.0))
     price_risk = sl_cap / lots
+    lg = direction == "LONG"
+    sl_b = np.where(lg, entry_b - price_risk, entry_b + price_risk)
+    tp_b = np.where(lg, entry_b + price_risk * rr_min, entry_b - price_risk * rr_min)
+    denom_b = entry_b - sl_b
+    rr_b = np.abs(np.divide(tp_b - entry_b, denom_b, out=np.zeros(n), where=denom_b != 0))
+    slpl_b = lots * np.abs(denom_b)
+
+    sl_price = np.where(path_a, stop, sl_b)
+    tp_price = np.where(path_a, target, tp_b)
+    rr_ratio = np.where(path_a, rr_a, rr_b)
+    sl_cost = np.where(path_a, slpl, slpl_b)
+
+    # reasons, lowest precedence first (later assignments win)
+    bad_rr = rr_ratio + eps < rr_min
+    reason[bad_rr] = [f"RR {r:.2f} < {rr_min}" for r in rr_ratio[bad_rr]]
+    reason[sl_cost > sl_cap + 1e-9] = f"SL exceeds {sl_cap}/lot"
+    b = ~path_a
+    bad_dir = b & ~np.isin(direction, ("LONG", "SHORT"))
+    reason[bad_dir] = [f"bad_direction:{d}" for d in direction[bad_dir]]
+    for f in ("lot_size", "entry_price", "direction"):
+        reason[b & _col(sigs, f, numeric=(f != "direction")).isna().to_numpy()] = f"missing_field:{f}"
+
+    ok = pd.isna(reason)
+    return pd.DataFrame({"sl_price": np.where(ok, sl_price, np.nan), "tp_price": np.where(ok, tp_price, np.nan),
+                         "rr_ratio": np.where(ok, rr_ratio, np.nan), "ok": ok, "reason": reason}, index=sigs.index)
 
-    if direction == "LONG":
-        sl_price = entry - price_risk
-        tp_price = entry + (price_risk * rr_min)
-    elif direction == "SHORT":
-        sl_price = entry + price_risk
-        tp_price = entry - (price_risk * rr_min)
-    else:
-        return None, f"bad_direction:{direction}"
-
-    if lots * abs(entry - sl_price) > sl_cap + 1e-9:
-        return None, f"SL exceeds {sl_cap}/lot"
-
-    rr_ratio = abs((tp_price - entry) / (entry - sl_price)) if entry != sl_price else 0.0
-    if rr_ratio + eps < rr_min:
-        return None, f"RR {rr_ratio:.2f} < {rr_min}"
-
-    return {"sl_price": sl_price, "tp_price": tp_price, "rr_ratio": rr_ratio}, None
-
-# --- Main run ---
-def run_once():
-    conn = sqlite3.connect(DB_PATH)
+def validate_signal(sig, rr_profile):
+    """
+    Validates one signal and returns (bands_dict, reject_reason_or_None).
+    Single-row form of validate_frame.
+    """
+    r = validate_frame(pd.DataFrame([sig]), rr_profile).iloc[0]
+    if not r["ok"]:
+        return None, r["reason"]
+    return {"sl_price": float(r["sl_price"]), "tp_price": float(r["tp_price"]), "rr_ratio": float(r["rr_ratio"])}, None
+
+# --- Incremental passes ---
+UPDATE_SQL = """
+    UPDATE signals
+    SET sl_price=COALESCE(?, sl_price), tp_price=COALESCE(?, tp_price), rr_ratio=COALESCE(?, rr_ratio),
+        rr_validated=?, rr_reject_reason=?
+    WHERE rowid=?
+"""
+
+def connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
-
+    conn.execute("PRAGMA journal_mode=WAL;")
     ensure_columns(conn, "signals", REQUIRED_COLS, OPTIONAL_COLS)
-    pk_col, is_rowid = detect_key_column(conn, "signals")
-    logging.info(f"signals key column -> {pk_col} (rowid_fallback={is_rowid})")
-
-    select_pk = f"{pk_col} AS pk" if not is_rowid else "rowid AS pk"
-    q = f"""
-    SELECT {select_pk}, *
-    FROM signals
-    WHERE rr_validated IS NULL
-    ORDER BY COALESCE(ts_utc, CURRENT_TIMESTAMP) DESC
-    LIMIT 500
-    """
-    sigs = pd.read_sql(q, conn)
-
+    return conn
+
+def process_batch(conn, after: int, top: int, limit: int = BATCH, rr_profile=RR_PROFILE):
+    """Validate up to `limit` pending signals with after < rowid <= top. Returns (count, last rowid)."""
+    sigs = pd.read_sql("""
+        SELECT rowid AS pk, * FROM signals
+        WHERE rowid > ? AND rowid <= ? AND rr_validated IS NULL
+        ORDER BY rowid LIMIT ?""", conn, params=(after, top, limit))
     if sigs.empty:
-        logging.info("No pending signals for RR validation.")
-        conn.close()
-        return
-
-    for _, sig in sigs.iterrows():
-        rr_profile = {"sl_cap_per_lot": MAX_SL_PER_LOT, "rr_min": RR_MIN, "rr_eps": RR_EPS}
-        bands, reason = validate_signal(sig, rr_profile)
-        if bands:
-            sql = (
-                "UPDATE signals SET sl_price=?, tp_price=?, rr_ratio=?, rr_validated=1, rr_reject_reason=NULL WHERE rowid=?"
-                if is_rowid else
-                f"UPDATE signals SET sl_price=?, tp_price=?, rr_ratio=?, rr_validated=1, rr_reject_reason=NULL WHERE {pk_col}=?"
-            )
-            conn.execute(sql, (bands["sl_price"], bands["tp_price"], bands["rr_ratio"], sig["pk"]))
-            logging.info(f"Signal {sig['pk']} VALID: RR={bands['rr_ratio']:.2f}")
+        return 0, top
+    res = validate_frame(sigs, rr_profile)
+    nan_none = lambda a: [None if pd.isna(x) else float(x) for x in a]
+    rows = list(zip(nan_none(res["sl_price"]), nan_none(res["tp_price"]), nan_none(res["rr_ratio"]),
+                    res["ok"].astype(int).tolist(), res["reason"].tolist(), sigs["pk"].astype(int).tolist()))
+    with conn:
+        conn.executemany(UPDATE_SQL, rows)
+    for pk, ok, rr, reason in zip(sigs["pk"], res["ok"], res["rr_ratio"], res["reason"]):
+        if ok:
+            logging.info(f"Signal {pk} VALID: RR={rr:.2f}")
         else:
-            sql = (
-                "UPDATE signals SET rr_validated=0, rr_reject_reason=? WHERE rowid=?"
-                if is_rowid else
-                f"UPDATE signals SET rr_validated=0, rr_reject_reason=? WHERE {pk_col}=?"
-            )
-            conn.execute(sql, (reason, sig["pk"]))
-            logging.warning(f"Signal {sig['pk']} REJECT: {reason}")
+            logging.warning(f"Signal {pk} REJECT: {reason}")
+    return len(sigs), int(sigs["pk"].iloc[-1])
+
+def drain(conn, hwm: int = 0, limit: int = BATCH) -> tuple:
+    """All pending signals above the high-water mark, batch by batch. Returns (count, new mark)."""
+    top = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM signals").fetchone()[0]
+    total = 0
+    while hwm < top:
+        n, last = process_batch(conn, hwm, top, limit)
+        total += n
+        hwm = last if n == limit else top
+    return total, hwm
 
-    conn.commit()
+# --- Main run ---
+def run_once():
+    conn = connect()
+    n, _ = drain(conn)
+    logging.info(f"Validated {n} pending signals." if n else "No pending signals for RR validation.")
     conn.close()
+    return n
+
+def follow(poll_ms: int = POLL_MS, limit: int = BATCH, rescan_secs: float = RESCAN_SECS):
+    conn = connect()
+    hwm, next_rescan = 0, time.monotonic() + rescan_secs
+    try:
+        while True:
+            if time.monotonic() >= next_rescan:
+                hwm, next_rescan = 0, time.monotonic() + rescan_secs
+            n, hwm = drain(conn, hwm, limit)
+            if n:
+                logging.info(f"Validated {n} signals (high-water rowid {hwm})")
+            time.sleep(poll_ms / 1000)
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        conn.close()
+
+def main():
+    ap = argparse.ArgumentParser(description="Teevra18 M8 RR builder")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("once", help="validate everything pending, then exit (default)")
+    f = sub.add_parser("follow", help="long-lived: validate new signals as they arrive")
+    f.add_argument("--poll-ms", type=int, default=POLL_MS)
+    f.add_argument("--batch", type=int, default=BATCH)
+    f.add_argument("--rescan-secs", type=float, default=RESCAN_SECS)
+    args = ap.parse_args()
+    if args.cmd == "follow":
+        print("Following signals… Ctrl+C to stop")
+        follow(args.poll_ms, args.batch, args.rescan_secs)
+    else:
+        run_once()
 
 if __name__ == "__main__":
-    run_once()
+    main()
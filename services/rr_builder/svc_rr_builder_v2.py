@@ -1,7 +1,7 @@
 from common.bootstrap import init_runtime
 init_runtime()
 import argparse, sqlite3, json
-from rr_rules_v2 import validate_signal_row
+from rr_rules_v2 import validate_signals
 
 def fetch_candidate_signals(conn, limit):
     sql = """
@@ -21,19 +21,18 @@ def fetch_candidate_signals(conn, limit):
         })
     return out
 
-def mark_result(conn, rowid, ok, reason, metrics):
-    if ok:
-        conn.execute("""
-          UPDATE signals
-          SET rr_validated=1, rr_reject_reason=NULL, rr_metrics_json=?
-          WHERE rowid=?
-        """, (json.dumps(metrics), rowid))
-    else:
-        conn.execute("""
-          UPDATE signals
-          SET rr_validated=0, rr_reject_reason=?, state='ARCHIVED', rr_metrics_json=?
-          WHERE rowid=?
-        """, (reason, json.dumps(metrics), rowid))
+def mark_results(conn, results):
+    """results: [(rowid, ok, reason, metrics)]; one executemany per outcome."""
+    conn.executemany("""
+      UPDATE signals
+      SET rr_validated=1, rr_reject_reason=NULL, rr_metrics_json=?
+      WHERE rowid=?
+    """, [(json.dumps(m), rowid) for rowid, ok, _, m in results if ok])
+    conn.executemany("""
+      UPDATE signals
+      SET rr_validated=0, rr_reject_reason=?, state='ARCHIVED', rr_metrics_json=?
+      WHERE rowid=?
+    """, [(reason, json.dumps(m), rowid) for rowid, ok, reason, m in results if not ok])
 
 def main():
     ap = argparse.ArgumentParser()
@@ -51,17 +50,19 @@ def main():
         print("[M8] No pending signals.")
         return
 
-    accepted = 0
-    for s in cands:
-        ok, reason, metrics = validate_signal_row(conn, s, profile_name=args.profile)
+    # one profile load and one vectorised pass for the whole batch
+    oks, reasons, metrics = validate_signals(conn, cands, profile_name=args.profile)
+    results = []
+    for s, ok, reason, m in zip(cands, oks, reasons, metrics):
         tag = "ACCEPT" if ok else f"REJECT({reason})"
         print(f"[{tag}] {s['signal_id']} {s['option_symbol']} {s['side']} lots={s['lots']} "
               f"entry={s['entry_price']} sl={s['sl_points']} tp={s['tp_points']} "
-              f"rr_eff={metrics['rr_eff']:.2f} risk₹={metrics['effective_risk']:.0f}")
-        if not args.dry_run:
-            mark_result(conn, s["rowid"], ok, reason, metrics)
-            conn.commit()
-        if ok: accepted += 1
+              f"rr_eff={m['rr_eff']:.2f} risk₹={m['effective_risk']:.0f}")
+        results.append((s["rowid"], bool(ok), reason, m))
+    if not args.dry_run:
+        with conn:
+            mark_results(conn, results)
+    accepted = sum(1 for r in results if r[1])
 
     print(f"[M8] Done. Accepted={accepted}, Reviewed={len(cands)}.")
 
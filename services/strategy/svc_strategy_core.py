@@ -3,6 +3,7 @@ from common.bootstrap import init_runtime
 init_runtime()
 import os, sys, sqlite3, datetime, uuid, hashlib, argparse, json, warnings
 from pathlib import Path
+import numpy as np
 import pandas as pd
 warnings.filterwarnings("ignore", category=UserWarning, module="pandas")
 
@@ -12,6 +13,8 @@ if str(PROJECT_ROOT / "lib") not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT / "lib"))
 
 from t18_db_helpers import t18_fetch_lot_size
+from teevra.strategy_registry import REGISTRY, LONG
+from teevra import candles_latest, instruments
 
 # --- Paths & constants ---
 DB  = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
@@ -23,6 +26,7 @@ RR_MIN = 2.0
 SL_PER_LOT_CAP = 1000.0
 GROUP_NAME_DEFAULT = "LIVE"
 STRATEGY_ID = "core_v1"
+LOOKBACK_SECS = int(os.getenv("M7_LOOKBACK_SECS", str(5 * 86400)))  # slice scanned for last-N bars
 
 # -------------------- Utility helpers --------------------
 def now_utc():
@@ -80,23 +84,9 @@ def count_today(conn):
     ).fetchone()[0]
 
 # -------------------- Master CSV (optional) --------------------
-import pandas as pd
-from pandas.errors import EmptyDataError
-
 def load_master():
-    # Ensure MASTER_CSV points to a real file; fall back to empty frame if not
-    try:
-        if not MASTER_CSV.exists() or MASTER_CSV.stat().st_size == 0:
-            print(f"[WARN] MASTER_CSV missing/empty at {MASTER_CSV}; continuing with empty master.")
-            return pd.DataFrame()
-        df = pd.read_csv(MASTER_CSV, low_memory=False)
-        return df
-    except EmptyDataError:
-        print(f"[WARN] MASTER_CSV has no columns: {MASTER_CSV}; continuing with empty master.")
-        return pd.DataFrame()
-    except Exception as e:
-        print(f"[WARN] MASTER_CSV load failed ({e}); continuing with empty master.")
-        return pd.DataFrame()
+    # memory-mapped cache of MASTER_CSV (teevra.instruments); empty master + [WARN] if the CSV is missing
+    return instruments.master(MASTER_CSV)
 
 
 # -------------------- Candle column detection (robust) --------------------
@@ -137,7 +127,7 @@ def _guess_ts_by_sample(conn, table="candles_1m"):
 def detect_candle_columns(conn, table="candles_1m"):
     colnames = _colmap(conn, table)
     ts_col = _pick_exact(colnames, [
-        "ts_utc","ts","bar_time_utc","timestamp","time_utc","dt_utc"
+        "ts_utc","ts","t_start","bar_time_utc","timestamp","time_utc","dt_utc"
     ]) or _pick_contains(colnames, ["ts_utc","timestamp","datetime","time","bar"]) \
       or _guess_ts_by_sample(conn, table)
     if not ts_col:
@@ -158,52 +148,80 @@ def detect_candle_columns(conn, table="candles_1m"):
         raise RuntimeError(f"{table}: missing OHLC columns -> {', '.join(missing)}")
     return {"ts": ts_col, "sid": sid_col, "o": open_col, "h": high_col, "l": low_col, "c": close_col}
 
-def fetch_last2(conn, table="candles_1m"):
+def _is_numeric_ts(conn, table, ts):
+    r = conn.execute(f"SELECT typeof({ts}) FROM {table} WHERE {ts} IS NOT NULL LIMIT 1").fetchone()
+    return bool(r) and r[0] in ("integer", "real")
+
+def fetch_lastn(conn, table="candles_1m", n=2, lookback_secs=LOOKBACK_SECS):
+    """
+    Last `n` bars per instrument as columnar arrays:
+        {"sid": (m,) object, "ts": (m,n), "o"/"h"/"l"/"c": (m,n) float64}
+    Column -1 is the current bar. Instruments with fewer than n bars are skipped.
+    Served from candles_latest (universe x n rows) when the candle writer
+    maintains it for this table; otherwise a ROW_NUMBER window over a recent
+    time slice (epoch ts + index) instead of reading the whole table into pandas.
+    """
+    tf = table[len("candles_"):] if table.startswith("candles_") else None
+    if tf in candles_latest.TIMEFRAMES and n <= candles_latest.K and candles_latest.has_latest(conn, tf):
+        b = candles_latest.latest_bars(conn, tf, n)
+        return {k: b[k] for k in ("sid", "ts", "o", "h", "l", "c")}
     cols = detect_candle_columns(conn, table)
     ts, sid, o, h, l, c = cols["ts"], cols["sid"], cols["o"], cols["h"], cols["l"], cols["c"]
-    # Portable: fetch last N and pair in pandas (works even if window functions are limited)
-    sql = f"SELECT {ts} AS ts_col, {sid} AS sid, {o} AS o, {h} AS h, {l} AS l, {c} AS c FROM {table};"
-    df = pd.read_sql_query(sql, conn)
-    if df.empty: return {}
-    # sort per sid by ts; keep last 2
-    pairs = {}
-    for sid_val, g in df.groupby("sid"):
-        g = g.sort_values("ts_col")
-        if len(g) >= 2:
-            prev = {"ts_utc": g.iloc[-2]["ts_col"], "security_id": sid_val,
-                    "open": g.iloc[-2]["o"], "high": g.iloc[-2]["h"],
-                    "low": g.iloc[-2]["l"], "close": g.iloc[-2]["c"]}
-            curr = {"ts_utc": g.iloc[-1]["ts_col"], "security_id": sid_val,
-                    "open": g.iloc[-1]["o"], "high": g.iloc[-1]["h"],
-                    "low": g.iloc[-1]["l"], "close": g.iloc[-1]["c"]}
-            pairs[str(sid_val)] = (prev, curr)
-    return pairs
-
-# -------------------- Strategies --------------------
-def strat_bo2(prev,curr):
-    if curr["close"]>prev["high"]: return {"side":"LONG","reason":"close>prev_high"}
-    if curr["close"]<prev["low"] : return {"side":"SHORT","reason":"close<prev_low"}
-    return None
-
-def strat_rb1(prev,curr):
-    rng=max(1e-9, prev["high"]-prev["low"])
-    upper=prev["high"]-0.1*rng; lower=prev["low"]+0.1*rng
-    if curr["close"]<=lower: return {"side":"LONG","reason":"close<=lower10%"}
-    if curr["close"]>=upper: return {"side":"SHORT","reason":"close>=upper10%"}
-    return None
-
-def build_candidate(group,strat_id,prev,curr,min_rr):
-    if strat_id=="BO2": ans=strat_bo2(prev,curr)
-    elif strat_id=="RB1": ans=strat_rb1(prev,curr)
-    else: ans=None
-    if not ans: return None
-    side=ans["side"]; entry=float(curr["close"])
-    if side=="LONG":
-        stop=float(prev["low"]); sl=max(1e-9, entry-stop); target=entry+min_rr*sl
-    else:
-        stop=float(prev["high"]); sl=max(1e-9, stop-entry); target=entry-min_rr*sl
-    rr=abs((target-entry)/(entry-stop)) if entry!=stop else 0.0
-    return {"group_name":group,"strategy_id":strat_id,"side":side,"entry":entry,"stop":stop,"target":target,"rr":rr,"reason":ans["reason"]}
+    where, params = "", []
+    if lookback_secs and _is_numeric_ts(conn, table, ts):
+        mx = conn.execute(f"SELECT MAX({ts}) FROM {table}").fetchone()[0]
+        if mx is not None:
+            span = lookback_secs * (1000 if float(mx) > 1e12 else 1)   # epoch ms vs s
+            where, params = f"WHERE {ts} >= ?", [mx - span]
+    sql = f"""
+        SELECT sid, ts_col, o, h, l, c FROM (
+            SELECT {sid} AS sid, {ts} AS ts_col, {o} AS o, {h} AS h, {l} AS l, {c} AS c,
+                   ROW_NUMBER() OVER (PARTITION BY {sid} ORDER BY {ts} DESC) AS rn
+            FROM {table} {where}
+        ) WHERE rn <= ? ORDER BY sid, ts_col
+    """
+    try:
+        rows = conn.execute(sql, params + [n]).fetchall()
+    except sqlite3.OperationalError:
+        # SQLite < 3.25 (no window functions): per-instrument LIMIT n on the PK index
+        rows = []
+        for (sv,) in conn.execute(f"SELECT DISTINCT {sid} FROM {table}").fetchall():
+            part = conn.execute(
+                f"SELECT {sid}, {ts}, {o}, {h}, {l}, {c} FROM {table} WHERE {sid}=? ORDER BY {ts} DESC LIMIT ?",
+                (sv, n)).fetchall()
+            rows.extend(reversed(part))
+    empty = {"sid": np.array([], dtype=object), "ts": np.empty((0, n), dtype=object),
+             **{k: np.empty((0, n)) for k in ("o", "h", "l", "c")}}
+    if not rows:
+        return empty
+    sids = np.array([r[0] for r in rows], dtype=object)
+    starts = np.flatnonzero(np.r_[True, sids[1:] != sids[:-1]])
+    counts = np.diff(np.r_[starts, len(rows)])
+    starts = starts[counts >= n]
+    if not len(starts):
+        return empty
+    idx = starts[:, None] + np.arange(n)[None, :]
+    ohlc = np.array([r[2:6] for r in rows], dtype=np.float64)
+    return {"sid": sids[starts], "ts": np.array([r[1] for r in rows], dtype=object)[idx],
+            "o": ohlc[idx, 0], "h": ohlc[idx, 1], "l": ohlc[idx, 2], "c": ohlc[idx, 3]}
+
+# -------------------- Strategies (compiled registry, vectorised over the universe) --------------------
+def build_candidates(strat_id, bars, min_rr):
+    """Evaluate one registered strategy across all instruments; returns columnar bands (side==0 -> none)."""
+    m = len(bars["sid"])
+    cs = REGISTRY.get(strat_id)
+    if cs is None or not m:
+        z = np.zeros(m)
+        return {"side": np.zeros(m, dtype=np.int8), "entry": z, "stop": z, "target": z, "rr": z, "reasons": {}}
+    ns = cs.namespace(bars) if bars["c"].shape[1] >= cs.bars_needed else None
+    side = cs.evaluate(bars, ns) if ns is not None else np.zeros(m, dtype=np.int8)
+    entry = bars["c"][:, -1]
+    stop = cs.stops(bars, side, ns) if ns is not None else entry.copy()
+    sl = np.maximum(1e-9, np.where(side == LONG, entry - stop, stop - entry))
+    target = entry + side * min_rr * sl
+    denom = entry - stop
+    rr = np.abs(np.divide(target - entry, denom, out=np.zeros_like(entry), where=denom != 0))
+    return {"side": side, "entry": entry, "stop": stop, "target": target, "rr": rr, "reasons": cs.reasons}
 
 # -------------------- Emitters --------------------
 def emit_signal_base(conn, symbol: str, group_name: str, c: dict, lot: float):
@@ -263,58 +281,73 @@ def main():
         if today>=day_cap:
             print(f"[LIMIT] {today}/{day_cap} today."); return
 
-        # fetch last 2 candles per instrument (robust column detection)
+        # strategies: built-ins + inline config specs + Strategy Lab saves with rules (compiled once, cached)
+        REGISTRY.load_config(groups_cfg)
+        REGISTRY.load_catalog(conn)
+        enabled_ids = [st.get("id", "NA") for grp in groups_cfg if grp.get("enabled", True)
+                       for st in grp.get("strategies", []) if st.get("enabled", True)]
+
+        # fetch last N candles per instrument (robust column detection), columnar
         try:
-            pairs = fetch_last2(conn, table="candles_1m")
+            bars = fetch_lastn(conn, table="candles_1m", n=REGISTRY.bars_needed(enabled_ids))
         except Exception as e:
             print(f"[ERR] candles_1m column detection: {e}")
             return
 
         # master csv (optional) – gives symbols and lots; else we’ll fall back to tolerant lookup
         master = load_master()
+        sym_lot = {}
+        def symbol_lot(sid):
+            # resolved lazily, only for instruments that produced a candidate
+            if sid not in sym_lot:
+                md = master.by_sid(sid) or {}
+                symbol = md.get("symbol") or str(sid)
+                lot = md.get("lot_size") or t18_fetch_lot_size(conn, symbol, default_ls=1.0)
+                sym_lot[sid] = (symbol, float(lot or 1.0))
+            return sym_lot[sid]
 
         emitted = 0
-        for sid,(prev,curr) in pairs.items():
-            # prefer master symbol; else fall back to tolerant lot lookup path
-            md = master.get(str(sid), {"symbol": None, "lot_size": None})
-            symbol = md["symbol"] or str(sid)
-            # lot preference: master -> helper -> 1.0
-            lot = md["lot_size"] if md["lot_size"] else t18_fetch_lot_size(conn, symbol, default_ls=1.0)
-
-            for grp in groups_cfg:
-                if not grp.get("enabled", True):
+        for grp in groups_cfg:
+            if not grp.get("enabled", True):
+                continue
+            gname = grp.get("name", GROUP_NAME_DEFAULT)
+            emit_mode = (grp.get("emit_mode") or "base").lower()  # "base" or "fallback"
+
+            for st in grp.get("strategies", []):
+                if not st.get("enabled", True):
+                    continue
+                strat_id = st.get("id", "NA")
+                cand = build_candidates(strat_id, bars, min_rr)
+                hit = np.flatnonzero(cand["side"] != 0)
+                if not len(hit):
                     continue
-                gname = grp.get("name", GROUP_NAME_DEFAULT)
-                emit_mode = (grp.get("emit_mode") or "base").lower()  # "base" or "fallback"
 
-                for st in grp.get("strategies", []):
-                    if not st.get("enabled", True):
-                        continue
-                    strat_id = st.get("id", "NA")
-                    cand = build_candidate(gname, strat_id, prev, curr, min_rr)
-                    if not cand:
-                        continue
+                # hard gates (M7-side), vectorised over the instruments that fired
+                lots = np.array([symbol_lot(bars["sid"][i])[1] for i in hit])
+                sl_per_lot = np.abs(cand["entry"][hit] - cand["stop"][hit]) * lots
+                ok = (sl_per_lot <= max_sl) & (cand["rr"][hit] + 1e-9 >= min_rr)
 
-                    # hard gates (M7-side)
-                    sl_per_lot = abs(cand["entry"] - cand["stop"]) * float(lot or 1.0)
-                    if sl_per_lot > max_sl:         # SL per lot cap
-                        continue
-                    if cand["rr"] + 1e-9 < min_rr:   # RR threshold, strict (no eps baked globally)
-                        continue
+                for i, lot, slpl in zip(hit[ok], lots[ok], sl_per_lot[ok]):
+                    symbol = symbol_lot(bars["sid"][i])[0]
+                    side = "LONG" if cand["side"][i] == LONG else "SHORT"
+                    c = {"group_name": gname, "strategy_id": strat_id, "side": side,
+                         "entry": float(cand["entry"][i]), "stop": float(cand["stop"][i]),
+                         "target": float(cand["target"][i]), "rr": float(cand["rr"][i]),
+                         "reason": cand["reasons"].get(int(cand["side"][i]), "")}
 
                     if args.dry_run:
-                        print(f"[DRY] {symbol} | {gname}/{strat_id} | {cand['side']} "
-                              f"| E:{cand['entry']} S:{cand['stop']} T:{cand['target']} "
-                              f"| RR:{cand['rr']:.2f} | SL/lot:{sl_per_lot:.2f} | mode={emit_mode}")
+                        print(f"[DRY] {symbol} | {gname}/{strat_id} | {c['side']} "
+                              f"| E:{c['entry']} S:{c['stop']} T:{c['target']} "
+                              f"| RR:{c['rr']:.2f} | SL/lot:{slpl:.2f} | mode={emit_mode}")
                         emitted += 1
                         continue
 
                     if emit_mode == "fallback":
                         # let M8 compute bands using direction, entry_price, lot_size
-                        emit_signal_fallback(conn, symbol, gname, cand["side"], cand["entry"], float(lot or 1.0))
+                        emit_signal_fallback(conn, symbol, gname, c["side"], c["entry"], float(lot))
                     else:
                         # preferred: write base set now
-                        emit_signal_base(conn, symbol, gname, cand, float(lot or 1.0))
+                        emit_signal_base(conn, symbol, gname, c, float(lot))
                     emitted += 1
 
         if not args.dry_run:
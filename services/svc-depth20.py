@@ -1,10 +1,16 @@
 # C:\teevra18\services\svc-depth20.py
-import os, json, time, struct, sqlite3, threading
+from common.bootstrap import init_runtime
+init_runtime()
+import os, json, time, queue, sqlite3, threading
 from datetime import datetime, timezone
 from urllib.parse import urlencode
 from dotenv import load_dotenv
 import pandas as pd
 from websocket import WebSocketApp  # websocket-client
+from teevra.db_writer import get_writer
+from teevra.dhan_decode import depth_dtypes, decode_depth_frame, merge_books, compute_pressures
+from teevra import depth_store
+import numpy as np
 
 # ---------------- Env & Config ----------------
 ROOT = r"C:\teevra18"
@@ -17,6 +23,12 @@ DHAN_ACCESS_TOKEN = os.getenv("DHAN_ACCESS_TOKEN")
 
 assert DHAN_CLIENT_ID and DHAN_ACCESS_TOKEN, "Set DHAN_CLIENT_ID and DHAN_ACCESS_TOKEN in .env"
 
+# Storage: "books" = one row per (security_id, ts) in depth20_books (teevra.depth_store),
+# "levels" = legacy 40 rows per update in depth20_levels, "both" = write both.
+# DEPTH20_DELTA=1 switches depth20_books to changed-levels-only with periodic keyframes.
+DEPTH20_STORE = os.getenv("DEPTH20_STORE", "books").lower()
+BOOK_ENCODER = depth_store.BookEncoder()
+
 # Latency budget (processing)
 LATENCY_WARN_MS = 200.0
 
@@ -25,18 +37,11 @@ LATENCY_WARN_MS = 200.0
 ENDIAN = "<"  # little-endian
 
 # Header: length(int16), feed_code(uint8), exch(uint8), security_id(int32), seq(uint32)  = 12 bytes
-HDR_FMT = ENDIAN + "HBBiI"
-HDR_SIZE = struct.calcsize(HDR_FMT)
-
-# Each level = price(float64) + qty(uint32) + orders(uint32) = 16 bytes
-LVL_FMT = ENDIAN + "dII"
-LVL_SIZE = struct.calcsize(LVL_FMT)
+# Each level = price(float64) + qty(uint32) + orders(uint32) = 16 bytes; 20 levels per side.
+# Decoded whole-frame via NumPy dtypes (teevra.dhan_decode); feed codes BID=41, ASK=51.
+HDR_DTYPE, PKT_DTYPE = depth_dtypes(ENDIAN)
 LEVELS = 20
 
-# Feed codes (per docs)
-FEED_CODE_BID = 41
-FEED_CODE_ASK = 51
-
 EXCH_CODE_MAP = {
     1: "NSE_EQ",   # If Dhan changes codes, adjust here
     2: "NSE_FNO",
@@ -55,71 +60,75 @@ def get_watchlist(db_path=DB_PATH):
         raise RuntimeError("universe_depth20 is empty. Seed it in Step 3.")
     return [{"SecurityId": int(sid), "ExchangeSegment": seg} for sid, seg in rows]
 
+DEPTH_INSERT_SQL = """
+  INSERT OR REPLACE INTO depth20_levels(
+    ts_recv_utc, security_id, exchange_seg, side, level,
+    price, qty, orders, top5_bid_qty, top5_ask_qty, top10_bid_qty, top10_ask_qty,
+    pressure_1_5, pressure_1_10, latency_ms
+  ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
 def insert_levels(rows):
     if not rows:
         return
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.executemany("""
-      INSERT OR REPLACE INTO depth20_levels(
-        ts_recv_utc, security_id, exchange_seg, side, level,
-        price, qty, orders, top5_bid_qty, top5_ask_qty, top10_bid_qty, top10_ask_qty,
-        pressure_1_5, pressure_1_10, latency_ms
-      ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    """, rows)
-    con.commit()
-    con.close()
+    # handed to the shared writer thread; frames are coalesced into one transaction
+    if not get_writer(DB_PATH).submit(DEPTH_INSERT_SQL, rows):
+        print(f"[WARN] depth writer backlog; dropped {len(rows)} rows")
+
+def insert_books(rows):
+    if not rows:
+        return
+    if not get_writer(DB_PATH).submit(depth_store.INSERT_SQL, rows):
+        print(f"[WARN] depth writer backlog; dropped {len(rows)} books")
+
+def ensure_books_schema(db_path=DB_PATH):
+    con = sqlite3.connect(db_path)
+    try:
+        depth_store.ensure_schema(con)
+        con.commit()
+    finally:
+        con.close()
 
 # ---------------- Parsing ----------------
-def compute_pressures(bid_levels, ask_levels):
-    # bid_levels/ask_levels are lists of (price, qty, orders) ordered best->20
-    b5 = sum(q for _, q, _ in bid_levels[:5])
-    a5 = sum(q for _, q, _ in ask_levels[:5])
-    b10 = sum(q for _, q, _ in bid_levels[:10])
-    a10 = sum(q for _, q, _ in ask_levels[:10])
-    def safe_ratio(x, y):
-        s = x + y
-        return (x - y) / s if s else 0.0
-    return b5, a5, b10, a10, safe_ratio(b5, a5), safe_ratio(b10, a10)
-
-def parse_packet(buf, offset, exch_from_hdr=True):
-    # returns (next_offset, snapshot_dict) or (next_offset, None) if unknown code
-    hdr = struct.unpack_from(HDR_FMT, buf, offset)
-    msg_len, feed_code, exch_code, security_id, _seq = hdr
-    start = offset + HDR_SIZE
-    end = offset + msg_len  # msg_len includes header+payload per docs
-    # Sanity: ensure we have full message
-    if end > len(buf):
-        # incomplete frame; drop
-        return len(buf), None
-
-    side = None
-    if feed_code == FEED_CODE_BID:
-        side = "BID"
-    elif feed_code == FEED_CODE_ASK:
-        side = "ASK"
-
-    exchange_seg = EXCH_CODE_MAP.get(exch_code, "NSE_FNO" if exch_code==2 else "NSE_EQ")
-    levels = []
-    pos = start
-    for _ in range(LEVELS):
-        price, qty, orders = struct.unpack_from(LVL_FMT, buf, pos)
-        levels.append((price, int(qty), int(orders)))
-        pos += LVL_SIZE
-
-    return end, {
-        "security_id": int(security_id),
-        "exchange_seg": exchange_seg,
-        "side": side,
-        "levels": levels
-    }
+def exch_names(codes):
+    return [EXCH_CODE_MAP.get(int(c), "NSE_FNO" if int(c) == 2 else "NSE_EQ") for c in codes]
+
+def decode_books(buf):
+    """Decode one depth message into paired BID/ASK books (columnar)."""
+    return merge_books(decode_depth_frame(buf, PKT_DTYPE, HDR_DTYPE))
+
+def books_to_rows(books, ts_iso, latency_ms):
+    """depth20_levels rows (20 per available side) for every book in a frame."""
+    if not len(books["security_id"]):
+        return []
+    pr = compute_pressures(books["bid_qty"], books["ask_qty"])
+    segs = exch_names(books["exch"])
+    lvl = list(range(1, LEVELS + 1))
+    rows = []
+    # per-book scalars once, per-level columns as Python lists (one tolist per array)
+    sids = books["security_id"].tolist()
+    agg = list(zip(pr["top5_bid"].tolist(), pr["top5_ask"].tolist(), pr["top10_bid"].tolist(),
+                   pr["top10_ask"].tolist(), pr["p_1_5"].tolist(), pr["p_1_10"].tolist()))
+    for side in ("bid", "ask"):
+        has = books[f"has_{side}"]
+        price = books[f"{side}_price"].tolist()
+        qty = books[f"{side}_qty"].tolist()
+        orders = books[f"{side}_orders"].tolist()
+        name = side.upper()
+        for i in np.flatnonzero(has).tolist():
+            b5, a5, b10, a10, p15, p110 = agg[i]
+            head = (ts_iso, sids[i], segs[i], name)
+            tail = (b5, a5, b10, a10, p15, p110, latency_ms)
+            rows.extend(head + (l, p, q, o) + tail
+                        for l, p, q, o in zip(lvl, price[i], qty[i], orders[i]))
+    return rows
 
 # ---------------- WebSocket Client ----------------
-def build_subscribe_message(instruments):
+def build_subscribe_message(instruments, request_code=23):
     # RequestCode 23 for 20-Level Market Depth
     # Accepts up to 50 instruments per connection
     msg = {
-        "RequestCode": 23,
+        "RequestCode": request_code,
         "InstrumentCount": len(instruments),
         "InstrumentList": [
             {
@@ -130,101 +139,272 @@ def build_subscribe_message(instruments):
     }
     return json.dumps(msg)
 
-def on_open(ws):
-    print("WS opened; subscribing...")
-    instruments = get_watchlist()
-    sub = build_subscribe_message(instruments)
-    ws.send(sub)
-    print("Subscribed to", len(instruments), "instruments.")
-
-def on_message(ws, message):
-    t_recv = time.perf_counter()
-    ts_iso = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-
-    if isinstance(message, bytes):
-        buf = message
-        offset = 0
-        # Dhan may stack multiple [BID+ASK] packets for multiple instruments in one message.
-        # Use header length to walk the buffer.
-        snapshots = []
-        while offset + HDR_SIZE <= len(buf):
-            try:
-                next_off, snap = parse_packet(buf, offset)
-            except struct.error:
-                break
-            if not snap or snap["side"] is None:
-                offset = next_off
-                continue
-            snapshots.append(snap)
-            offset = next_off
-
-        # Group by security_id to compute pressures using both sides if available
-        by_sid = {}
-        for s in snapshots:
-            by_sid.setdefault(s["security_id"], {}).update({s["side"]: s})
-
-        rows = []
-        t_parsed = time.perf_counter()
-        latency_ms = (t_parsed - t_recv) * 1000.0
-
-        for sid, sides in by_sid.items():
-            bid_levels = sides.get("BID", {}).get("levels", [])
-            ask_levels = sides.get("ASK", {}).get("levels", [])
-            if not bid_levels and not ask_levels:
-                continue
-
-            # If one side missing, compute with zeros for that side
-            b5,a5,b10,a10,p15,p110 = compute_pressures(bid_levels, ask_levels)
-
-            # Insert 20 rows for each available side
-            for side_name, levels in [("BID", bid_levels), ("ASK", ask_levels)]:
-                if not levels: 
-                    continue
-                exchange_seg = sides[side_name]["exchange_seg"]
-                for idx, (price, qty, orders) in enumerate(levels, start=1):
-                    rows.append((
-                        ts_iso, sid, exchange_seg, side_name, idx,
-                        float(price), int(qty), int(orders),
-                        int(b5), int(a5), int(b10), int(a10),
-                        float(p15), float(p110), float(latency_ms)
-                    ))
-        if rows:
-            insert_levels(rows)
-            if latency_ms > LATENCY_WARN_MS:
-                print(f"[WARN] Latency {latency_ms:.1f}ms > {LATENCY_WARN_MS}ms (rows={len(rows)})")
-    else:
-        # Some servers send text keepalives or errors
-        print("TEXT:", message)
-
-def on_error(ws, err):
-    print("WS error:", err)
+def build_unsubscribe_message(instruments):
+    return build_subscribe_message(instruments, request_code=UNSUBSCRIBE_CODE)
 
-def on_close(ws, code, msg):
-    print(f"WS closed: code={code} msg={msg}")
-
-def run_ws():
+def ws_url():
     params = {
         "token": DHAN_ACCESS_TOKEN,
         "clientId": DHAN_CLIENT_ID,
         "authType": 2
     }
-    url = DHAN_WS_BASE + "?" + urlencode(params)
-    ws = WebSocketApp(
-        url,
-        on_open=on_open,
-        on_message=on_message,
-        on_error=on_error,
-        on_close=on_close,
-    )
-    # Auto-reconnect loop
-    while True:
+    return DHAN_WS_BASE + "?" + urlencode(params)
+
+def as_instruments(keys):
+    return [{"SecurityId": sid, "ExchangeSegment": seg} for sid, seg in sorted(keys)]
+
+# ---------------- Sharding ----------------
+# The feed caps one connection at MAX_PER_CONN instruments, so universe_depth20
+# is split over several sockets. Each shard runs its own WebSocketApp thread and
+# only decodes; decoded books go onto one bounded queue drained by a single
+# pipeline thread (encoder state + DB writer are not shared across threads).
+MAX_PER_CONN = int(os.getenv("DEPTH20_MAX_PER_CONN", "50"))
+UNSUBSCRIBE_CODE = int(os.getenv("DEPTH20_UNSUB_CODE", "25"))
+WATCHLIST_REFRESH_SECS = float(os.getenv("DEPTH20_WATCHLIST_REFRESH_SECS", "30"))
+PIPELINE_MAX_QUEUE = int(os.getenv("DEPTH20_PIPELINE_MAX_QUEUE", "2000"))
+METRICS_SECS = float(os.getenv("DEPTH20_METRICS_SECS", "5"))
+RECONNECT_SECS = 3.0
+
+HEALTH_SQL = ("INSERT INTO health(key,value,ts_utc) VALUES(?,?,datetime('now')) "
+              "ON CONFLICT(key) DO UPDATE SET value=excluded.value, ts_utc=datetime('now')")
+
+def plan_shards(wanted, current, cap=MAX_PER_CONN):
+    """
+    Sticky assignment of instrument keys (sid, seg) to shards.
+    Instruments stay on the shard they are already on; removed ones are
+    dropped; new ones fill the least-loaded shards first, then open new shards.
+    `current` is {shard_id: set(keys)}; returns the new {shard_id: set(keys)}
+    (a shard mapped to an empty set should be closed).
+    """
+    wanted = set(wanted)
+    plan = {k: set(v) & wanted for k, v in current.items()}
+    placed = set().union(*plan.values()) if plan else set()
+    todo = sorted(wanted - placed)
+    for sid in sorted(plan, key=lambda k: len(plan[k])):
+        room = cap - len(plan[sid])
+        if room > 0 and todo:
+            plan[sid].update(todo[:room])
+            todo = todo[room:]
+    next_id = max(plan, default=-1) + 1
+    while todo:
+        plan[next_id] = set(todo[:cap])
+        todo = todo[cap:]
+        next_id += 1
+    return plan
+
+class Shard:
+    def __init__(self, shard_id, keys, out_q):
+        self.id = shard_id
+        self.keys = set(keys)
+        self.out_q = out_q
+        self.ws = None
+        self.connected = False
+        self.stop_evt = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=f"depth20-shard{shard_id}", daemon=True)
+        # metrics (written by this shard's thread and the pipeline thread)
+        self.msgs = 0
+        self.books = 0
+        self.rows = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.last_msg = 0.0
+        self.last_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_evt.set()
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+
+    def update(self, keys):
+        """Apply a new instrument set on the live socket (diff subscribe/unsubscribe)."""
+        keys = set(keys)
+        with self.lock:
+            add, drop = keys - self.keys, self.keys - keys
+            self.keys = keys
+            if not self.connected:
+                return          # on_open subscribes the full set
+            try:
+                if drop:
+                    self.ws.send(build_unsubscribe_message(as_instruments(drop)))
+                if add:
+                    self.ws.send(build_subscribe_message(as_instruments(add)))
+            except Exception as e:
+                print(f"[WARN] shard{self.id} resubscribe failed: {e}")
+                return
+        if add or drop:
+            print(f"[INFO] shard{self.id}: +{len(add)} -{len(drop)} -> {len(keys)} instruments")
+
+    # --- socket callbacks ----------------------------------------------------
+    def on_open(self, ws):
+        with self.lock:
+            self.connected = True
+            if self.keys:
+                ws.send(build_subscribe_message(as_instruments(self.keys)))
+        print(f"shard{self.id}: WS opened; subscribed to {len(self.keys)} instruments.")
+
+    def on_message(self, ws, message):
+        t_recv = time.perf_counter()
+        ts_iso = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        if isinstance(message, bytes):
+            # Dhan may stack multiple [BID+ASK] packets for multiple instruments in one message;
+            # the whole message is decoded in one call.
+            try:
+                books = decode_books(message)
+            except ValueError:
+                return
+            self.msgs += 1
+            self.last_msg = time.time()
+            if not len(books["security_id"]):
+                return
+            try:
+                self.out_q.put_nowait((self, t_recv, ts_iso, books))
+            except queue.Full:
+                self.dropped += len(books["security_id"])
+        else:
+            # Some servers send text keepalives or errors
+            print(f"shard{self.id} TEXT:", message)
+
+    def on_error(self, ws, err):
+        print(f"shard{self.id} WS error:", err)
+
+    def on_close(self, ws, code, msg):
+        self.connected = False
+        print(f"shard{self.id} WS closed: code={code} msg={msg}")
+
+    def _run(self):
+        # Auto-reconnect loop
+        while not self.stop_evt.is_set():
+            self.ws = WebSocketApp(
+                ws_url(),
+                on_open=self.on_open,
+                on_message=self.on_message,
+                on_error=self.on_error,
+                on_close=self.on_close,
+            )
+            try:
+                self.ws.run_forever(ping_interval=10, ping_timeout=8)  # library handles pong
+            except Exception as e:
+                print(f"shard{self.id} run_forever exception:", e)
+            self.connected = False
+            if self.stop_evt.wait(RECONNECT_SECS):
+                break
+            self.reconnects += 1
+            print(f"shard{self.id}: reconnecting...")
+
+    def metrics(self) -> dict:
+        return {"instruments": len(self.keys), "connected": int(self.connected), "msgs": self.msgs,
+                "books": self.books, "rows": self.rows, "dropped": self.dropped,
+                "reconnects": self.reconnects, "last_latency_ms": round(self.last_latency_ms, 1),
+                "max_latency_ms": round(self.max_latency_ms, 1),
+                "idle_s": round(time.time() - self.last_msg, 1) if self.last_msg else -1}
+
+class DepthShardManager:
+    """Owns the shards, the shared books pipeline, and the watchlist rebalancer."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.q = queue.Queue(maxsize=PIPELINE_MAX_QUEUE)
+        self.shards = {}
+        self.stop_evt = threading.Event()
+        self._last_metrics = 0.0
+
+    # --- watchlist / rebalancing ---------------------------------------------
+    def rebalance(self):
         try:
-            ws.run_forever(ping_interval=10, ping_timeout=8)  # library handles pong
+            wanted = [(it["SecurityId"], it["ExchangeSegment"]) for it in get_watchlist(self.db_path)]
         except Exception as e:
-            print("run_forever exception:", e)
-        print("Reconnecting in 3s...")
-        time.sleep(3)
+            print(f"[WARN] watchlist: {e}")
+            return
+        plan = plan_shards(wanted, {k: sh.keys for k, sh in self.shards.items()})
+        for sid, keys in plan.items():
+            sh = self.shards.get(sid)
+            if not keys:
+                if sh is not None:
+                    sh.stop()
+                    del self.shards[sid]
+                    get_writer(self.db_path).submit_one("DELETE FROM health WHERE key LIKE ?",
+                                                        (f"depth20_shard{sid}_%",), block=False)
+                    print(f"[INFO] shard{sid} closed (no instruments)")
+            elif sh is None:
+                self.shards[sid] = Shard(sid, keys, self.q).start()
+                print(f"[INFO] shard{sid} started with {len(keys)} instruments")
+            elif keys != sh.keys:
+                sh.update(keys)
+
+    def _t_watchlist(self):
+        while not self.stop_evt.wait(WATCHLIST_REFRESH_SECS):
+            self.rebalance()
+
+    # --- pipeline --------------------------------------------------------------
+    def _handle(self, shard, t_recv, ts_iso, books):
+        # latency = receive -> encoded, including time spent queued behind other shards
+        latency_ms = (time.perf_counter() - t_recv) * 1000.0
+        n = 0
+        if DEPTH20_STORE in ("books", "both"):
+            rows = BOOK_ENCODER.encode(books, ts_iso, latency_ms, exch_names(books["exch"]), books["seq"])
+            insert_books(rows)
+            n += len(rows)
+        if DEPTH20_STORE in ("levels", "both"):
+            rows = books_to_rows(books, ts_iso, latency_ms)
+            insert_levels(rows)
+            n += len(rows)
+        shard.books += len(books["security_id"])
+        shard.rows += n
+        shard.last_latency_ms = latency_ms
+        shard.max_latency_ms = max(shard.max_latency_ms, latency_ms)
+        if n and latency_ms > LATENCY_WARN_MS:
+            print(f"[WARN] shard{shard.id} latency {latency_ms:.1f}ms > {LATENCY_WARN_MS}ms "
+                  f"(rows={n}, backlog={self.q.qsize()})")
+
+    def _publish_metrics(self):
+        rows = [("depth20_pipeline_queue", str(self.q.qsize())), ("depth20_shards", str(len(self.shards))),
+                ("depth20_encoder_rows", str(BOOK_ENCODER.rows_out)),
+                ("depth20_encoder_levels", str(BOOK_ENCODER.levels_out))]
+        for sid, sh in list(self.shards.items()):
+            rows.extend((f"depth20_shard{sid}_{k}", str(v)) for k, v in sh.metrics().items())
+        get_writer(self.db_path).submit(HEALTH_SQL, rows, block=False)
+
+    def _t_pipeline(self):
+        while not self.stop_evt.is_set():
+            try:
+                item = self.q.get(timeout=0.25)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                try:
+                    self._handle(*item)
+                except Exception as e:
+                    print(f"[WARN] depth pipeline: {e!r}")
+            now = time.time()
+            if now - self._last_metrics >= METRICS_SECS:
+                self._last_metrics = now
+                self._publish_metrics()
+
+    def run(self):
+        threading.Thread(target=self._t_pipeline, name="depth20-pipeline", daemon=True).start()
+        self.rebalance()
+        threading.Thread(target=self._t_watchlist, name="depth20-watchlist", daemon=True).start()
+        try:
+            while not self.stop_evt.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_evt.set()
+            for sh in list(self.shards.values()):
+                sh.stop()
 
 if __name__ == "__main__":
-    print("Starting svc-depth20 ...")
-    run_ws()
+    print(f"Starting svc-depth20 ... store={DEPTH20_STORE} delta={BOOK_ENCODER.delta} max_per_conn={MAX_PER_CONN}")
+    if DEPTH20_STORE in ("books", "both"):
+        ensure_books_schema()
+    DepthShardManager().run()
@@ -0,0 +1,169 @@
+# C:\teevra18\teevra\candles_latest.py
+"""
+Last-K bars per instrument per timeframe, kept next to candles_<tf>.
+
+svc_candles calls refresh_latest() inside the same transaction that upserts
+candles_<tf>, so candles_latest never runs ahead of or behind the candle
+tables. Readers that only want the newest bars (M7, M11 features, dashboards)
+read universe x K rows here instead of scanning the full candle history.
+
+    from teevra.candles_latest import latest_bars
+    bars = latest_bars(con, "1m", n=2)     # {"sid", "ts", "o","h","l","c","v","vwap"}: (m, n)
+
+Seed / repair from the candle tables:
+    python -m teevra.candles_latest rebuild [--tf 1m]
+"""
+import os
+import sqlite3
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
+K = int(os.getenv("CANDLES_LATEST_K", "32"))
+TIMEFRAMES = ("1m", "5m", "15m", "60m")
+
+DDL = """
+CREATE TABLE IF NOT EXISTS candles_latest (
+    tf            TEXT NOT NULL,
+    instrument_id TEXT NOT NULL,
+    t_start       INTEGER NOT NULL,
+    open          REAL NOT NULL,
+    high          REAL NOT NULL,
+    low           REAL NOT NULL,
+    close         REAL NOT NULL,
+    volume        REAL NOT NULL,
+    trades        INTEGER NOT NULL,
+    vwap          REAL,
+    PRIMARY KEY (tf, instrument_id, t_start)
+);
+"""
+
+_UPSERT_SQL = """
+    INSERT INTO candles_latest
+        (tf, instrument_id, t_start, open, high, low, close, volume, trades, vwap)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(tf, instrument_id, t_start) DO UPDATE SET
+        open=excluded.open, high=excluded.high, low=excluded.low, close=excluded.close,
+        volume=excluded.volume, trades=excluded.trades, vwap=excluded.vwap
+"""
+
+# drop the (K+1)-th newest bar of one instrument and everything older (PK range scan)
+_TRIM_SQL = """
+    DELETE FROM candles_latest
+    WHERE tf=? AND instrument_id=? AND t_start <= (
+        SELECT t_start FROM candles_latest WHERE tf=? AND instrument_id=?
+        ORDER BY t_start DESC LIMIT 1 OFFSET ?)
+"""
+
+
+def ensure_schema(con: sqlite3.Connection):
+    con.execute(DDL)
+
+
+def refresh_latest(con: sqlite3.Connection, tf: str, rows, k: int = K) -> int:
+    """
+    Fold candle rows (instrument_id, t_start, o, h, l, c, v, trades, vwap) of one
+    timeframe into candles_latest and trim the touched instruments back to k bars.
+    Runs on the caller's connection/transaction. Rows older than the window are
+    dropped by the trim, so backfills in any order end in the right state.
+    """
+    if not rows:
+        return 0
+    newest = {}
+    for r in rows:
+        iid = str(r[0])
+        lst = newest.get(iid)
+        if lst is None:
+            newest[iid] = lst = []
+        lst.append(r)
+    params = []
+    for iid, lst in newest.items():
+        if len(lst) > k:
+            lst = sorted(lst, key=lambda r: r[1])[-k:]
+        params.extend((tf, iid) + tuple(r[1:9]) for r in lst)
+    con.executemany(_UPSERT_SQL, params)
+    con.executemany(_TRIM_SQL, [(tf, iid, tf, iid, k) for iid in newest])
+    return len(params)
+
+
+def rebuild(con: sqlite3.Connection, tf: str, k: int = K) -> int:
+    """Repopulate one timeframe from candles_<tf> (one window pass)."""
+    ensure_schema(con)
+    con.execute("DELETE FROM candles_latest WHERE tf=?", (tf,))
+    con.execute(f"""
+        INSERT INTO candles_latest (tf, instrument_id, t_start, open, high, low, close, volume, trades, vwap)
+        SELECT ?, instrument_id, t_start, open, high, low, close, volume, trades, vwap FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY instrument_id ORDER BY t_start DESC) AS rn
+            FROM candles_{tf}
+        ) WHERE rn <= ?
+    """, (tf, k))
+    return con.execute("SELECT COUNT(*) FROM candles_latest WHERE tf=?", (tf,)).fetchone()[0]
+
+
+def has_latest(con: sqlite3.Connection, tf: str = "1m") -> bool:
+    try:
+        return con.execute("SELECT 1 FROM candles_latest WHERE tf=? LIMIT 1", (tf,)).fetchone() is not None
+    except sqlite3.Error:
+        return False
+
+
+def latest_bars(con: sqlite3.Connection, tf: str = "1m", n: int = 1, sids=None, partial: bool = False) -> dict:
+    """
+    Newest n bars per instrument as columnar arrays (column -1 = current bar):
+        {"sid": (m,) object, "ts": (m,n) int64, "o","h","l","c","v","vwap": (m,n) float64}
+    Instruments with fewer than n bars are skipped unless partial=True, in which
+    case their missing leading bars are NaN (ts 0). n is capped at CANDLES_LATEST_K.
+    """
+    n = max(1, min(int(n), K))
+    sql = """
+        SELECT instrument_id, t_start, open, high, low, close, volume, vwap FROM candles_latest
+        WHERE tf=?"""
+    params = [tf]
+    if sids:
+        sql += f" AND instrument_id IN ({','.join('?' * len(sids))})"
+        params.extend(map(str, sids))
+    rows = con.execute(sql + " ORDER BY instrument_id, t_start", params).fetchall()
+    cols = ("o", "h", "l", "c", "v", "vwap")
+    if not rows:
+        return {"sid": np.array([], dtype=object), "ts": np.zeros((0, n), dtype=np.int64),
+                **{c: np.empty((0, n)) for c in cols}}
+    sid = np.array([r[0] for r in rows], dtype=object)
+    ts = np.array([r[1] for r in rows], dtype=np.int64)
+    vals = np.array([r[2:8] for r in rows], dtype=np.float64)    # vwap NULL -> nan
+    starts = np.flatnonzero(np.r_[True, sid[1:] != sid[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    have = ends - starts
+    if not partial:
+        keep = have >= n
+        starts, ends, have = starts[keep], ends[keep], have[keep]
+    # right-align each instrument's tail into an (m, n) grid
+    pos = ends[:, None] - n + np.arange(n)[None, :]
+    valid = pos >= starts[:, None]
+    pos = np.where(valid, pos, 0)
+    out = {"sid": sid[starts], "ts": np.where(valid, ts[pos], 0)}
+    for j, c in enumerate(cols):
+        out[c] = np.where(valid, vals[pos, j], np.nan)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="candles_latest maintenance")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("rebuild")
+    r.add_argument("--tf", choices=TIMEFRAMES, default=None)
+    r.add_argument("--db", default=str(DB_PATH))
+    args = ap.parse_args()
+    con = sqlite3.connect(args.db, timeout=30)
+    with con:
+        for tf in ([args.tf] if args.tf else TIMEFRAMES):
+            try:
+                print(f"[OK] candles_latest {tf}: {rebuild(con, tf)} rows (K={K})")
+            except sqlite3.Error as e:
+                print(f"[WARN] candles_{tf}: {e}")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# C:\teevra18\teevra\chain_features.py
+"""
+Columnar option-chain features for every (ts, expiry) of a chain frame.
+
+Input is the long frame from teevra.chain_store.chain_frames / chain_at
+(ts_fetch_utc, last_price, expiry, strike, side, oi, volume, implied_volatility,
+delta, ...). All snapshots are processed together: legs are folded into one
+row per (snapshot, strike) and every feature is a grouped reduction over that
+table (bincount / cumulative sums), so a day of history costs about as much
+as a handful of single-snapshot passes.
+
+Definitions (same as the per-snapshot builder in scripts/build_chain_features_latest.py used):
+    atm          strike nearest to spot (lowest strike on ties; lowest strike if no spot)
+    window       the window_n strikes nearest to spot (ties -> lower strike)
+    ce/pe_oi/vol sums over the window
+    pcr_oi       pe_oi / ce_oi (ce_oi 0 -> divide by 1)
+    iv_skew      iv_atm_pe - iv_atm_ce
+    max_pain     strike minimising total option-holder payoff over all strikes
+"""
+import numpy as np
+import pandas as pd
+
+FEATURE_COLS = ("ts_fetch_utc", "expiry", "last_price", "atm_strike", "window_n",
+                "ce_oi_sum", "pe_oi_sum", "pcr_oi", "ce_vol_sum", "pe_vol_sum",
+                "iv_atm_ce", "iv_atm_pe", "iv_skew", "atm_delta_ce", "atm_delta_pe", "max_pain")
+
+
+def _col(df, name):
+    return pd.to_numeric(df[name], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+
+
+def _group_starts(g):
+    return np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+
+
+def compute_features(frame: pd.DataFrame, window_n: int = 10) -> pd.DataFrame:
+    if frame is None or frame.empty:
+        return pd.DataFrame(columns=FEATURE_COLS)
+    # snapshot id per (ts, expiry); strike rows per (snapshot, strike)
+    snap_keys = frame[["ts_fetch_utc", "expiry"]]
+    gid, snaps = pd.MultiIndex.from_frame(snap_keys).factorize(sort=True)
+    strike = frame["strike"].to_numpy(dtype=np.float64)
+    order = np.lexsort((strike, gid))
+    gid, strike = gid[order], strike[order]
+    side = frame["side"].to_numpy()[order]
+    is_ce = side == "CE"
+    new_row = np.r_[True, (gid[1:] != gid[:-1]) | (strike[1:] != strike[:-1])]
+    rid = np.cumsum(new_row) - 1
+    R, G = int(rid[-1]) + 1, len(snaps)
+    r_gid, r_strike = gid[new_row], strike[new_row]
+
+    def per_row(name):
+        v = _col(frame, name)[order]
+        ce, pe = np.zeros(R), np.zeros(R)
+        ce[rid[is_ce]] = v[is_ce]
+        pe[rid[~is_ce]] = v[~is_ce]
+        return ce, pe
+
+    ce_oi, pe_oi = per_row("oi")
+    ce_vol, pe_vol = per_row("volume")
+    ce_iv, pe_iv = per_row("implied_volatility")
+    ce_dl, pe_dl = per_row("delta")
+
+    spot_by_snap = np.zeros(G)
+    spot = _col(frame, "last_price")[order]
+    spot_by_snap[gid] = spot                                  # one spot per snapshot
+    s = spot_by_snap[r_gid]
+    dist = np.where(s > 0, np.abs(r_strike - s), 0.0)
+
+    # rank strikes inside each snapshot by (dist, strike): rank 0 = ATM, rank < n = window
+    o = np.lexsort((r_strike, dist, r_gid))
+    starts = _group_starts(r_gid[o])
+    rank = np.empty(R, dtype=np.int64)
+    rank[o] = np.arange(R) - np.repeat(starts, np.diff(np.r_[starts, R]))
+    win = rank < int(window_n)
+    atm = o[starts]                                           # row index of each snapshot's ATM
+
+    def wsum(v):
+        return np.bincount(r_gid, weights=np.where(win, v, 0.0), minlength=G)
+
+    ce_oi_s, pe_oi_s = wsum(ce_oi), wsum(pe_oi)
+
+    # max pain over all strikes: pain(K_j) = sum_{i<j} ce_i (K_j - s_i) + sum_{i>j} pe_i (s_i - K_j)
+    # rows are already sorted by (snapshot, strike), so group-local prefix sums do it in O(R)
+    rs = _group_starts(r_gid)
+    seg = np.repeat(rs, np.diff(np.r_[rs, R]))
+
+    def excl_prefix(v):
+        c = np.cumsum(v)
+        return c - v - (c[seg] - v[seg])                      # sum over rows before j in the group
+
+    def excl_suffix(v):
+        c = np.cumsum(v[::-1])[::-1]
+        ends = np.r_[rs[1:], R] - 1
+        end = np.repeat(ends, np.diff(np.r_[rs, R]))
+        return c - v - (c[end] - v[end])                      # sum over rows after j in the group
+
+    pain = (r_strike * excl_prefix(ce_oi) - excl_prefix(ce_oi * r_strike)
+            + excl_suffix(pe_oi * r_strike) - r_strike * excl_suffix(pe_oi))
+    po = np.lexsort((r_strike, pain, r_gid))
+    max_pain = r_strike[po[_group_starts(r_gid[po])]]
+
+    out = pd.DataFrame({
+        "ts_fetch_utc": snaps.get_level_values(0), "expiry": snaps.get_level_values(1),
+        "last_price": spot_by_snap, "atm_strike": r_strike[atm], "window_n": int(window_n),
+        "ce_oi_sum": ce_oi_s.astype(np.int64), "pe_oi_sum": pe_oi_s.astype(np.int64),
+        "pcr_oi": pe_oi_s / np.where(ce_oi_s > 0, ce_oi_s, 1.0),
+        "ce_vol_sum": wsum(ce_vol).astype(np.int64), "pe_vol_sum": wsum(pe_vol).astype(np.int64),
+        "iv_atm_ce": ce_iv[atm], "iv_atm_pe": pe_iv[atm], "iv_skew": pe_iv[atm] - ce_iv[atm],
+        "atm_delta_ce": ce_dl[atm], "atm_delta_pe": pe_dl[atm], "max_pain": max_pain,
+    })
+    return out[list(FEATURE_COLS)]
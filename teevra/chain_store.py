@@ -0,0 +1,258 @@
+# C:\teevra18\teevra\chain_store.py
+"""
+Change-only option chain persistence for svc_chain_snap.
+
+Every fetch cycle of one chain (underlying, expiry) gets one row in
+option_chain_cycles (spot, keyframe flag, leg counts). option_chain_snap then
+only receives the legs whose LTP / OI / IV / greeks moved beyond TOLERANCES
+since the last written value of that (strike, side). Every
+CHAIN_KEYFRAME_EVERY cycles (and on the first cycle after a restart) the whole
+chain is written again, so a chain at time t is
+
+    last row per (strike, side) with keyframe_ts(t) <= ts_fetch_utc <= t
+
+Legs that disappear from the feed between keyframes are carried until the next
+keyframe. Data written before this module existed (snapshots older than the
+underlying's first cycles row) reads as one keyframe per snapshot.
+
+    from teevra.chain_store import chain_at, chain_frames
+    df = chain_at(con, "NIFTY")                      # latest full chain, all expiries
+    df = chain_frames(con, "NIFTY", since, until)    # full chain at every cycle in the window
+"""
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+DELTA = os.getenv("CHAIN_DELTA", "1") == "1"
+KEYFRAME_EVERY = int(os.getenv("CHAIN_KEYFRAME_EVERY", "20"))
+
+# a leg is re-written when any of these moves by more than the tolerance
+TOLERANCES = {
+    "ltp": float(os.getenv("CHAIN_TOL_LTP", "0.05")),
+    "oi": 0.0,
+    "implied_volatility": float(os.getenv("CHAIN_TOL_IV", "0.01")),
+    "delta": float(os.getenv("CHAIN_TOL_GREEK", "0.0005")),
+    "gamma": float(os.getenv("CHAIN_TOL_GREEK", "0.0005")) / 100.0,
+    "theta": float(os.getenv("CHAIN_TOL_GREEK", "0.0005")) * 10.0,
+    "vega": float(os.getenv("CHAIN_TOL_GREEK", "0.0005")) * 10.0,
+}
+TRACKED = tuple(TOLERANCES)
+_TOL = np.array([TOLERANCES[k] for k in TRACKED])
+
+LEG_COLS = ("expiry", "strike", "side", "ltp", "oi", "previous_oi", "volume", "implied_volatility",
+            "delta", "gamma", "theta", "vega", "top_bid_price", "top_ask_price")
+
+DDL = """
+CREATE TABLE IF NOT EXISTS option_chain_cycles (
+  underlying    TEXT NOT NULL,
+  expiry        TEXT NOT NULL,
+  ts_fetch_utc  TEXT NOT NULL,
+  last_price    REAL,                 -- underlying spot for the cycle
+  is_key        INTEGER NOT NULL,     -- 1 = every leg written at this ts
+  n_legs        INTEGER NOT NULL,     -- legs in the fetched chain
+  n_written     INTEGER NOT NULL,     -- legs written to option_chain_snap
+  PRIMARY KEY (underlying, expiry, ts_fetch_utc)
+);
+CREATE INDEX IF NOT EXISTS idx_occ_key ON option_chain_cycles(underlying, is_key, ts_fetch_utc);
+"""
+
+CYCLE_SQL = """
+  INSERT OR REPLACE INTO option_chain_cycles
+    (underlying, expiry, ts_fetch_utc, last_price, is_key, n_legs, n_written)
+  VALUES (?,?,?,?,?,?,?)
+"""
+
+
+def ensure_schema(con: sqlite3.Connection):
+    con.executescript(DDL)
+
+
+def has_cycles(con: sqlite3.Connection, underlying: str = None) -> bool:
+    sql, params = "SELECT 1 FROM option_chain_cycles", ()
+    if underlying:
+        sql, params = sql + " WHERE underlying=?", (underlying,)
+    try:
+        return con.execute(sql + " LIMIT 1", params).fetchone() is not None
+    except sqlite3.Error:
+        return False
+
+
+def as_float(v):
+    return np.nan if v is None else float(v)
+
+
+class ChainDeltaFilter:
+    """
+    Last written value of every tracked field per (underlying, expiry, strike, side).
+    filter() returns the indices of legs to persist and whether this cycle is a
+    keyframe. Values are compared against what was last *written*, so slow drifts
+    below the tolerance still get persisted once they add up.
+    """
+
+    def __init__(self, delta: bool = DELTA, keyframe_every: int = KEYFRAME_EVERY):
+        self.delta = delta
+        self.keyframe_every = max(1, int(keyframe_every))
+        self._state = {}         # (und, exp) -> [cycles_since_key, keys tuple, values (n, k), {key: row}]
+        self.legs_in = 0
+        self.legs_out = 0
+
+    def reset(self):
+        self._state.clear()
+
+    def filter(self, underlying: str, expiry: str, keys, values):
+        """
+        keys: [(strike, side)], values: (n, len(TRACKED)) in TRACKED order (NaN = missing).
+        -> (indices to write, is_key)
+        """
+        n = len(keys)
+        self.legs_in += n
+        vals = np.asarray(values, dtype=np.float64).reshape(n, len(TRACKED))
+        keys = tuple(keys)
+        st = self._state.get((underlying, expiry))
+        key = not self.delta or st is None or st[0] + 1 >= self.keyframe_every
+        if key:
+            idx = np.arange(n)
+            self._state[(underlying, expiry)] = [0, keys, vals.copy(), {k: i for i, k in enumerate(keys)}]
+            self.legs_out += n
+            return idx, True
+        if st[1] == keys:
+            prev = st[2]                                  # usual case: same strikes, same order
+        else:
+            pos = st[3]
+            prev = np.full_like(vals, np.nan)
+            have = np.array([k in pos for k in keys], dtype=bool)
+            if have.any():
+                prev[have] = st[2][[pos[k] for k, h in zip(keys, have) if h]]
+        diff = np.abs(vals - prev)
+        nan_flip = np.isnan(vals) != np.isnan(prev)
+        changed = ((diff > _TOL) & ~np.isnan(diff)) | nan_flip
+        idx = np.flatnonzero(changed.any(axis=1))
+        # remember written values only; unchanged legs keep their last persisted value
+        new_vals = prev.copy()
+        new_vals[idx] = vals[idx]
+        st[0] += 1
+        st[1], st[2], st[3] = keys, new_vals, {k: i for i, k in enumerate(keys)}
+        self.legs_out += len(idx)
+        return idx, False
+
+
+_LEGACY_SQL = """SELECT expiry, ts_fetch_utc, MAX(last_price), 1 FROM option_chain_snap
+                 WHERE underlying=? {} GROUP BY expiry, ts_fetch_utc"""
+
+
+def _keyframes(con, underlying, until=None):
+    """
+    (expiry, ts, last_price, is_key) cycle rows. Legacy snapshots (before the
+    underlying's first cycle row) count as keyframes.
+    """
+    if has_cycles(con, underlying):
+        sql = ("SELECT expiry, ts_fetch_utc, last_price, is_key FROM option_chain_cycles WHERE underlying=?"
+               " UNION ALL " + _LEGACY_SQL.format(
+                   "AND ts_fetch_utc < (SELECT MIN(ts_fetch_utc) FROM option_chain_cycles WHERE underlying=?)"))
+        params = [underlying, underlying, underlying]
+    else:
+        sql, params = _LEGACY_SQL.format(""), [underlying]
+    if until:
+        sql = f"SELECT * FROM ({sql}) WHERE ts_fetch_utc <= ?"
+        params.append(until)
+    df = pd.read_sql_query(sql, con, params=params)
+    df.columns = ["expiry", "ts_fetch_utc", "last_price", "is_key"]
+    return df.sort_values(["expiry", "ts_fetch_utc"], kind="mergesort").reset_index(drop=True)
+
+
+def chain_at(con: sqlite3.Connection, underlying: str, ts: str = None, expiry: str = None,
+             current_only: bool = True) -> pd.DataFrame:
+    """
+    Full chain of `underlying` as of `ts` (default: latest), one row per
+    (expiry, strike, side) with LEG_COLS plus ts_fetch_utc (cycle time) and last_price (spot).
+    current_only keeps just the expiries fetched in the newest cycle (what a
+    snapshot query on MAX(ts_fetch_utc) used to return).
+    """
+    cyc = _keyframes(con, underlying, ts)
+    if expiry:
+        cyc = cyc[cyc["expiry"] == expiry]
+    if cyc.empty:
+        return pd.DataFrame(columns=["ts_fetch_utc", "last_price", *LEG_COLS])
+    last = cyc.groupby("expiry").tail(1).set_index("expiry")
+    if current_only:
+        last = last[last["ts_fetch_utc"] == last["ts_fetch_utc"].max()]
+    kts = cyc[cyc["is_key"] == 1].groupby("expiry")["ts_fetch_utc"].max()
+    parts = []
+    for exp, row in last.iterrows():
+        if exp not in kts.index:
+            continue
+        legs = pd.read_sql_query(f"""
+            SELECT {', '.join(LEG_COLS)} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY strike, side ORDER BY ts_fetch_utc DESC) AS rn
+                FROM option_chain_snap
+                WHERE underlying=? AND expiry=? AND ts_fetch_utc >= ? AND ts_fetch_utc <= ?
+            ) WHERE rn = 1""", con, params=(underlying, exp, kts[exp], row["ts_fetch_utc"]))
+        legs.insert(0, "last_price", row["last_price"])
+        legs.insert(0, "ts_fetch_utc", row["ts_fetch_utc"])
+        parts.append(legs)
+    if not parts:
+        return pd.DataFrame(columns=["ts_fetch_utc", "last_price", *LEG_COLS])
+    return pd.concat(parts, ignore_index=True).sort_values(["expiry", "strike", "side"]).reset_index(drop=True)
+
+
+def chain_frames(con: sqlite3.Connection, underlying: str, since: str = None, until: str = None) -> pd.DataFrame:
+    """
+    Full chain at every cycle in [since, until]: long frame with one row per
+    (ts_fetch_utc, expiry, strike, side), columns as chain_at. Each leg's value at a
+    cycle is found with one searchsorted per (expiry, leg) over its write times.
+    """
+    cyc = _keyframes(con, underlying, until)
+    if cyc.empty:
+        return pd.DataFrame(columns=["ts_fetch_utc", "last_price", *LEG_COLS])
+    # start reading each expiry at its last keyframe at/before `since`
+    starts = {}
+    for exp, g in cyc.groupby("expiry", sort=False):
+        keys = g.loc[g["is_key"] == 1, "ts_fetch_utc"]
+        before = keys[keys <= since] if since else keys.iloc[:1]
+        starts[exp] = before.iloc[-1] if len(before) else (keys.iloc[0] if len(keys) else None)
+    out = []
+    for exp, g in cyc.groupby("expiry", sort=False):
+        k0 = starts[exp]
+        if k0 is None:
+            continue
+        g = g[g["ts_fetch_utc"] >= k0]
+        params = [underlying, exp, k0]
+        sql = f"""SELECT ts_fetch_utc AS ts_w, {', '.join(LEG_COLS)} FROM option_chain_snap
+                  WHERE underlying=? AND expiry=? AND ts_fetch_utc >= ?"""
+        if until:
+            sql += " AND ts_fetch_utc <= ?"
+            params.append(until)
+        legs = pd.read_sql_query(sql + " ORDER BY strike, side, ts_fetch_utc", con, params=params)
+        if legs.empty:
+            continue
+        c_ts = g["ts_fetch_utc"].to_numpy(dtype=str)
+        kpos = np.where(g["is_key"].to_numpy() == 1, np.arange(len(c_ts)), 0)
+        c_key = c_ts[np.maximum.accumulate(kpos)]         # keyframe in force at each cycle
+        c_spot = g["last_price"].to_numpy(dtype=np.float64)
+        keep_c = (c_ts >= since) if since else np.ones(len(c_ts), dtype=bool)
+        c_ts, c_key, c_spot = c_ts[keep_c], c_key[keep_c], c_spot[keep_c]
+        if not len(c_ts):
+            continue
+        w_ts = legs["ts_w"].to_numpy(dtype=str)
+        leg_id = legs.groupby(["strike", "side"], sort=False).ngroup().to_numpy()
+        bounds = np.flatnonzero(np.r_[True, leg_id[1:] != leg_id[:-1], True])
+        L, C = len(bounds) - 1, len(c_ts)
+        pos = np.full((L, C), -1, dtype=np.int64)
+        for j in range(L):
+            lo, hi = bounds[j], bounds[j + 1]
+            p = np.searchsorted(w_ts[lo:hi], c_ts, side="right") - 1 + lo
+            ok = (p >= lo) & (w_ts[np.maximum(p, lo)] >= c_key)
+            pos[j] = np.where(ok, p, -1)
+        li, ci = np.nonzero(pos >= 0)
+        sel = pos[li, ci]
+        frame = legs.iloc[sel][list(LEG_COLS)].reset_index(drop=True)
+        frame.insert(0, "last_price", c_spot[ci])
+        frame.insert(0, "ts_fetch_utc", c_ts[ci])
+        out.append(frame)
+    if not out:
+        return pd.DataFrame(columns=["ts_fetch_utc", "last_price", *LEG_COLS])
+    return (pd.concat(out, ignore_index=True)
+              .sort_values(["ts_fetch_utc", "expiry", "strike", "side"], kind="mergesort")
+              .reset_index(drop=True))
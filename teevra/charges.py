@@ -0,0 +1,218 @@
+# C:\teevra18\teevra\charges.py
+"""
+Indian F&O round-trip charges and charges-aware R:R, shared by M8, M9, the
+backtester and KPI code. Everything takes scalars or NumPy arrays.
+
+    brokerage  brokerage_per_order x 2
+    exchange   exch_txn_rate x (buy + sell turnover)
+    SEBI       sebi_rate x (buy + sell turnover)
+    STT        stt_sell_rate x sell turnover
+    stamp      stamp_buy_rate x buy turnover
+    GST        gst_rate x (brokerage + exchange + SEBI)
+
+rr_profiles rows are compiled once into an RrProfile (per-root ChargesModel)
+and cached per connection for CHARGES_PROFILE_TTL seconds, so M8 checks a
+whole batch of signals against one profile without touching SQLite again.
+
+    from teevra import charges
+    prof = charges.load_profile(conn, "BASELINE_V2")
+    ok, reason, m = charges.validate_batch(prof, entry, sl_pts, tp_pts, lots, roots, side)
+    fees = charges.roundtrip_charges(entry, exit_, qty, prof.coeffs(roots))
+"""
+import os
+import json
+import time
+import sqlite3
+from dataclasses import dataclass, field, astuple
+
+import numpy as np
+
+LOT_SIZE = {"NIFTY": 75, "BANKNIFTY": 35}
+LONG, SHORT = 1, -1
+PROFILE_TTL = float(os.getenv("CHARGES_PROFILE_TTL", "60"))
+
+
+@dataclass(frozen=True)
+class ChargesModel:
+    brokerage_per_order: float = 20.0
+    gst_rate: float = 0.18
+    stt_sell_rate: float = 0.001
+    exch_txn_rate: float = 0.0003503
+    sebi_rate: float = 0.000001
+    stamp_buy_rate: float = 0.00003
+
+
+FIELDS = tuple(ChargesModel.__dataclass_fields__)
+DEFAULT = ChargesModel()
+
+
+def infer_root(symbol: str) -> str:
+    s = (symbol or "").upper()
+    if s.startswith("BANKNIFTY") or s.startswith("NIFTYBANK"):
+        return "BANKNIFTY"
+    return "NIFTY"
+
+
+def normalize_side(side: str) -> str:
+    """signals.side may be LONG/SHORT or BUY/SELL; empty means LONG."""
+    s = (side or "LONG").upper()
+    return {"BUY": "LONG", "SELL": "SHORT"}.get(s, s)
+
+
+# ---- charges -------------------------------------------------------------------
+def _coef(cm, name):
+    return cm[name] if isinstance(cm, dict) else getattr(cm, name)
+
+
+def roundtrip_charges(entry, exit_, qty, cm, side=LONG):
+    """
+    Charges for opening at entry and closing at exit_. cm is a ChargesModel or
+    a dict of per-row coefficient arrays (RrProfile.coeffs). SHORT buys back at
+    exit_, so the buy/sell turnovers swap.
+    """
+    entry, exit_ = np.asarray(entry, dtype=np.float64), np.maximum(np.asarray(exit_, dtype=np.float64), 0.0)
+    lg = np.asarray(side) == LONG
+    buy_turnover = np.where(lg, entry, exit_) * qty
+    sell_turnover = np.where(lg, exit_, entry) * qty
+    brokerage = _coef(cm, "brokerage_per_order") * 2.0
+    exch = _coef(cm, "exch_txn_rate") * (buy_turnover + sell_turnover)
+    sebi = _coef(cm, "sebi_rate") * (buy_turnover + sell_turnover)
+    stt = _coef(cm, "stt_sell_rate") * sell_turnover
+    stamp = _coef(cm, "stamp_buy_rate") * buy_turnover
+    gst = _coef(cm, "gst_rate") * (brokerage + exch + sebi)
+    return brokerage + exch + sebi + stt + stamp + gst
+
+
+def effective_metrics(entry, sl_pts, tp_pts, qty, cm, side=LONG) -> dict:
+    """Gross / charges-adjusted risk and reward at the planned SL and TP exits (premium floors at 0)."""
+    entry, sl_pts, tp_pts = (np.asarray(a, dtype=np.float64) for a in (entry, sl_pts, tp_pts))
+    qty = np.asarray(qty, dtype=np.float64)
+    lg = np.asarray(side) == LONG
+    stop_exit = np.maximum(np.where(lg, entry - sl_pts, entry + sl_pts), 0.0)
+    tp_exit = np.maximum(np.where(lg, entry + tp_pts, entry - tp_pts), 0.0)
+    gross_risk, gross_reward = sl_pts * qty, tp_pts * qty
+    charges_at_stop = roundtrip_charges(entry, stop_exit, qty, cm, side)
+    charges_at_tp = roundtrip_charges(entry, tp_exit, qty, cm, side)
+    eff_risk = gross_risk + charges_at_stop
+    eff_reward = gross_reward - charges_at_tp
+    rr_eff = np.divide(eff_reward, eff_risk, out=np.zeros(np.broadcast(eff_reward, eff_risk).shape),
+                       where=eff_risk > 0)
+    return {"qty": qty, "gross_risk": gross_risk, "gross_reward": gross_reward,
+            "charges_at_stop": charges_at_stop, "charges_at_tp": charges_at_tp,
+            "effective_risk": eff_risk, "effective_reward": eff_reward, "rr_eff": rr_eff,
+            "stop_exit": stop_exit, "tp_exit": tp_exit}
+
+
+def metrics_rows(metrics: dict, n: int) -> list:
+    """effective_metrics() arrays -> n dicts of plain Python numbers (rr_metrics_json)."""
+    cols = {}
+    for name, v in metrics.items():
+        x = np.asarray(v, dtype=np.float64)
+        x = np.broadcast_to(np.nan_to_num(x).astype(np.int64) if name == "qty" else x, (n,))
+        cols[name] = x.tolist()
+    return [dict(zip(cols, vals)) for vals in zip(*cols.values())]
+
+
+# ---- profiles --------------------------------------------------------------------
+@dataclass
+class RrProfile:
+    name: str
+    rr_min: float = 0.0
+    sl_cap_per_trade: float = float("inf")
+    include_charges: bool = True
+    charges_broker: str = None
+    models: dict = field(default_factory=lambda: {"NIFTY": DEFAULT})
+
+    @property
+    def cfg(self) -> dict:
+        return {"rr_min": self.rr_min, "sl_cap_per_trade": self.sl_cap_per_trade,
+                "include_charges": self.include_charges, "charges_broker": self.charges_broker}
+
+    def model(self, root: str) -> ChargesModel:
+        return self.models.get((root or "").upper()) or next(iter(self.models.values()))
+
+    def coeffs(self, roots) -> dict:
+        """Per-row coefficient arrays for roundtrip_charges, one ChargesModel lookup per distinct root."""
+        roots = np.asarray(roots, dtype=object)
+        uniq, inv = np.unique(roots.astype(str), return_inverse=True)
+        table = np.array([astuple(self.model(r)) for r in uniq], dtype=np.float64).reshape(-1, len(FIELDS))
+        return {f: table[inv, i] for i, f in enumerate(FIELDS)}
+
+
+_PROFILES = {}
+
+
+def _compile(name, row) -> RrProfile:
+    rr_min, sl_cap, include_charges, broker, overrides = row
+    models = {}
+    for root, cfg in (json.loads(overrides) if overrides else {}).items():
+        models[root.upper()] = ChargesModel(**{f: float(cfg.get(f, getattr(DEFAULT, f))) for f in FIELDS})
+    return RrProfile(name, float(rr_min), float(sl_cap), bool(include_charges), broker, models or {"NIFTY": DEFAULT})
+
+
+def load_profile(conn, profile_name: str, ttl: float = PROFILE_TTL) -> RrProfile:
+    """rr_profiles row -> RrProfile, cached per (connection, name); RuntimeError when missing."""
+    key = (id(conn), profile_name)
+    hit = _PROFILES.get(key)
+    if hit and time.monotonic() - hit[0] < ttl:
+        return hit[1]
+    row = conn.execute("""
+        SELECT rr_min, sl_cap_per_trade, include_charges, charges_broker, charges_overrides_json
+        FROM rr_profiles WHERE profile_name=?
+    """, (profile_name,)).fetchone()
+    if not row:
+        raise RuntimeError(f"RR profile '{profile_name}' not found")
+    prof = _compile(profile_name, tuple(row))
+    _PROFILES[key] = (time.monotonic(), prof)
+    return prof
+
+
+def load_profile_or_default(conn, profile_name: str) -> RrProfile:
+    """Like load_profile, but without a row: default charges and no effective-RR/risk gate."""
+    try:
+        return load_profile(conn, profile_name)
+    except (RuntimeError, sqlite3.Error) as e:
+        print(f"[WARN] {e}; using default charges without the M8 gate")
+        return RrProfile(profile_name)
+
+
+def take(cm: dict, idx) -> dict:
+    """Rows idx of a coefficient-array dict (RrProfile.coeffs)."""
+    return {k: v[idx] for k, v in cm.items()}
+
+
+# ---- M8 batch validation -----------------------------------------------------------
+def validate_batch(prof: RrProfile, entry, sl_pts, tp_pts, lots=1, roots=None, side=None,
+                   allow_short: bool = False, qty=None, cm=None):
+    """
+    Charges-aware M8 gate for a whole batch. side: LONG/SHORT ints or
+    LONG/SHORT/BUY/SELL strings (default LONG); qty defaults to LOT_SIZE x lots
+    and cm to prof.coeffs(roots), so callers holding per-instrument arrays
+    (the backtester) can pass qty/cm and skip roots.
+    Returns (ok bool array, reason object array, effective_metrics dict).
+    Reasons match the v2 rules: 'ok', 'side_not_supported_v2', 'risk>CAP', 'rr_eff<MIN',
+    plus 'unknown_root:<ROOT>' for roots without a LOT_SIZE entry (their metrics are NaN).
+    """
+    entry = np.asarray(entry, dtype=np.float64)
+    n = len(entry)
+    if roots is not None:
+        roots = np.asarray([(r or "NIFTY").upper() for r in roots], dtype=object)
+    side = np.full(n, LONG) if side is None else np.asarray(side)
+    if side.dtype.kind in "OUS":
+        side = np.where(np.array([normalize_side(s) for s in side]) == "LONG", LONG, SHORT)
+    unknown = np.zeros(n, dtype=bool)
+    if qty is None:
+        lots = np.maximum(np.asarray(lots, dtype=np.int64), 1)
+        lot = np.array([LOT_SIZE.get(r, np.nan) for r in roots], dtype=np.float64)
+        unknown = np.isnan(lot)
+        qty = lot * lots
+    m = effective_metrics(entry, sl_pts, tp_pts, qty, prof.coeffs(roots) if cm is None else cm, side)
+    reason = np.full(n, "ok", dtype=object)
+    reason[m["rr_eff"] < prof.rr_min] = f"rr_eff<{prof.rr_min:.2f}"
+    reason[m["effective_risk"] > prof.sl_cap_per_trade] = f"risk>{prof.sl_cap_per_trade:.0f}"
+    # never size an unknown contract as 1 unit: that would understate its risk by the lot size
+    if unknown.any():
+        reason[unknown] = [f"unknown_root:{r}" for r in roots[unknown]]
+    if not allow_short:
+        reason[side != LONG] = "side_not_supported_v2"
+    return reason == "ok", reason, m
@@ -2,6 +2,8 @@
 import sqlite3, os, time
 from pathlib import Path
 
+from teevra.db_writer import get_writer
+
 DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
 
 DDL = """
@@ -75,14 +77,13 @@ def ensure_schema():
     conn.close()
 
 def put_health(key, value):
-    conn = connect()
-    conn.execute("INSERT INTO health(key,value,ts_utc) VALUES(?,?,datetime('now')) "
-                 "ON CONFLICT(key) DO UPDATE SET value=excluded.value, ts_utc=datetime('now');",
-                 (key, value))
-    conn.close()
+    # queued on the shared writer thread; coalesced with other ingest writes
+    get_writer(DB_PATH).submit_one(
+        "INSERT INTO health(key,value,ts_utc) VALUES(?,?,datetime('now')) "
+        "ON CONFLICT(key) DO UPDATE SET value=excluded.value, ts_utc=datetime('now');",
+        (key, value))
 
 def log(level, area, msg):
-    conn = connect()
-    conn.execute("INSERT INTO ops_log(ts_utc,level,area,msg) VALUES(datetime('now'),?,?,?)",
-                 (level, area, msg))
-    conn.close()
+    get_writer(DB_PATH).submit_one(
+        "INSERT INTO ops_log(ts_utc,level,area,msg) VALUES(datetime('now'),?,?,?)",
+        (level, area, msg))
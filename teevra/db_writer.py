@@ -0,0 +1,237 @@
+# C:\teevra18\teevra\db_writer.py
+"""
+Single-writer queue for SQLite.
+
+Ingest paths (ticks_raw, ltp_ticks, depth20_books/levels, health, ops_log) submit
+(sql, rows) to a per-process writer thread instead of opening a connection and
+committing per call. The writer coalesces everything queued into one bounded
+transaction (grouped by statement so each runs as one executemany on a cached
+prepared statement), which keeps WAL lock hold times short when M1/M3/M4/M9
+share the DB file.
+
+    from teevra.db_writer import get_writer
+    w = get_writer()                        # DB_PATH by default; one per path
+    w.submit("INSERT INTO ltp_ticks(symbol, ts_ms, ltp) VALUES(?,?,?)", [row, ...])
+
+Backpressure: the queue is bounded (DB_WRITER_MAX_QUEUE items). submit()
+blocks up to DB_WRITER_PUT_TIMEOUT_MS, then drops the item and counts it.
+stats() and the health rows db_writer_* expose queue depth, drops and commit latency.
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from pathlib import Path
+
+DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
+
+MAX_BATCH_ROWS   = int(os.getenv("DB_WRITER_MAX_BATCH_ROWS", "5000"))
+MAX_LATENCY_MS   = float(os.getenv("DB_WRITER_MAX_LATENCY_MS", "200"))
+MAX_QUEUE        = int(os.getenv("DB_WRITER_MAX_QUEUE", "20000"))
+PUT_TIMEOUT_MS   = float(os.getenv("DB_WRITER_PUT_TIMEOUT_MS", "250"))
+BUSY_RETRIES     = int(os.getenv("DB_WRITER_BUSY_RETRIES", "5"))
+METRICS_SECS     = float(os.getenv("DB_WRITER_METRICS_SECS", "5"))
+
+_HEALTH_SQL = ("INSERT INTO health(key,value,ts_utc) VALUES(?,?,datetime('now')) "
+               "ON CONFLICT(key) DO UPDATE SET value=excluded.value, ts_utc=datetime('now')")
+
+
+class DBWriter:
+    def __init__(self, db_path=DB_PATH, name: str = None):
+        self.db_path = str(db_path)
+        self.name = name or Path(sys.argv[0] or "py").stem
+        self.q = queue.Queue(maxsize=MAX_QUEUE)
+        self.stop_evt = threading.Event()
+        self._items_in = 0      # items accepted by submit()
+        self._items_done = 0    # items committed (or failed) by the writer thread
+        self._thread = None
+        self._lock = threading.Lock()
+        # metrics
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.commits = 0
+        self.max_queue_seen = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self._last_metrics = 0.0
+
+    # --- producer API ---------------------------------------------------------
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.stop_evt.clear()
+                self._thread = threading.Thread(target=self._run, name=f"db-writer:{self.name}", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, sql: str, rows, block: bool = True) -> bool:
+        """Queue rows (list of tuples) for `sql`. Returns False if dropped under backpressure."""
+        if not rows:
+            return True
+        if not isinstance(rows, list):
+            rows = list(rows)
+        try:
+            self.q.put((sql, rows), block=block, timeout=PUT_TIMEOUT_MS / 1000.0)
+        except queue.Full:
+            self.dropped += len(rows)
+            return False
+        with self._lock:
+            self._items_in += 1
+            self.submitted += len(rows)
+        qs = self.q.qsize()
+        if qs > self.max_queue_seen:
+            self.max_queue_seen = qs
+        return True
+
+    def submit_one(self, sql: str, params=(), block: bool = True) -> bool:
+        return self.submit(sql, [tuple(params)], block=block)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything queued so far has been committed."""
+        target = self._items_in
+        deadline = time.time() + timeout
+        while self._items_done < target:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        self.flush(timeout)
+        self.stop_evt.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queue": self.q.qsize(), "max_queue": self.max_queue_seen,
+            "submitted": self.submitted, "written": self.written,
+            "dropped": self.dropped, "failed": self.failed, "commits": self.commits,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+            "max_commit_ms": round(self.max_commit_ms, 2),
+        }
+
+    # --- writer thread --------------------------------------------------------
+    def _connect(self):
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                              check_same_thread=False, cached_statements=256)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        return con
+
+    def _collect(self, first):
+        """Coalesce queued items into {sql: rows} until the row/latency bound is hit."""
+        batch = {first[0]: list(first[1])}
+        n, items = len(first[1]), 1
+        deadline = time.perf_counter() + MAX_LATENCY_MS / 1000.0
+        while n < MAX_BATCH_ROWS:
+            try:
+                sql, rows = self.q.get_nowait()
+            except queue.Empty:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                try:
+                    sql, rows = self.q.get(timeout=min(left, 0.01))
+                except queue.Empty:
+                    continue
+            batch.setdefault(sql, []).extend(rows)
+            n += len(rows)
+            items += 1
+        return batch, n, items
+
+    def _commit(self, con, batch: dict, n: int):
+        t0 = time.perf_counter()
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                for sql, rows in batch.items():
+                    con.executemany(sql, rows)
+                con.execute("COMMIT")
+                break
+            except sqlite3.OperationalError as e:
+                try:
+                    con.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                if "locked" in str(e).lower() or "busy" in str(e).lower():
+                    if attempt < BUSY_RETRIES:
+                        time.sleep(0.05 * (attempt + 1))
+                        continue
+                self._commit_each(con, batch)
+                return
+            except Exception:
+                # non-sqlite errors too (e.g. OverflowError on a bad parameter): never leave
+                # the transaction open or let one caller's rows kill the writer thread
+                try:
+                    con.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                self._commit_each(con, batch)
+                return
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.written += n
+        self.commits += 1
+        self.last_commit_ms = ms
+        self.max_commit_ms = max(self.max_commit_ms, ms)
+
+    def _commit_each(self, con, batch: dict):
+        # isolate the bad statement so one broken caller does not sink the others
+        for sql, rows in batch.items():
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                con.executemany(sql, rows)
+                con.execute("COMMIT")
+                self.written += len(rows)
+                self.commits += 1
+            except Exception as e:
+                try:
+                    con.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                self.failed += len(rows)
+                print(f"[db_writer] {self.name}: {len(rows)} row(s) failed: {e} | {sql.strip()[:80]}",
+                      file=sys.stderr)
+
+    def _metrics_rows(self):
+        s = self.stats()
+        return [(f"db_writer_{self.name}_{k}", str(v)) for k, v in s.items()]
+
+    def _run(self):
+        con = self._connect()
+        try:
+            while not (self.stop_evt.is_set() and self.q.empty()):
+                try:
+                    first = self.q.get(timeout=0.25)
+                except queue.Empty:
+                    continue
+                batch, n, items = self._collect(first)
+                now = time.time()
+                if now - self._last_metrics >= METRICS_SECS:
+                    self._last_metrics = now
+                    batch.setdefault(_HEALTH_SQL, []).extend(self._metrics_rows())
+                try:
+                    self._commit(con, batch, n)
+                finally:
+                    self._items_done += items
+        finally:
+            con.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(db_path=DB_PATH) -> DBWriter:
+    """Process-wide writer for `db_path`, started on first use and flushed at exit."""
+    key = str(db_path)
+    with _writers_lock:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = DBWriter(key).start()
+            atexit.register(w.stop)
+    return w
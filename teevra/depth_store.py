@@ -0,0 +1,277 @@
+# C:\teevra18\teevra\depth_store.py
+"""
+Compact depth-20 storage: one row per (security_id, ts) instead of 40.
+
+Each side of a book is stored as one BLOB of packed levels in the wire layout
+(price f8, qty u4, orders u4 = 16B per level, little-endian), so a full book is
+640 bytes in a single row with the top5/top10 pressures stored once.
+
+    depth20_books(security_id, ts_recv_utc, exchange_seg, seq, is_key,
+                  bid_mask, ask_mask, bid_levels, ask_levels,
+                  best_bid, best_ask, top5_*, top10_*, pressure_1_5, pressure_1_10, latency_ms)
+
+bid_mask/ask_mask are 20-bit masks of the levels present in the blob (bit 0 =
+level 1). Full mode writes every book as a keyframe (is_key=1). Delta mode
+(DEPTH20_DELTA=1) writes only the levels that changed since the previous book
+of that security, skips books that did not change at all, and forces a keyframe
+every DEPTH20_KEYFRAME_EVERY rows per security (and on the first book after a
+restart), so any window can be rebuilt from the nearest keyframe.
+On a keyframe mask 0 means "side not seen"; on a delta it means "unchanged".
+
+    from teevra.depth_store import BookEncoder, latest_books, read_books
+    rows = BookEncoder(delta=True).encode(books, ts_iso, latency_ms, segs)   # merge_books() output
+    bk = latest_books(con)      # {"security_id", "ts", "bid_price" (m,20), ...} one fetch
+"""
+import os
+import sqlite3
+
+import numpy as np
+
+from teevra.dhan_decode import LEVELS, compute_pressures
+
+DELTA = os.getenv("DEPTH20_DELTA", "0") == "1"
+KEYFRAME_EVERY = int(os.getenv("DEPTH20_KEYFRAME_EVERY", "100"))
+
+LEVEL_DTYPE = np.dtype([("price", "<f8"), ("qty", "<u4"), ("orders", "<u4")])
+FULL_MASK = (1 << LEVELS) - 1
+_BITS = 1 << np.arange(LEVELS, dtype=np.int64)
+_EMPTY = b""
+
+DDL = """
+CREATE TABLE IF NOT EXISTS depth20_books (
+  security_id   INTEGER NOT NULL,
+  ts_recv_utc   TEXT    NOT NULL,        -- ISO8601 receive time
+  exchange_seg  TEXT    NOT NULL,
+  seq           INTEGER,
+  is_key        INTEGER NOT NULL,        -- 1 = full book, 0 = changed levels only
+  bid_mask      INTEGER NOT NULL,        -- bit i set = level i+1 present in bid_levels
+  ask_mask      INTEGER NOT NULL,
+  bid_levels    BLOB,                    -- packed (price f8, qty u4, orders u4) per masked level
+  ask_levels    BLOB,
+  best_bid      REAL,
+  best_ask      REAL,
+  top5_bid_qty  INTEGER,
+  top5_ask_qty  INTEGER,
+  top10_bid_qty INTEGER,
+  top10_ask_qty INTEGER,
+  pressure_1_5  REAL,
+  pressure_1_10 REAL,
+  latency_ms    REAL,
+  PRIMARY KEY (security_id, ts_recv_utc)
+);
+CREATE INDEX IF NOT EXISTS idx_d20b_ts ON depth20_books(ts_recv_utc);
+CREATE INDEX IF NOT EXISTS idx_d20b_key ON depth20_books(security_id, is_key, ts_recv_utc);
+"""
+
+INSERT_SQL = """
+  INSERT OR REPLACE INTO depth20_books(
+    security_id, ts_recv_utc, exchange_seg, seq, is_key, bid_mask, ask_mask,
+    bid_levels, ask_levels, best_bid, best_ask, top5_bid_qty, top5_ask_qty,
+    top10_bid_qty, top10_ask_qty, pressure_1_5, pressure_1_10, latency_ms
+  ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+_COLS = ("security_id, ts_recv_utc, exchange_seg, is_key, bid_mask, ask_mask, bid_levels, ask_levels, "
+         "top5_bid_qty, top5_ask_qty, top10_bid_qty, top10_ask_qty, pressure_1_5, pressure_1_10, latency_ms")
+
+
+def ensure_schema(con: sqlite3.Connection):
+    con.executescript(DDL)
+
+
+def has_books(con: sqlite3.Connection) -> bool:
+    try:
+        return con.execute("SELECT 1 FROM depth20_books LIMIT 1").fetchone() is not None
+    except sqlite3.Error:
+        return False
+
+
+def pack_levels(books: dict, side: str) -> np.ndarray:
+    """merge_books() side columns -> (m, 20) LEVEL_DTYPE array."""
+    m = len(books["security_id"])
+    lv = np.empty((m, LEVELS), dtype=LEVEL_DTYPE)
+    for k in ("price", "qty", "orders"):
+        lv[k] = books[f"{side}_{k}"]
+    return lv
+
+
+def mask_of(changed: np.ndarray) -> int:
+    return int(_BITS[changed].sum())
+
+
+def unmask(mask: int) -> np.ndarray:
+    return np.flatnonzero(mask & _BITS)
+
+
+class BookEncoder:
+    """
+    Turns decoded frames into depth20_books rows. Keeps the last book per
+    security (only used in delta mode) and the rows-since-keyframe counter.
+    One encoder per feed process; state is lost on restart, which just means
+    the next book of each security is written as a keyframe.
+    """
+
+    def __init__(self, delta: bool = DELTA, keyframe_every: int = KEYFRAME_EVERY):
+        self.delta = delta
+        self.keyframe_every = max(1, int(keyframe_every))
+        self._prev = {}          # sid -> [bid (20,) or None, ask (20,) or None, rows_since_key]
+        self.books_in = 0
+        self.rows_out = 0
+        self.levels_out = 0
+
+    def reset(self):
+        self._prev.clear()
+
+    def encode(self, books: dict, ts_iso: str, latency_ms: float, segs, seqs=None) -> list:
+        m = len(books["security_id"])
+        if not m:
+            return []
+        self.books_in += m
+        pr = compute_pressures(books["bid_qty"], books["ask_qty"])
+        bid, ask = pack_levels(books, "bid"), pack_levels(books, "ask")
+        has_b, has_a = books["has_bid"].tolist(), books["has_ask"].tolist()
+        best_b = np.where(books["has_bid"], books["bid_price"][:, 0], np.nan).tolist()
+        best_a = np.where(books["has_ask"], books["ask_price"][:, 0], np.nan).tolist()
+        agg = list(zip(pr["top5_bid"].tolist(), pr["top5_ask"].tolist(), pr["top10_bid"].tolist(),
+                       pr["top10_ask"].tolist(), pr["p_1_5"].tolist(), pr["p_1_10"].tolist()))
+        seqs = seqs.tolist() if seqs is not None else [None] * m
+        rows = []
+        for i, sid in enumerate(books["security_id"].tolist()):
+            b = bid[i] if has_b[i] else None
+            a = ask[i] if has_a[i] else None
+            if self.delta:
+                st = self._prev.get(sid)
+                key = st is None or st[2] + 1 >= self.keyframe_every
+                if st is None:
+                    st = self._prev[sid] = [None, None, 0]
+                if key:
+                    b = b if b is not None else st[0]      # keyframes carry the last known side
+                    a = a if a is not None else st[1]
+                    bm = FULL_MASK if b is not None else 0
+                    am = FULL_MASK if a is not None else 0
+                else:
+                    bm = mask_of(b != st[0]) if b is not None and st[0] is not None else (FULL_MASK if b is not None else 0)
+                    am = mask_of(a != st[1]) if a is not None and st[1] is not None else (FULL_MASK if a is not None else 0)
+                    if not bm and not am:
+                        continue
+                if b is not None:
+                    st[0] = b.copy()
+                if a is not None:
+                    st[1] = a.copy()
+                st[2] = 0 if key else st[2] + 1
+            else:
+                key = True
+                bm = FULL_MASK if b is not None else 0
+                am = FULL_MASK if a is not None else 0
+            bblob = b[unmask(bm)].tobytes() if bm else _EMPTY
+            ablob = a[unmask(am)].tobytes() if am else _EMPTY
+            self.levels_out += bin(bm).count("1") + bin(am).count("1")
+            b5, a5, b10, a10, p15, p110 = agg[i]
+            rows.append((sid, ts_iso, segs[i], seqs[i], int(key), bm, am, bblob, ablob,
+                         best_b[i], best_a[i], b5, a5, b10, a10, p15, p110, latency_ms))
+        self.rows_out += len(rows)
+        return rows
+
+
+def _fetch(con, sids=None, since=None, until=None, latest=False):
+    """
+    Rows needed to rebuild the requested window, ordered by (security_id, ts):
+    for each security everything from its last keyframe at/before `since` (or
+    its newest keyframe when latest=True) up to `until`.
+    """
+    cols = ", ".join("b." + c.strip() for c in _COLS.split(","))
+    in_sids = f" AND b.security_id IN ({','.join('?' * len(sids))})" if sids else ""
+    sid_params = [int(s) for s in sids] if sids else []
+    params = []
+    if since or latest:
+        key_where = "is_key=1" + (" AND ts_recv_utc <= ?" if not latest else "")
+        params += [since] if not latest else []
+        sql = f"""
+            WITH ks AS (SELECT security_id, MAX(ts_recv_utc) AS kts FROM depth20_books b
+                        WHERE {key_where}{in_sids} GROUP BY security_id)
+            SELECT {cols} FROM depth20_books b
+            {'JOIN' if latest else 'LEFT JOIN'} ks ON ks.security_id = b.security_id
+            WHERE b.ts_recv_utc >= COALESCE(ks.kts, ?)"""
+        params += sid_params + [since or ""]
+    else:
+        sql = f"SELECT {cols} FROM depth20_books b WHERE 1=1"
+    if until:
+        sql += " AND b.ts_recv_utc <= ?"
+        params.append(until)
+    sql += in_sids
+    params += sid_params
+    return con.execute(sql + " ORDER BY b.security_id, b.ts_recv_utc", params).fetchall()
+
+
+def _rebuild(rows, since=None, latest=False) -> dict:
+    """Apply keyframes/deltas in order and return full books as columnar arrays."""
+    n = len(rows)
+    out = {"security_id": np.zeros(n, dtype=np.int64), "ts": np.empty(n, dtype=object),
+           "exchange_seg": np.empty(n, dtype=object),
+           "has_bid": np.zeros(n, dtype=bool), "has_ask": np.zeros(n, dtype=bool)}
+    lv = {s: np.zeros((n, LEVELS), dtype=LEVEL_DTYPE) for s in ("bid", "ask")}
+    scal = np.full((n, 7), np.nan)
+    keep = np.zeros(n, dtype=bool)
+    cur_sid, state, has = None, None, None
+    for j, r in enumerate(rows):
+        sid, ts, seg, key, bm, am, bblob, ablob = r[:8]
+        if sid != cur_sid or key:
+            if sid != cur_sid and not key:
+                cur_sid, state, has = sid, None, None      # no keyframe yet for this security
+                continue
+            cur_sid = sid
+            state = {"bid": np.zeros(LEVELS, dtype=LEVEL_DTYPE), "ask": np.zeros(LEVELS, dtype=LEVEL_DTYPE)}
+            has = {"bid": False, "ask": False}
+        elif state is None:
+            continue
+        for side, mask, blob in (("bid", bm, bblob), ("ask", am, ablob)):
+            if mask:
+                state[side][unmask(mask)] = np.frombuffer(blob, dtype=LEVEL_DTYPE)
+                has[side] = True
+        out["security_id"][j], out["ts"][j], out["exchange_seg"][j] = sid, ts, seg
+        out["has_bid"][j], out["has_ask"][j] = has["bid"], has["ask"]
+        lv["bid"][j], lv["ask"][j] = state["bid"], state["ask"]
+        scal[j] = [np.nan if v is None else v for v in r[8:15]]
+        keep[j] = not since or latest or ts >= since
+    if latest:
+        # newest rebuilt row per security
+        last = np.r_[out["security_id"][1:] != out["security_id"][:-1], True] if n else keep
+        keep &= last
+    idx = np.flatnonzero(keep)
+    res = {k: v[idx] for k, v in out.items()}
+    for side in ("bid", "ask"):
+        res[f"{side}_price"] = lv[side]["price"][idx].astype(np.float64)
+        res[f"{side}_qty"] = lv[side]["qty"][idx].astype(np.int64)
+        res[f"{side}_orders"] = lv[side]["orders"][idx].astype(np.int64)
+    for j, k in enumerate(("top5_bid", "top5_ask", "top10_bid", "top10_ask", "p_1_5", "p_1_10", "latency_ms")):
+        res[k] = scal[idx, j]
+    return res
+
+
+def read_books(con: sqlite3.Connection, sids=None, since: str = None, until: str = None) -> dict:
+    """
+    Full books for every stored update in [since, until] (ISO ts strings, either
+    optional), rebuilt from the nearest keyframe. Columnar, ordered by
+    (security_id, ts): security_id, ts, exchange_seg, has_bid/has_ask (n,),
+    bid_/ask_ price/qty/orders (n,20), top5_*/top10_*/p_1_5/p_1_10/latency_ms (n,).
+    """
+    return _rebuild(_fetch(con, sids, since, until), since=since)
+
+
+def latest_books(con: sqlite3.Connection, sids=None) -> dict:
+    """Newest full book per security (same columns as read_books)."""
+    return _rebuild(_fetch(con, sids, latest=True), latest=True)
+
+
+def books_to_levels(books: dict, levels: int = LEVELS) -> list:
+    """Expand rebuilt books to depth20_levels-shaped tuples (ts, sid, side, level, price, qty, orders)."""
+    rows = []
+    for i, (sid, ts) in enumerate(zip(books["security_id"].tolist(), books["ts"].tolist())):
+        for side in ("bid", "ask"):
+            if not books[f"has_{side}"][i]:
+                continue
+            p = books[f"{side}_price"][i, :levels].tolist()
+            q = books[f"{side}_qty"][i, :levels].tolist()
+            o = books[f"{side}_orders"][i, :levels].tolist()
+            rows.extend((ts, sid, side.upper(), l + 1, p[l], q[l], o[l]) for l in range(len(p)))
+    return rows
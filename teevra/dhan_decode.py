@@ -0,0 +1,139 @@
+# C:\teevra18\teevra\dhan_decode.py
+"""
+Vectorised decoders for Dhan binary feed frames.
+
+One WebSocket message can stack many packets back to back. Instead of
+struct.unpack_from per field/level, these map the whole message onto
+precompiled NumPy dtypes with np.frombuffer and return columnar arrays.
+
+Depth-20 packet (svc-depth20):
+    header 12B: msg_len u16, feed_code u8, exch u8, security_id i32, seq u32
+    20 levels x 16B: price f64, qty u32, orders u32
+Ticker packet (feeder_dhan, big-endian):
+    resp_code u8, msg_len u16, exch u8, security_id i32, ltp f32, ltt i32
+"""
+import numpy as np
+
+LEVELS = 20
+FEED_CODE_BID = 41
+FEED_CODE_ASK = 51
+RESP_CODE_TICKER = 2
+
+
+def depth_dtypes(endian: str = "<"):
+    hdr = np.dtype([("msg_len", endian + "u2"), ("feed_code", "u1"), ("exch", "u1"),
+                    ("security_id", endian + "i4"), ("seq", endian + "u4")])
+    lvl = np.dtype([("price", endian + "f8"), ("qty", endian + "u4"), ("orders", endian + "u4")])
+    pkt = np.dtype([("hdr", hdr), ("levels", lvl, (LEVELS,))])
+    return hdr, pkt
+
+DEPTH_HDR, DEPTH_PKT = depth_dtypes("<")
+
+TICKER_PKT = np.dtype([("resp_code", "u1"), ("msg_len", ">u2"), ("exch", "u1"),
+                       ("security_id", ">i4"), ("ltp", ">f4"), ("ltt", ">i4")])
+
+
+def _packet_offsets(buf, hdr_dtype, size_field="msg_len", min_len=1):
+    """Walk header lengths only (cheap) for frames whose packets are not all one size."""
+    offs, off, n = [], 0, len(buf)
+    hsz = hdr_dtype.itemsize
+    while off + hsz <= n:
+        ln = int(np.frombuffer(buf, dtype=hdr_dtype, count=1, offset=off)[0][size_field])
+        if ln < min_len or off + ln > n:
+            break   # incomplete/garbled tail; drop like the struct parser did
+        offs.append((off, ln))
+        off += ln
+    return offs
+
+
+def decode_depth_frame(buf, pkt_dtype=DEPTH_PKT, hdr_dtype=DEPTH_HDR) -> dict:
+    """
+    Decode every depth packet in one message. Returns columnar arrays:
+        security_id (n,), exch (n,), feed_code (n,), seq (n,),
+        price (n,20) f8, qty (n,20) u4, orders (n,20) u4
+    Packets with other feed codes are kept; callers filter on feed_code.
+    """
+    size = pkt_dtype.itemsize
+    n_bytes = len(buf)
+    pk = None
+    if n_bytes and n_bytes % size == 0:
+        cand = np.frombuffer(buf, dtype=pkt_dtype)
+        if (cand["hdr"]["msg_len"] == size).all():
+            pk = cand                                  # fast path: uniform packets
+    if pk is None:
+        offs = [o for o, ln in _packet_offsets(buf, hdr_dtype, min_len=hdr_dtype.itemsize) if ln >= size]
+        if offs:
+            base = np.frombuffer(buf, dtype=np.uint8)
+            idx = (np.asarray(offs)[:, None] + np.arange(size)[None, :]).ravel()
+            pk = base[idx].view(pkt_dtype)
+        else:
+            pk = np.zeros(0, dtype=pkt_dtype)
+    hdr, lv = pk["hdr"], pk["levels"]
+    return {
+        "security_id": hdr["security_id"].astype(np.int64),
+        "exch": hdr["exch"],
+        "feed_code": hdr["feed_code"],
+        "seq": hdr["seq"],
+        "price": lv["price"].astype(np.float64),
+        "qty": lv["qty"].astype(np.int64),
+        "orders": lv["orders"].astype(np.int64),
+    }
+
+
+def merge_books(frame: dict) -> dict:
+    """
+    Pair BID/ASK packets per security_id (last packet wins within a frame).
+    Returns security_id (m,), exch (m,), seq (m,), has_bid/has_ask (m,) and
+    bid_*/ask_* (m,20) arrays; a missing side is zero-filled.
+    """
+    sid, code = frame["security_id"], frame["feed_code"]
+    keep = (code == FEED_CODE_BID) | (code == FEED_CODE_ASK)
+    sids = np.unique(sid[keep])
+    m = len(sids)
+    out = {"security_id": sids, "exch": np.zeros(m, dtype=np.uint8), "seq": np.zeros(m, dtype=np.int64),
+           "has_bid": np.zeros(m, dtype=bool), "has_ask": np.zeros(m, dtype=bool)}
+    for side, fc in (("bid", FEED_CODE_BID), ("ask", FEED_CODE_ASK)):
+        sel = np.flatnonzero(code == fc)
+        pos = np.searchsorted(sids, sid[sel])
+        for k in ("price", "qty", "orders"):
+            arr = np.zeros((m, LEVELS), dtype=frame[k].dtype)
+            arr[pos] = frame[k][sel]          # later duplicates overwrite earlier ones
+            out[f"{side}_{k}"] = arr
+        out[f"has_{side}"][pos] = True
+        out["exch"][pos] = frame["exch"][sel]
+        out["seq"][pos] = frame["seq"][sel]
+    return out
+
+
+def compute_pressures(bid_qty: np.ndarray, ask_qty: np.ndarray) -> dict:
+    """Vectorised twin of svc-depth20.compute_pressures over (m,20) qty arrays."""
+    b5, a5 = bid_qty[:, :5].sum(1), ask_qty[:, :5].sum(1)
+    b10, a10 = bid_qty[:, :10].sum(1), ask_qty[:, :10].sum(1)
+    def ratio(x, y):
+        s = (x + y).astype(np.float64)
+        return np.divide(x - y, s, out=np.zeros_like(s), where=s != 0)
+    return {"top5_bid": b5, "top5_ask": a5, "top10_bid": b10, "top10_ask": a10,
+            "p_1_5": ratio(b5, a5), "p_1_10": ratio(b10, a10)}
+
+
+def decode_ticker_frame(buf) -> dict:
+    """All ticker packets (resp_code 2) in a message -> security_id, ltp, ltt arrays."""
+    size = TICKER_PKT.itemsize
+    n_bytes = len(buf)
+    pk = None
+    if n_bytes and n_bytes % size == 0:
+        cand = np.frombuffer(buf, dtype=TICKER_PKT)
+        if (cand["msg_len"] == size).all() or len(cand) == 1:
+            pk = cand
+    if pk is None:
+        hdr = np.dtype([("resp_code", "u1"), ("msg_len", ">u2")])
+        offs = [o for o, ln in _packet_offsets(buf, hdr, min_len=hdr.itemsize) if ln >= size]
+        if n_bytes >= size and not offs:
+            offs = [0]                          # single packet with an odd length field
+        base = np.frombuffer(buf, dtype=np.uint8)
+        idx = (np.asarray(offs, dtype=np.int64)[:, None] + np.arange(size)[None, :]).ravel()
+        pk = base[idx].view(TICKER_PKT) if len(offs) else np.zeros(0, dtype=TICKER_PKT)
+    pk = pk[pk["resp_code"] == RESP_CODE_TICKER]
+    return {"security_id": pk["security_id"].astype(np.int64),
+            "ltp": pk["ltp"].astype(np.float64),
+            "ltt": pk["ltt"].astype(np.int64)}
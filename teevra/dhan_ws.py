@@ -5,22 +5,19 @@ import threading
 import asyncio
 import inspect
 from pathlib import Path
-from collections import deque
-from dataclasses import dataclass
-from typing import Optional
-
-import pandas as pd
 import pyarrow as pa
-import pyarrow.parquet as pq
 import psutil
 
 from teevra.db import ensure_schema, connect, put_health, log
+from teevra.db_writer import get_writer
+from teevra.tick_ring import TickRing, epoch_to_iso, to_pylist, null_mask
+from teevra.parquet_ticks import RollingTickWriter, ROLL_DIR
 
 # ---- Settings / Paths --------------------------------------------------------
 ENV = os.getenv("ENV", "local")
 DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
 DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\teevra18\data"))
-PARQUET_DIR = DATA_DIR / "parquet" / "ticks"
+PARQUET_DIR = ROLL_DIR   # rolling files; EOD compaction -> data\parquet\ticks
 LOG_DIR = Path(os.getenv("LOG_DIR", r"C:\teevra18\logs"))
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -49,38 +46,25 @@ from dhanhq import marketfeed as mf  # legacy async API: DhanFeed, Quote/Full/Ti
 MODE_CONST = {"QUOTE": mf.Quote, "FULL": mf.Full, "TICKER": mf.Ticker}[MODE]
 
 # ---- Data model --------------------------------------------------------------
-@dataclass
-class TickRow:
-    ts_utc: str
-    exchange_segment: int
-    security_id: int
-    mode: str
-    ltt_epoch: Optional[int]
-    ltp: Optional[float]
-    atp: Optional[float]
-    last_qty: Optional[int]
-    volume: Optional[int]
-    buy_qty_total: Optional[int]
-    sell_qty_total: Optional[int]
-    oi: Optional[int]
-    day_open: Optional[float]
-    day_high: Optional[float]
-    day_low: Optional[float]
-    day_close: Optional[float]
-    prev_close: Optional[float]
-    recv_ts_utc: str
-
-def _now_utc_iso() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+# Ticks live in a preallocated columnar ring (teevra.tick_ring); column order
+# matches ticks_raw with ts_utc/recv_ts_utc held as epoch seconds.
+MODE_CHAR = b"F" if MODE_CONST == mf.Full else (b"Q" if MODE_CONST == mf.Quote else b"T")
+
+TICKS_INSERT_SQL = """
+    INSERT INTO ticks_raw(
+        ts_utc,exchange_segment,security_id,mode,ltt_epoch,ltp,atp,last_qty,volume,
+        buy_qty_total,sell_qty_total,oi,day_open,day_high,day_low,day_close,prev_close,recv_ts_utc
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
 
 # ---- Ingestor ----------------------------------------------------------------
 class Ingestor:
     def __init__(self):
         ensure_schema()
         self.stop_evt = threading.Event()
-        self.buffer = deque()        # SQLite
-        self.parquet_buffer = []     # Parquet
-        self.lock = threading.Lock()
+        self.ring = TickRing()       # shared by the SQLite and Parquet flushers
+        self._last_dropped = 0
+        self.pq_writer = RollingTickWriter(PARQUET_DIR)
         self.last_recv_ts = 0.0
 
         # Subscriptions
@@ -99,45 +83,47 @@ class Ingestor:
 
     # --- DB flushers ----------------------------------------------------------
     def _flush_sqlite(self):
-        if not self.buffer:
+        if not self.ring.pending("sqlite"):
             return
-        rows = []
-        with self.lock:
-            while self.buffer and len(rows) < SQLITE_BATCH_SIZE:
-                tr: TickRow = self.buffer.popleft()
-                rows.append(
-                    (
-                        tr.ts_utc, tr.exchange_segment, tr.security_id, tr.mode, tr.ltt_epoch,
-                        tr.ltp, tr.atp, tr.last_qty, tr.volume, tr.buy_qty_total, tr.sell_qty_total,
-                        tr.oi, tr.day_open, tr.day_high, tr.day_low, tr.day_close, tr.prev_close, tr.recv_ts_utc
-                    )
-                )
-        if rows:
-            with connect() as c:
-                c.executemany(
-                    """
-                    INSERT INTO ticks_raw(
-                        ts_utc,exchange_segment,security_id,mode,ltt_epoch,ltp,atp,last_qty,volume,
-                        buy_qty_total,sell_qty_total,oi,day_open,day_high,day_low,day_close,prev_close,recv_ts_utc
-                    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    rows,
-                )
+        writer = get_writer(DB_PATH)
+        while True:
+            n, segs = self.ring.peek("sqlite", SQLITE_BATCH_SIZE)
+            if not n:
+                break
+            for seg in segs:
+                ts = epoch_to_iso(seg["ts_epoch"]).tolist()
+                recv = epoch_to_iso(seg["recv_epoch"]).tolist()
+                cols = [to_pylist(seg[k]) for k in (
+                    "exchange_segment", "security_id", "mode", "ltt_epoch", "ltp", "atp",
+                    "last_qty", "volume", "buy_qty_total", "sell_qty_total", "oi",
+                    "day_open", "day_high", "day_low", "day_close", "prev_close")]
+                writer.submit(TICKS_INSERT_SQL, list(zip(ts, *cols, recv)))
+            self.ring.advance("sqlite", n)
+        if self.ring.dropped != self._last_dropped:
+            self._last_dropped = self.ring.dropped
+            put_health("m1_ring_dropped", str(self._last_dropped))
+            log("WARN", "ingest", f"tick ring full; dropped={self._last_dropped}")
 
     def _flush_parquet(self):
-        if not self.parquet_buffer:
-            return
-        df = pd.DataFrame(self.parquet_buffer)
-        self.parquet_buffer.clear()
-        if df.empty:
+        n, segs = self.ring.peek("parquet")
+        if not n:
             return
-        df["ds"] = pd.to_datetime(df["ts_utc"]).dt.date.astype(str)
-        table = pa.Table.from_pandas(df)
-        pq.write_to_dataset(
-            table,
-            root_path=str(PARQUET_DIR),
-            partition_cols=["ds", "exchange_segment", "security_id"]
-        )
+        for seg in segs:
+            arrays, names = [], []
+            for name, col in seg.items():
+                if name in ("ts_epoch", "recv_epoch"):
+                    arrays.append(pa.array(epoch_to_iso(col)))
+                    names.append("ts_utc" if name == "ts_epoch" else "recv_ts_utc")
+                elif name == "mode":
+                    arrays.append(pa.array(col.astype(str)))
+                    names.append(name)
+                else:
+                    arrays.append(pa.array(col, mask=null_mask(col)))
+                    names.append(name)
+            arrays.append(pa.array(seg["ts_epoch"].astype("datetime64[D]").astype(str)))
+            names.append("ds")
+            self.pq_writer.write(pa.Table.from_arrays(arrays, names=names))
+        self.ring.advance("parquet", n)
 
     # --- Watchlist ------------------------------------------------------------
     def _load_watchlist(self):
@@ -269,30 +255,27 @@ class Ingestor:
         if sid is None:
             return  # Cannot map to instrument; skip
 
-        row = TickRow(
-            ts_utc=_now_utc_iso(),
-            exchange_segment=seg,
-            security_id=sid,
-            mode=("F" if MODE_CONST == mf.Full else ("Q" if MODE_CONST == mf.Quote else "T")),
-            ltt_epoch=as_int(ltt_raw),
-            ltp=as_float(first_key(D, "LTP", "ltp")),
-            atp=as_float(first_key(D, "ATP", "atp")),
-            last_qty=as_int(first_key(D, "LastQty", "lastQty", "LastTradedQty")),
-            volume=as_int(first_key(D, "Volume", "volume", "TotalTradedVolume")),
-            buy_qty_total=as_int(first_key(D, "TotalBuyQty", "totalBuyQty")),
-            sell_qty_total=as_int(first_key(D, "TotalSellQty", "totalSellQty")),
-            oi=as_int(first_key(D, "OI", "oi", "OpenInterest")),
-            day_open=as_float(first_key(D, "Open", "open")),
-            day_high=as_float(first_key(D, "High", "high")),
-            day_low=as_float(first_key(D, "Low", "low")),
-            day_close=as_float(first_key(D, "Close", "close")),
-            prev_close=as_float(first_key(D, "PrevClose", "prevClose", "PreviousClose")),
-            recv_ts_utc=_now_utc_iso(),
-        )
-
-        with self.lock:
-            self.buffer.append(row)
-            self.parquet_buffer.append(row.__dict__)
+        now = int(time.time())
+        self.ring.append((
+            now,
+            seg,
+            sid,
+            MODE_CHAR,
+            as_int(ltt_raw),
+            as_float(first_key(D, "LTP", "ltp")),
+            as_float(first_key(D, "ATP", "atp")),
+            as_int(first_key(D, "LastQty", "lastQty", "LastTradedQty")),
+            as_int(first_key(D, "Volume", "volume", "TotalTradedVolume")),
+            as_int(first_key(D, "TotalBuyQty", "totalBuyQty")),
+            as_int(first_key(D, "TotalSellQty", "totalSellQty")),
+            as_int(first_key(D, "OI", "oi", "OpenInterest")),
+            as_float(first_key(D, "Open", "open")),
+            as_float(first_key(D, "High", "high")),
+            as_float(first_key(D, "Low", "low")),
+            as_float(first_key(D, "Close", "close")),
+            as_float(first_key(D, "PrevClose", "prevClose", "PreviousClose")),
+            now,
+        ))
         self.last_recv_ts = time.time()
 
     def _parse_any(self, pkt):
@@ -341,6 +324,13 @@ class Ingestor:
 
             time.sleep(FLUSH_LOOP_SLEEP_SECS)
 
+        # final drain; closing writes the Parquet footers and marks files closed in the manifest
+        try:
+            self._flush_sqlite()
+            self._flush_parquet()
+        finally:
+            self.pq_writer.close()
+
     # --- Async driver ---------------------------------------------------------
     async def _async_main(self):
         """Connect, (re)subscribe, and consume packets."""
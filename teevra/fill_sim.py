@@ -0,0 +1,298 @@
+# C:\teevra18\teevra\fill_sim.py
+"""
+Path-accurate paper fills and SL/TP resolution, shared by M9 and the backtester.
+
+A "tape" is every tick (symbol, ts_ms, price) sorted by (symbol, ts). Orders
+look at their own slice of the tape and are resolved together; bar data
+(bar_exits) walks each bar as O-L-H-C (up bar) or O-H-L-C (down bar):
+
+    entry   first tick at/after the delayed fill time, plus slippage
+    exit    first tick that touches SL or TP (same tick -> SL, pessimistic)
+            TP is a resting limit: exits at the TP price
+            SL is a stop-market: exits at the touching tick, so a gap through
+            the stop exits at the worse price, then pays slippage (on bars the
+            path is continuous: the stop price, unless the open gapped through)
+
+Slippage comes from the latest depth-20 book of the instrument: the distance
+from mid to the VWAP of walking the opposite side for the order qty (half the
+spread for small orders, more when qty eats through the top levels).
+Instruments without a book use FILL_SLIP_DEFAULT_PTS.
+
+    from teevra import fill_sim
+    slip = fill_sim.SlippageModel.load(conn, {"NIFTY 24500 CE": 53215})
+    tape = fill_sim.Tape(sym, ts_ms, px)
+    ex = fill_sim.resolve_exits(tape, order_sym, after_ms, side, sl, tp, qty, slip)
+"""
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+LONG, SHORT = 1, -1
+NO_HIT, SL_HIT, TP_HIT = 0, 1, 2
+EVENTS = np.array(["", "SL_HIT", "TP_HIT"], dtype=object)
+
+SLIP_DEFAULT_PTS = float(os.getenv("FILL_SLIP_DEFAULT_PTS", "0"))
+TP_TRADE_THROUGH = os.getenv("FILL_TP_TRADE_THROUGH", "0") == "1"   # 1: a touch is not enough to fill TP
+BLOCK = 256
+TS_SPAN = 1 << 42                   # epoch ms fit below this until 2109
+
+
+# ---- first crossing search ----------------------------------------------------
+class _BlockMax:
+    """Block maxima + sparse table over them, for 'first i >= start with x[i] >= thr' queries."""
+
+    def __init__(self, x):
+        n = len(x)
+        nb = max(1, -(-n // BLOCK))
+        self.x = np.full(nb * BLOCK, -np.inf)
+        self.x[:n] = x
+        self.n = n
+        bmax = self.x.reshape(nb, BLOCK).max(axis=1)
+        self.st = [bmax]
+        w = 1
+        while 2 * w <= nb:
+            prev = self.st[-1]
+            self.st.append(np.maximum(prev[:len(prev) - w], prev[w:]))
+            w *= 2
+
+    def _scan(self, block, start, stop, thr):
+        # (k, BLOCK) gather of one block per query -> first qualifying position or -1
+        pos = block[:, None] * BLOCK + np.arange(BLOCK)
+        ok = (pos >= start[:, None]) & (pos < stop[:, None]) & (self.x[pos] >= thr[:, None])
+        return np.where(ok.any(axis=1), pos[np.arange(len(pos)), ok.argmax(axis=1)], -1)
+
+    def first(self, start, stop, thr):
+        start, stop = np.asarray(start, dtype=np.int64), np.asarray(stop, dtype=np.int64)
+        thr = np.asarray(thr, dtype=np.float64)
+        out = np.full(len(start), -1, dtype=np.int64)
+        live = np.flatnonzero(stop > start)
+        if not len(live):
+            return out
+        s, e, t = start[live], stop[live], thr[live]
+        hit = self._scan(s // BLOCK, s, e, t)
+        out[live] = hit
+        rest = hit < 0
+        if not rest.any():
+            return out
+        live, s, e, t = live[rest], s[rest], e[rest], t[rest]
+        # binary lifting over whole blocks (b0+1 .. last block of the range)
+        cur = s // BLOCK + 1
+        last = (e - 1) // BLOCK
+        for lvl in range(len(self.st) - 1, -1, -1):
+            w = 1 << lvl
+            tab = self.st[lvl]
+            can = (cur + w - 1 <= last) & (cur < len(tab))
+            idx = np.clip(cur, 0, len(tab) - 1)
+            jump = can & (tab[idx] < t)
+            cur = np.where(jump, cur + w, cur)
+        found = cur <= last
+        if found.any():
+            k = np.flatnonzero(found)
+            out[live[k]] = self._scan(cur[k], s[k], e[k], t[k])
+        return out
+
+
+class Tape:
+    """Ticks sorted by (symbol, ts); each symbol owns one contiguous slice."""
+
+    def __init__(self, symbol, ts_ms, px):
+        symbol = np.asarray(symbol, dtype=object)
+        ts_ms, px = np.asarray(ts_ms, dtype=np.int64), np.asarray(px, dtype=np.float64)
+        code = pd.factorize(symbol, sort=True)[0].astype(np.int64)
+        # (symbol rank, ts) packed into one sorted int64 key: one searchsorted serves every order
+        key = code * TS_SPAN + np.clip(ts_ms, 0, TS_SPAN - 1)
+        order = np.argsort(key, kind="stable")
+        self.symbol, self.ts, self.px, key = symbol[order], ts_ms[order], px[order], key[order]
+        code = code[order]
+        n = len(self.px)
+        first = np.r_[True, code[1:] != code[:-1]] if n else np.zeros(0, dtype=bool)
+        starts = np.flatnonzero(first)
+        ends = np.r_[starts[1:], n]
+        self.seg = {s: (int(a), int(b), int(r)) for s, a, b, r in zip(self.symbol[starts], starts, ends, code[starts])}
+        self.key = key
+        self._up = self._dn = None
+
+    def __len__(self):
+        return len(self.px)
+
+    def _segs(self, symbols):
+        return np.array([self.seg.get(s, (0, 0, -1)) for s in symbols], dtype=np.int64).reshape(-1, 3)
+
+    def bounds(self, symbols):
+        """(start, stop) slice per requested symbol ((0, 0) when absent)."""
+        b = self._segs(symbols)
+        return b[:, 0], b[:, 1]
+
+    def first_at_or_after(self, symbols, ts_ms, strict=False):
+        """Index of the first tick at (or strictly after) ts in each symbol's slice, -1 if none."""
+        b = self._segs(symbols)
+        q = np.clip(np.asarray(ts_ms, dtype=np.int64), 0, TS_SPAN - 1)
+        i = np.searchsorted(self.key, b[:, 2] * TS_SPAN + q, side="right" if strict else "left")
+        return np.where((b[:, 2] >= 0) & (i < b[:, 1]), i, -1)
+
+    def first_above(self, start, stop, thr):
+        if self._up is None:
+            self._up = _BlockMax(self.px)
+        return self._up.first(start, stop, thr)
+
+    def first_below(self, start, stop, thr):
+        if self._dn is None:
+            self._dn = _BlockMax(-self.px)
+        return self._dn.first(start, stop, -np.asarray(thr, dtype=np.float64))
+
+
+# ---- slippage -------------------------------------------------------------------
+class SlippageModel:
+    """Per-symbol cost in price points of crossing the book for a given qty."""
+
+    def __init__(self, books: dict = None, default_pts: float = SLIP_DEFAULT_PTS):
+        # books: symbol -> (bid_px[20], bid_qty[20], ask_px[20], ask_qty[20])
+        self.books = books or {}
+        self.default = float(default_pts)
+
+    @classmethod
+    def load(cls, conn, sid_by_symbol: dict, default_pts: float = SLIP_DEFAULT_PTS):
+        """Latest depth-20 book per instrument (depth20_books, else legacy depth20_levels)."""
+        sym_by_sid = {int(v): k for k, v in sid_by_symbol.items() if str(v).strip().isdigit()}
+        if not sym_by_sid:
+            return cls({}, default_pts)
+        books = {}
+        from teevra import depth_store
+        if depth_store.has_books(conn):
+            bk = depth_store.latest_books(conn, list(sym_by_sid))
+            for i, sid in enumerate(bk["security_id"].tolist()):
+                if bk["has_bid"][i] and bk["has_ask"][i]:
+                    books[sym_by_sid[sid]] = (bk["bid_price"][i], bk["bid_qty"][i].astype(np.float64),
+                                              bk["ask_price"][i], bk["ask_qty"][i].astype(np.float64))
+        else:
+            sids = list(sym_by_sid)
+            try:
+                rows = conn.execute(f"""
+                    SELECT l.security_id, l.side, l.level, l.price, l.qty FROM depth20_levels l
+                    JOIN (SELECT security_id, MAX(ts_recv_utc) AS ts FROM depth20_levels
+                          WHERE security_id IN ({','.join('?' * len(sids))}) GROUP BY security_id) m
+                      ON m.security_id = l.security_id AND m.ts = l.ts_recv_utc""", sids).fetchall()
+            except sqlite3.Error:
+                rows = []
+            tmp = {}
+            for sid, side, lvl, price, qty in rows:
+                b = tmp.setdefault(int(sid), np.zeros((4, 20)))
+                k = 0 if side == "BID" else 2
+                if 1 <= int(lvl) <= 20:
+                    b[k, int(lvl) - 1], b[k + 1, int(lvl) - 1] = price, qty
+            for sid, b in tmp.items():
+                if b[1].sum() > 0 and b[3].sum() > 0:
+                    books[sym_by_sid[sid]] = (b[0], b[1], b[2], b[3])
+        return cls(books, default_pts)
+
+    def points(self, symbols, qty, buying) -> np.ndarray:
+        """Slippage (>= 0, price points) for each (symbol, qty, buy/sell) request."""
+        qty = np.broadcast_to(np.asarray(qty, dtype=np.float64), (len(symbols),))
+        buying = np.broadcast_to(np.asarray(buying, dtype=bool), (len(symbols),))
+        out = np.full(len(symbols), self.default)
+        have = [k for k, s in enumerate(symbols) if s in self.books]
+        if not have:
+            return out
+        k = np.array(have)
+        bk = [self.books[symbols[i]] for i in have]
+        bid_px, bid_q, ask_px, ask_q = (np.stack([b[j] for b in bk]) for j in range(4))
+        mid = 0.5 * (bid_px[:, 0] + ask_px[:, 0])
+        b = buying[k][:, None]
+        px, q = np.where(b, ask_px, bid_px), np.where(b, ask_q, bid_q)
+        want = qty[k][:, None]
+        before = np.cumsum(q, axis=1) - q
+        take = np.clip(want - before, 0.0, q)
+        filled = take.sum(axis=1)
+        # past the visible book the remainder prices at the worst level seen
+        worst = px[np.arange(len(k)), np.maximum((q > 0).sum(axis=1) - 1, 0)]
+        notional = (take * px).sum(axis=1) + np.maximum(qty[k] - filled, 0.0) * worst
+        vwap = notional / np.maximum(qty[k], 1e-12)
+        out[k] = np.where(mid > 0, np.abs(vwap - mid), self.default)
+        return out
+
+
+# ---- fills / exits ----------------------------------------------------------------
+def fill_price(px, side, slip_pts):
+    """Entry pays slippage: BUY above the tape, SELL below."""
+    return np.maximum(np.asarray(px) + np.where(np.asarray(side) == LONG, 1.0, -1.0) * slip_pts, 0.0)
+
+
+def resolve_fills(tape: Tape, symbols, fill_at_ms, side, qty, slip: SlippageModel = None):
+    """First tick at/after each order's fill time -> (tape index or -1, fill price)."""
+    i = tape.first_at_or_after(symbols, fill_at_ms)
+    px = np.where(i >= 0, tape.px[np.maximum(i, 0)] if len(tape) else np.nan, np.nan)
+    pts = slip.points(symbols, qty, np.asarray(side) == LONG) if slip is not None else 0.0
+    return i, np.where(i >= 0, fill_price(px, side, pts), np.nan)
+
+
+def exit_prices(event, touch_px, side, sl, tp, slip_pts):
+    """TP exits at TP; SL exits at the touching price (gap-through) less slippage."""
+    lg = np.asarray(side) == LONG
+    stop_px = np.where(lg, np.minimum(touch_px, sl), np.maximum(touch_px, sl))
+    stop_px = np.maximum(stop_px + np.where(lg, -1.0, 1.0) * slip_pts, 0.0)
+    return np.where(event == TP_HIT, tp, np.where(event == SL_HIT, stop_px, np.nan))
+
+
+def resolve_exits(tape: Tape, symbols, after_ms, side, sl, tp, qty=1, slip: SlippageModel = None,
+                  start=None, strict=True):
+    """
+    First SL/TP touch for every order on its symbol's ticks after `after_ms`
+    (or from tape index `start` when given). Returns dict of arrays:
+    idx (tape index, -1 = still open), event (NO_HIT/SL_HIT/TP_HIT), ts_ms, price.
+    """
+    side, sl, tp = np.asarray(side), np.asarray(sl, dtype=np.float64), np.asarray(tp, dtype=np.float64)
+    n = len(side)
+    a, b = tape.bounds(symbols)
+    if start is None:
+        s = tape.first_at_or_after(symbols, after_ms, strict=strict)
+    else:
+        s = np.asarray(start, dtype=np.int64)
+    s = np.where(s >= 0, s, b)
+    lg = side == LONG
+    tp_thr = tp + np.where(lg, 1e-9, -1e-9) if TP_TRADE_THROUGH else tp
+    # LONG: TP above / SL below; SHORT the other way round
+    up_thr = np.where(lg, tp_thr, sl)
+    dn_thr = np.where(lg, sl, tp_thr)
+    up = tape.first_above(s, b, up_thr) if n else np.zeros(0, dtype=np.int64)
+    dn = tape.first_below(s, b, dn_thr) if n else np.zeros(0, dtype=np.int64)
+    big = np.iinfo(np.int64).max
+    tp_i = np.where(lg, up, dn)
+    sl_i = np.where(lg, dn, up)
+    tp_k, sl_k = np.where(tp_i >= 0, tp_i, big), np.where(sl_i >= 0, sl_i, big)
+    idx = np.minimum(tp_k, sl_k)
+    event = np.where(idx == big, NO_HIT, np.where(sl_k <= tp_k, SL_HIT, TP_HIT))
+    idx = np.where(idx == big, -1, idx)
+    touch = np.where(idx >= 0, tape.px[np.maximum(idx, 0)] if len(tape) else np.nan, np.nan)
+    pts = slip.points(symbols, qty, ~lg) if slip is not None else np.zeros(n)
+    return {"idx": idx, "event": event,
+            "ts_ms": np.where(idx >= 0, tape.ts[np.maximum(idx, 0)] if len(tape) else -1, -1),
+            "price": exit_prices(event, touch, side, sl, tp, pts)}
+
+
+def bar_exits(o, h, l, c, side, sl, tp, slip_pts=0.0, skip_open=False):
+    """
+    One bar per order ((k,) arrays): the same first-touch rules on the bar's
+    O-L/H-C path, for the backtester's per-bar step. skip_open ignores the open
+    (the order filled on it, and M9 only exits on later ticks). Returns (event, price).
+    """
+    o, h, l, c, sl, tp = (np.asarray(a, dtype=np.float64) for a in (o, h, l, c, sl, tp))
+    up = c >= o
+    path = np.stack([o, np.where(up, l, h), np.where(up, h, l), c], axis=1)
+    lg = (np.asarray(side) == LONG)[:, None]
+    tp_thr = tp + np.where(lg[:, 0], 1e-9, -1e-9) if TP_TRADE_THROUGH else tp
+    tp_hit = np.where(lg, path >= tp_thr[:, None], path <= tp_thr[:, None])
+    sl_hit = np.where(lg, path <= sl[:, None], path >= sl[:, None])
+    after = np.arange(4) >= np.asarray(skip_open, dtype=np.int64).reshape(-1, 1)
+    tp_hit &= after
+    sl_hit &= after
+    valid = ~np.isnan(path).any(axis=1)
+    big = 4
+    tp_k = np.where(tp_hit.any(axis=1), tp_hit.argmax(axis=1), big)
+    sl_k = np.where(sl_hit.any(axis=1), sl_hit.argmax(axis=1), big)
+    k = np.minimum(tp_k, sl_k)
+    event = np.where(~valid | (k == big), NO_HIT, np.where(sl_k <= tp_k, SL_HIT, TP_HIT))
+    # inside a bar the price moves continuously, so only the open can gap through a stop
+    touch = np.where(k == 0, path[:, 0], sl)
+    return event, exit_prices(event, touch, side, sl, tp, slip_pts)
@@ -0,0 +1,184 @@
+# C:\teevra18\teevra\greeks.py
+"""
+Batch Black-Scholes pricing, greeks and implied volatility on NumPy arrays.
+
+Everything takes broadcastable arrays (one element per option leg) so a full
+chain, or every leg of a sweep, is solved in one call. Units follow the Dhan
+option chain so computed values can sit next to broker ones:
+
+    implied volatility  percent (12.5 = 12.5%)
+    delta               per 1 point of spot
+    gamma               per 1 point of spot
+    theta               rupees per calendar day
+    vega                rupees per 1 vol point
+
+    from teevra.greeks import implied_vol, bs_greeks, year_fraction
+    T = year_fraction(expiry, now_utc)                    # expiry 15:30 IST
+    iv = implied_vol(ltp, spot, strike, T, is_call)       # decimal, NaN if no solution
+    g = bs_greeks(spot, strike, T, iv, is_call)
+"""
+import os
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+RISK_FREE = float(os.getenv("BS_RISK_FREE", "0.065"))
+DIV_YIELD = float(os.getenv("BS_DIV_YIELD", "0.0"))
+IST = ZoneInfo("Asia/Kolkata")
+EXPIRY_CLOSE = dt.time(15, 30)
+YEAR_SECS = 365.0 * 86400.0
+SIGMA_LO, SIGMA_HI = 1e-4, 5.0
+
+_SQRT2 = np.sqrt(2.0)
+_INV_SQRT2PI = 1.0 / np.sqrt(2.0 * np.pi)
+
+
+def _erfc(x):
+    # Chebyshev fit (Numerical Recipes erfcc), fractional error < 1.2e-7 everywhere
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+            -0.82215223 + t * 0.17087277)))))))))
+    return np.where(x >= 0, r, 2.0 - r)
+
+
+def norm_cdf(x):
+    return 0.5 * _erfc(-np.asarray(x, dtype=np.float64) / _SQRT2)
+
+
+def norm_pdf(x):
+    x = np.asarray(x, dtype=np.float64)
+    return _INV_SQRT2PI * np.exp(-0.5 * x * x)
+
+
+def year_fraction(expiry, now_utc=None):
+    """Years from now to expiry day 15:30 IST. `expiry` is 'YYYY-MM-DD' or a sequence of them."""
+    now = now_utc or dt.datetime.now(dt.timezone.utc)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=dt.timezone.utc)
+    cache = {}
+
+    def one(e):
+        t = cache.get(e)
+        if t is None:
+            close = dt.datetime.combine(dt.date.fromisoformat(str(e)[:10]), EXPIRY_CLOSE, IST)
+            t = cache[e] = (close - now).total_seconds() / YEAR_SECS
+        return t
+
+    if isinstance(expiry, str):
+        return one(expiry)
+    return np.array([one(e) for e in expiry], dtype=np.float64)
+
+
+def _d1d2(S, K, T, sigma, r, q):
+    vt = sigma * np.sqrt(T)
+    d1 = (np.log(S / K) + (r - q + 0.5 * sigma * sigma) * T) / vt
+    return d1, d1 - vt
+
+
+def bs_price(S, K, T, sigma, is_call, r=RISK_FREE, q=DIV_YIELD):
+    S, K, T, sigma = (np.asarray(a, dtype=np.float64) for a in (S, K, T, sigma))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1, d2 = _d1d2(S, K, T, sigma, r, q)
+        dq, dr = np.exp(-q * T), np.exp(-r * T)
+        call = S * dq * norm_cdf(d1) - K * dr * norm_cdf(d2)
+        put = K * dr * norm_cdf(-d2) - S * dq * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def bs_greeks(S, K, T, iv, is_call, r=RISK_FREE, q=DIV_YIELD) -> dict:
+    """iv in decimal; returns delta, gamma, theta (per day), vega (per vol point). NaN where iv/T invalid."""
+    S, K, T, iv = (np.asarray(a, dtype=np.float64) for a in (S, K, T, iv))
+    is_call = np.asarray(is_call, dtype=bool)
+    ok = (T > 0) & (iv > 0) & (S > 0) & (K > 0)
+    T_, iv_ = np.where(ok, T, 1.0), np.where(ok, iv, 0.2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1, d2 = _d1d2(S, K, T_, iv_, r, q)
+        dq, dr = np.exp(-q * T_), np.exp(-r * T_)
+        pdf, sq = norm_pdf(d1), np.sqrt(T_)
+        delta = np.where(is_call, dq * norm_cdf(d1), dq * (norm_cdf(d1) - 1.0))
+        gamma = dq * pdf / (S * iv_ * sq)
+        decay = -S * dq * pdf * iv_ / (2.0 * sq)
+        theta = np.where(is_call,
+                         decay - r * K * dr * norm_cdf(d2) + q * S * dq * norm_cdf(d1),
+                         decay + r * K * dr * norm_cdf(-d2) - q * S * dq * norm_cdf(-d1)) / 365.0
+        vega = S * dq * pdf * sq / 100.0
+    nan = np.nan
+    return {"delta": np.where(ok, delta, nan), "gamma": np.where(ok, gamma, nan),
+            "theta": np.where(ok, theta, nan), "vega": np.where(ok, vega, nan)}
+
+
+def implied_vol(price, S, K, T, is_call, r=RISK_FREE, q=DIV_YIELD, tol=1e-6, max_iter=60):
+    """
+    Decimal IV for every leg at once: Newton steps kept inside a [lo, hi] bracket
+    that shrinks every iteration, falling back to bisection when Newton would leave
+    it or vega vanishes. NaN where the price is outside no-arbitrage bounds or T <= 0.
+    """
+    price, S, K, T = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (price, S, K, T)))
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), price.shape)
+    out = np.full(price.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dq, dr = np.exp(-q * T), np.exp(-r * T)
+        lower = np.where(is_call, np.maximum(S * dq - K * dr, 0.0), np.maximum(K * dr - S * dq, 0.0))
+        upper = np.where(is_call, S * dq, K * dr)
+    ok = (T > 0) & (S > 0) & (K > 0) & np.isfinite(price) & (price > lower) & (price < upper)
+    idx = np.flatnonzero(ok.ravel())
+    if not len(idx):
+        return out
+    p, s, k, t, c = (a.ravel()[idx] for a in (price, S, K, T, is_call))
+    lo, hi = np.full(len(idx), SIGMA_LO), np.full(len(idx), SIGMA_HI)
+    # Brenner-Subrahmanyam start on the time value, clipped into the bracket
+    tv = p - np.where(c, np.maximum(s - k, 0.0), np.maximum(k - s, 0.0))
+    sig = np.clip(np.sqrt(2.0 * np.pi / t) * np.maximum(tv, 1e-8) / s, 0.02, 2.0)
+    live = np.arange(len(idx))
+    for _ in range(max_iter):
+        ss, kk, tt, cc, sg = s[live], k[live], t[live], c[live], sig[live]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diff = bs_price(ss, kk, tt, sg, cc, r, q) - p[live]
+            d1, _ = _d1d2(ss, kk, tt, sg, r, q)
+            vega = ss * np.exp(-q * tt) * norm_pdf(d1) * np.sqrt(tt)
+        done = np.abs(diff) < tol * np.maximum(1.0, p[live])
+        hi[live] = np.where(diff > 0, sg, hi[live])
+        lo[live] = np.where(diff <= 0, sg, lo[live])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = sg - diff / vega
+        inside = (vega > 1e-12) & (newton > lo[live]) & (newton < hi[live])
+        sig[live] = np.where(done, sg, np.where(inside, newton, 0.5 * (lo[live] + hi[live])))
+        done |= (hi[live] - lo[live]) < 1e-10
+        live = live[~done]
+        if not len(live):
+            break
+    res = np.where((sig > SIGMA_LO * 1.0001) & (sig < SIGMA_HI * 0.9999), sig, np.nan)
+    out.ravel()[idx] = res
+    return out
+
+
+def fill_missing(ltp, spot, strike, T, is_call, iv_pct, delta, gamma, theta, vega):
+    """
+    Fill legs whose broker IV / greeks are missing (None/NaN/0). Broker values are
+    never overwritten. Inputs are float arrays (one per leg); returns
+    (iv_pct, delta, gamma, theta, vega, n_iv_filled, n_greeks_filled).
+    """
+    iv_pct, delta, gamma, theta, vega = (np.array(a, dtype=np.float64) for a in (iv_pct, delta, gamma, theta, vega))
+    ltp = np.asarray(ltp, dtype=np.float64)
+    no_iv = ~(iv_pct > 0)
+    no_g = ~((np.abs(np.nan_to_num(delta)) > 0) | (np.nan_to_num(gamma) > 0) | (np.nan_to_num(vega) > 0))
+    need = (no_iv | no_g) & (ltp > 0)
+    if not need.any():
+        return iv_pct, delta, gamma, theta, vega, 0, 0
+    sig = np.where(no_iv, np.nan, iv_pct / 100.0)
+    solve = need & no_iv
+    if solve.any():
+        sig[solve] = implied_vol(ltp[solve], np.broadcast_to(spot, ltp.shape)[solve],
+                                 np.asarray(strike, dtype=np.float64)[solve],
+                                 np.broadcast_to(T, ltp.shape)[solve], np.asarray(is_call)[solve])
+    got_iv = solve & np.isfinite(sig)
+    iv_pct[got_iv] = sig[got_iv] * 100.0
+    fill_g = need & no_g & np.isfinite(sig)
+    if fill_g.any():
+        g = bs_greeks(np.broadcast_to(spot, ltp.shape)[fill_g], np.asarray(strike, dtype=np.float64)[fill_g],
+                      np.broadcast_to(T, ltp.shape)[fill_g], sig[fill_g], np.asarray(is_call)[fill_g])
+        delta[fill_g], gamma[fill_g], theta[fill_g], vega[fill_g] = g["delta"], g["gamma"], g["theta"], g["vega"]
+    return iv_pct, delta, gamma, theta, vega, int(got_iv.sum()), int(fill_g.sum())
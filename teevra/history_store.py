@@ -0,0 +1,284 @@
+# C:\teevra18\teevra\history_store.py
+"""
+Compacted historical candle store + catalog.
+
+The loader (services/historical/svc_historical_loader.py) writes one small file
+per API window:
+    data\\history\\<tf>\\<segment>\\<instrument>\\<symbol>\\year=Y\\month=MM\\part-<from>_<to>.parquet
+
+Compaction folds every month directory into one file sorted by ts_utc, with a
+fixed non-dictionary schema (HIST_SCHEMA; year/month live only in the path),
+row groups of HIST_PARQUET_ROW_GROUP rows and column statistics, so a ts_utc
+filter only touches the row groups it needs:
+    ...\\year=Y\\month=MM\\part-0.parquet
+
+Every compacted file is recorded in the hist_catalog table (symbol, securityId,
+timeframe, ts range, rows) so readers pick files without listing directories:
+
+    from teevra import history_store as hs
+    t = hs.read("5m", "RELIANCE", start="2025-01-01", end="2025-02-01", columns=["ts_utc", "close"])
+
+Usage:
+    python -m teevra.history_store compact [--timeframe 5m] [--symbol RELIANCE] [--keep]
+    python -m teevra.history_store catalog          # rebuild hist_catalog from file footers
+"""
+import os
+import sqlite3
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\teevra18\data"))
+HIST_DIR = DATA_DIR / "history"
+DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
+
+ROW_GROUP = int(os.getenv("HIST_PARQUET_ROW_GROUP", "8192"))
+COMPRESSION = os.getenv("HIST_PARQUET_COMPRESSION", "zstd")
+COMPACT_NAME = "part-0.parquet"
+
+HIST_SCHEMA = pa.schema([
+    ("ts_utc", pa.timestamp("ns", tz="UTC")),
+    ("ts_ist", pa.timestamp("ns", tz="Asia/Kolkata")),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.int64()),
+    ("open_interest", pa.int64()),
+    ("securityId", pa.string()),
+    ("symbol", pa.string()),
+    ("segment", pa.string()),
+    ("instrument", pa.string()),
+    ("expiryCode", pa.int32()),
+    ("timeframe", pa.string()),
+])
+
+CATALOG_DDL = """
+CREATE TABLE IF NOT EXISTS hist_catalog (
+  path        TEXT PRIMARY KEY,          -- relative to HIST_DIR, '/' separated
+  timeframe   TEXT NOT NULL,
+  segment     TEXT NOT NULL,
+  instrument  TEXT NOT NULL,
+  symbol      TEXT NOT NULL,             -- directory (sanitised) symbol
+  security_id TEXT,
+  year        INTEGER NOT NULL,
+  month       INTEGER NOT NULL,
+  ts_min      TEXT,                      -- UTC 'YYYY-MM-DDTHH:MM:SSZ'
+  ts_max      TEXT,
+  rows        INTEGER NOT NULL,
+  row_groups  INTEGER NOT NULL,
+  bytes       INTEGER NOT NULL,
+  updated_utc TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_hist_catalog_sym ON hist_catalog(symbol, timeframe, ts_min);
+CREATE INDEX IF NOT EXISTS idx_hist_catalog_sid ON hist_catalog(security_id, timeframe, ts_min);
+"""
+
+def _utc(x) -> str:
+    t = pd.Timestamp(x)
+    t = t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def connect(db_path: Path = None):
+    con = sqlite3.connect(db_path or DB_PATH, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.executescript(CATALOG_DDL)
+    return con
+
+
+def conform(t: pa.Table) -> pa.Table:
+    """Cast any loader/legacy file to HIST_SCHEMA (dictionary columns decoded, missing columns null)."""
+    n = t.num_rows
+    cols = []
+    for f in HIST_SCHEMA:
+        if f.name not in t.column_names:
+            cols.append(pa.nulls(n, f.type))
+            continue
+        c = t[f.name]
+        if pa.types.is_dictionary(c.type):
+            c = c.cast(c.type.value_type)
+        cols.append(c.cast(f.type, safe=False))
+    return pa.Table.from_arrays(cols, schema=HIST_SCHEMA)
+
+
+def month_dirs(root: Path = HIST_DIR, timeframe: str = None, symbol: str = None):
+    """<tf>/<seg>/<inst>/<sym>/year=Y/month=MM directories under root."""
+    pat = f"{timeframe or '*'}/*/*/{symbol or '*'}/year=*/month=*"
+    return sorted(p for p in Path(root).glob(pat) if p.is_dir())
+
+
+def _dir_meta(month_dir: Path, root: Path) -> dict:
+    tf, seg, inst, sym, y, m = month_dir.relative_to(root).parts
+    return {"timeframe": tf, "segment": seg, "instrument": inst, "symbol": sym,
+            "year": int(y.split("=", 1)[1]), "month": int(m.split("=", 1)[1])}
+
+
+def _keep_last(t: pa.Table) -> pa.Table:
+    # stable sort, then drop every row whose ts_utc repeats in the next row (later file wins)
+    t = t.take(pc.sort_indices(t, [("ts_utc", "ascending")]))
+    ts = t["ts_utc"].to_numpy()
+    if len(ts) < 2:
+        return t
+    keep = np.r_[ts[:-1] != ts[1:], True]
+    return t if keep.all() else t.filter(pa.array(keep))
+
+
+def file_entry(path: Path, root: Path = HIST_DIR) -> dict:
+    """Catalog row from the Parquet footer alone (row-group stats give the ts range)."""
+    md = pq.ParquetFile(path).metadata
+    ts_i = md.schema.to_arrow_schema().get_field_index("ts_utc")
+    lo = hi = None
+    for i in range(md.num_row_groups):
+        st = md.row_group(i).column(ts_i).statistics
+        if st is None or not st.has_min_max:
+            continue
+        lo = st.min if lo is None or st.min < lo else lo
+        hi = st.max if hi is None or st.max > hi else hi
+    sid = None
+    if md.num_rows:
+        sid = pq.read_table(path, columns=["securityId"]).slice(0, 1)["securityId"][0].as_py()
+    e = _dir_meta(path.parent, root)
+    e.update(path=path.relative_to(root).as_posix(), security_id=sid,
+             ts_min=_utc(lo) if lo is not None else None, ts_max=_utc(hi) if hi is not None else None,
+             rows=md.num_rows, row_groups=md.num_row_groups, bytes=path.stat().st_size)
+    return e
+
+
+def catalog_upsert(con, entries):
+    with con:
+        con.executemany("""
+            INSERT INTO hist_catalog(path, timeframe, segment, instrument, symbol, security_id, year, month,
+                                     ts_min, ts_max, rows, row_groups, bytes, updated_utc)
+            VALUES (:path, :timeframe, :segment, :instrument, :symbol, :security_id, :year, :month,
+                    :ts_min, :ts_max, :rows, :row_groups, :bytes, datetime('now'))
+            ON CONFLICT(path) DO UPDATE SET
+              security_id=excluded.security_id, ts_min=excluded.ts_min, ts_max=excluded.ts_max,
+              rows=excluded.rows, row_groups=excluded.row_groups, bytes=excluded.bytes,
+              updated_utc=excluded.updated_utc""", entries)
+
+
+def compact_month(month_dir: Path, root: Path = HIST_DIR, keep: bool = False):
+    """Merge loader parts (and any earlier compacted file) into part-0.parquet. None if nothing new."""
+    month_dir = Path(month_dir)
+    parts = sorted(p for p in month_dir.glob("*.parquet") if p.name != COMPACT_NAME)
+    if not parts:
+        return None
+    out = month_dir / COMPACT_NAME
+    tables = [conform(pq.read_table(out))] if out.exists() else []
+    used = []
+    for p in parts:
+        try:
+            # read the file on its own: no hive inference, so year/month never come back as dictionaries
+            tables.append(conform(pq.ParquetFile(p).read()))
+            used.append(p)
+        except Exception as e:
+            print(f"[SKIP] {p}: {e}")
+    if not used:
+        return None
+    t = _keep_last(pa.concat_tables(tables))
+    tmp = month_dir / (COMPACT_NAME + ".tmp")
+    pq.write_table(t, str(tmp), row_group_size=ROW_GROUP, compression=COMPRESSION,
+                   write_statistics=True,
+                   sorting_columns=[pq.SortingColumn(HIST_SCHEMA.get_field_index("ts_utc"))])
+    os.replace(tmp, out)
+    if not keep:
+        for p in used:
+            p.unlink(missing_ok=True)
+    e = file_entry(out, root)
+    e["files_in"] = len(used)
+    return e
+
+
+def compact(root: Path = HIST_DIR, timeframe: str = None, symbol: str = None,
+            dirs=None, keep: bool = False, db_path: Path = None) -> dict:
+    """Compact every month directory (or just `dirs`) and record the results in hist_catalog."""
+    root = Path(root)
+    dirs = sorted({Path(d) for d in dirs}) if dirs is not None else month_dirs(root, timeframe, symbol)
+    stats = {"months": 0, "files_in": 0, "rows": 0}
+    entries = []
+    for d in dirs:
+        e = compact_month(d, root, keep)
+        if e is None:
+            continue
+        stats["months"] += 1
+        stats["files_in"] += e.pop("files_in")
+        stats["rows"] += e["rows"]
+        entries.append(e)
+    if entries:
+        con = connect(db_path)
+        catalog_upsert(con, entries)
+        con.close()
+    return stats
+
+
+def rebuild_catalog(root: Path = HIST_DIR, db_path: Path = None) -> int:
+    root = Path(root)
+    con = connect(db_path)
+    entries = [file_entry(d / COMPACT_NAME, root) for d in month_dirs(root) if (d / COMPACT_NAME).exists()]
+    with con:
+        con.execute("DELETE FROM hist_catalog")
+    catalog_upsert(con, entries)
+    con.close()
+    return len(entries)
+
+
+def files_for(timeframe: str, symbol: str = None, security_id=None, start=None, end=None,
+              root: Path = HIST_DIR, db_path: Path = None) -> list[Path]:
+    """Compacted files overlapping [start, end) for one symbol (directory name) or securityId."""
+    sql = "SELECT path FROM hist_catalog WHERE timeframe=?"
+    args = [timeframe]
+    if symbol is not None:
+        sql += " AND symbol=?"; args.append(symbol)
+    if security_id is not None:
+        sql += " AND security_id=?"; args.append(str(security_id))
+    if end is not None:
+        sql += " AND ts_min < ?"; args.append(_utc(end))
+    if start is not None:
+        sql += " AND ts_max >= ?"; args.append(_utc(start))
+    con = connect(db_path)
+    rows = con.execute(sql + " ORDER BY ts_min", args).fetchall()
+    con.close()
+    return [Path(root) / r[0] for r in rows]
+
+
+def read(timeframe: str, symbol: str = None, security_id=None, start=None, end=None,
+         columns=None, root: Path = HIST_DIR, db_path: Path = None) -> pa.Table:
+    """Candles in [start, end): catalog picks the files, the ts_utc filter prunes row groups."""
+    files = files_for(timeframe, symbol, security_id, start, end, root, db_path)
+    if not files:
+        return HIST_SCHEMA.empty_table().select(columns or HIST_SCHEMA.names)
+    flt = None
+    if start is not None:
+        flt = ds.field("ts_utc") >= pa.scalar(pd.Timestamp(_utc(start)), HIST_SCHEMA.field("ts_utc").type)
+    if end is not None:
+        f = ds.field("ts_utc") < pa.scalar(pd.Timestamp(_utc(end)), HIST_SCHEMA.field("ts_utc").type)
+        flt = f if flt is None else flt & f
+    dset = ds.dataset([str(p) for p in files], schema=HIST_SCHEMA, format="parquet")
+    return dset.to_table(columns=columns, filter=flt)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Teevra18 historical Parquet maintenance")
+    ap.add_argument("--root", default=str(HIST_DIR))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact")
+    c.add_argument("--timeframe", default=None, help="e.g. 1d, 5m")
+    c.add_argument("--symbol", default=None, help="symbol directory name")
+    c.add_argument("--keep", action="store_true", help="keep the loader's per-window files")
+    sub.add_parser("catalog")
+    args = ap.parse_args()
+
+    if args.cmd == "compact":
+        print("[OK] compacted:", compact(Path(args.root), args.timeframe, args.symbol, keep=args.keep))
+    elif args.cmd == "catalog":
+        print(f"[OK] catalog rebuilt: {rebuild_catalog(Path(args.root))} files")
+
+if __name__ == "__main__":
+    main()
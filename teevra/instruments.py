@@ -0,0 +1,316 @@
+# C:\teevra18\teevra\instruments.py
+"""
+Dhan scrip master, parsed once and shared by every process.
+
+The first caller after the CSV changes (new day's download) normalises it into
+an uncompressed Arrow IPC file under data\\cache; every other load memory-maps
+that file, so opening the master costs milliseconds instead of a pandas
+read_csv. Hash indexes (security_id, symbol name, option contract) are built
+lazily on first use and make lookups O(1).
+
+    from teevra.instruments import master
+    m = master()                                   # default CSV, cached per process
+    m.by_sid(2885)                                 # -> {"security_id": 2885, "symbol": ..., "lot_size": ...} | None
+    m.by_symbol("RELIANCE", "NSE_EQ")              # name match after N() normalisation
+    m.option("NIFTY", "2025-09-25", 24500, "CE")   # -> row dict | None
+    m.frame()                                      # whole master as a DataFrame (normalised columns)
+
+Rebuild the cache by hand:
+    python -m teevra.instruments build [--csv path]
+"""
+import os
+import re
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+MASTER_CSV = Path(os.getenv("INSTRUMENT_MASTER_CSV", r"C:\teevra18\data\api-scrip-master-detailed.csv"))
+CACHE_DIR = Path(os.getenv("INSTRUMENT_CACHE_DIR", r"C:\teevra18\data\cache"))
+RECHECK_SECS = float(os.getenv("INSTRUMENT_RECHECK_SECS", "300"))   # how often a live process stats the CSV
+CACHE_VERSION = 1                                                    # bump when normalise() output changes
+
+COLUMNS = ("security_id", "exch_id", "segment", "exchange_segment", "instrument", "instrument_type",
+           "symbol", "trading_symbol", "symbol_name", "display_name", "underlying_symbol", "underlying_id",
+           "expiry", "strike", "option_type", "lot_size", "tick_size")
+
+# normalised column -> candidate CSV headers (detailed master first, compact master SEM_* second)
+_SOURCES = {
+    "security_id":       ("SECURITY_ID", "SEM_SMST_SECURITY_ID"),
+    "exch_id":           ("EXCH_ID", "SEM_EXM_EXCH_ID"),
+    "segment":           ("SEGMENT", "SEM_SEGMENT"),
+    "instrument":        ("INSTRUMENT", "SEM_INSTRUMENT_NAME"),
+    "instrument_type":   ("INSTRUMENT_TYPE", "SEM_EXCH_INSTRUMENT_TYPE"),
+    "trading_symbol":    ("TRADING_SYMBOL", "SEM_TRADING_SYMBOL"),
+    "symbol_name":       ("SYMBOL_NAME", "SM_SYMBOL_NAME"),
+    "display_name":      ("DISPLAY_NAME", "SEM_CUSTOM_SYMBOL"),
+    "underlying_symbol": ("UNDERLYING_SYMBOL",),
+    "underlying_id":     ("UNDERLYING_SECURITY_ID",),
+    "expiry":            ("SM_EXPIRY_DATE", "SEM_EXPIRY_DATE"),
+    "strike":            ("STRIKE_PRICE", "SEM_STRIKE_PRICE"),
+    "option_type":       ("OPTION_TYPE", "SEM_OPTION_TYPE"),
+    "lot_size":          ("LOT_SIZE", "SEM_LOT_UNITS"),
+    "tick_size":         ("TICK_SIZE", "SEM_TICK_SIZE"),
+}
+# preferred display symbol, same order svc_historical_loader used
+_NAME_ORDER = ("trading_symbol", "symbol_name", "display_name", "underlying_symbol")
+# names matched by by_symbol(), in priority order; search() also scans the underlying.
+# N()-normalised copies are stored next to them as k_<name>
+_NAME_KEYS = ("symbol", "trading_symbol", "display_name", "symbol_name")
+_SEARCH_KEYS = _NAME_KEYS + ("underlying_symbol",)
+
+_EQ = {"E", "EQ", "CM", "EQUITY", "CASH"}
+_FO = {"D", "FO", "FNO", "F&O", "DERIVATIVE", "DERIVATIVES"}
+_CUR = {"C", "CD", "CURRENCY", "CURR", "FX"}
+
+
+def N(x):
+    return re.sub(r'[^A-Z0-9]', '', str(x).upper()) if x is not None else ""
+
+
+def exchange_segment(exch, seg, instrument):
+    """Vectorised Dhan API segment (NSE_EQ, NSE_FNO, IDX_I, BSE_EQ, MCX_COMM, ...) from master columns."""
+    e = pd.Series(exch, dtype=str).fillna("").str.upper().str.strip()
+    s = pd.Series(seg, dtype=str).fillna("").str.upper().str.strip()
+    i = pd.Series(instrument, dtype=str).fillna("").str.upper().str.strip()
+    deriv = i.str.startswith("OPT") | i.str.startswith("FUT")
+    ex = np.where(e.isin(["NSE", "BSE"]), e, "NSE").astype(str)
+    out = np.select(
+        [e.eq("MCX"), s.eq("I") | i.eq("INDEX"), s.isin(_FO), s.isin(_CUR), ~s.isin(_EQ) & deriv],
+        ["MCX_COMM", "IDX_I", np.char.add(ex, "_FNO"), np.char.add(ex, "_CURRENCY"), np.char.add(ex, "_FNO")],
+        default=np.char.add(ex, "_EQ"))
+    return out
+
+
+def _parse_dates(s: pd.Series) -> pd.Series:
+    """'YYYY-MM-DD' strings ('' when missing); ISO first, then the d-m-y spellings seen in older masters."""
+    s = s.fillna("").astype(str).str.strip()
+    d = pd.to_datetime(s, errors="coerce", format="ISO8601")
+    for fmt in ("%d-%b-%Y", "%d-%m-%Y", "%d/%m/%Y", "%d-%b-%y"):
+        miss = d.isna() & s.ne("")
+        if not miss.any():
+            break
+        d = d.where(~miss, pd.to_datetime(s.where(miss), errors="coerce", format=fmt))
+    return d.dt.strftime("%Y-%m-%d").fillna("")
+
+
+def norm_keys(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str).str.upper().str.replace(r"[^A-Z0-9]", "", regex=True)
+
+
+def normalise(raw: pd.DataFrame) -> pd.DataFrame:
+    """Raw master (all-str columns) -> COLUMNS with typed ids/strikes/lots, plus k_* name keys."""
+    cols = {c.strip().upper(): c for c in raw.columns}
+
+    def src(name):
+        for h in _SOURCES[name]:
+            if h in cols:
+                return raw[cols[h]].fillna("").astype(str).str.strip()
+        return pd.Series("", index=raw.index)
+
+    out = {k: src(k) for k in _SOURCES}
+    num = lambda s: pd.to_numeric(s, errors="coerce")
+    sid = num(out["security_id"])
+    keep = sid.notna().to_numpy()
+    df = pd.DataFrame({k: v[keep].to_numpy() for k, v in out.items()})
+    df["security_id"] = sid[keep].astype(np.int64).to_numpy()
+    df["underlying_id"] = num(df["underlying_id"]).fillna(-1).astype(np.int64)
+    strike = num(df["strike"])
+    df["strike"] = strike.where(strike > 0)
+    df["lot_size"] = num(df["lot_size"])
+    df["tick_size"] = num(df["tick_size"])
+    df["expiry"] = _parse_dates(df["expiry"])
+    ot = df["option_type"].str.upper()
+    df["option_type"] = ot.where(ot.isin(["CE", "PE"]), "")
+    df["exch_id"] = df["exch_id"].str.upper()
+    df["exchange_segment"] = exchange_segment(df["exch_id"], df["segment"], df["instrument"])
+    sym = df[_NAME_ORDER[0]]
+    for c in _NAME_ORDER[1:]:
+        sym = sym.where(sym != "", df[c])
+    df["symbol"] = sym.where(sym != "", df["security_id"].astype(str))
+    df["underlying_symbol"] = df["underlying_symbol"].str.upper()
+    for c in _SEARCH_KEYS:
+        df["k_" + c] = norm_keys(df[c])
+    return df[list(COLUMNS) + ["k_" + c for c in _SEARCH_KEYS]]
+
+
+def _fingerprint(csv: Path) -> str:
+    st = csv.stat()
+    return f"{st.st_size}_{st.st_mtime_ns}"
+
+
+def build_cache(csv: Path = MASTER_CSV, cache_dir: Path = CACHE_DIR) -> Path:
+    """Parse the CSV into <cache_dir>/instrument_master_v<N>_<stem>_<fingerprint>.arrow (no-op if current)."""
+    csv = Path(csv)
+    path = Path(cache_dir) / f"instrument_master_v{CACHE_VERSION}_{csv.stem}_{_fingerprint(csv)}.arrow"
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df = normalise(pd.read_csv(csv, dtype=str, low_memory=False, encoding="utf-8-sig"))
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, tbl.schema) as w:
+        w.write_table(tbl)
+    os.replace(tmp, path)
+    # older snapshots of the same CSV; a file another process still has mapped is left for next time
+    for old in path.parent.glob(f"instrument_master_v*_{csv.stem}_*.arrow"):
+        if old != path:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    return path
+
+
+class InstrumentMaster:
+    """Columnar, memory-mapped master with lazily built hash indexes."""
+
+    def __init__(self, table: pa.Table, source=None):
+        self.table = table
+        self.source = source
+        self._sid = self._name = self._opt = None
+        self._frame = None
+
+    @classmethod
+    def open(cls, csv: Path = MASTER_CSV, cache_dir: Path = CACHE_DIR) -> "InstrumentMaster":
+        path = build_cache(csv, cache_dir)
+        mm = pa.memory_map(str(path), "r")
+        m = cls(pa.ipc.open_file(mm).read_all(), source=path)
+        m._mm = mm                     # keep the mapping alive as long as the table
+        return m
+
+    @classmethod
+    def empty(cls) -> "InstrumentMaster":
+        return cls(pa.Table.from_pandas(normalise(pd.DataFrame()), preserve_index=False))
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def _col(self, name):
+        return self.table.column(name).to_numpy(zero_copy_only=False)
+
+    # ---- indexes ------------------------------------------------------------------
+    @property
+    def sid_index(self) -> dict:
+        if self._sid is None:
+            # first row wins when a security_id appears on two exchanges
+            sids = self._col("security_id")
+            self._sid = dict(zip(sids[::-1].tolist(), range(len(sids) - 1, -1, -1)))
+        return self._sid
+
+    @property
+    def name_index(self) -> dict:
+        """N(name) -> row numbers, ordered by _NAME_KEYS priority then master order."""
+        if self._name is None:
+            n = len(self)
+            keys = pd.DataFrame({"k": np.concatenate([self._col("k_" + c) for c in _NAME_KEYS]),
+                                 "r": np.tile(np.arange(n), len(_NAME_KEYS))})
+            keys = keys[keys["k"] != ""].drop_duplicates()
+            rows = keys["r"].to_numpy()
+            self._name = {k: rows[pos] for k, pos in keys.groupby("k", sort=False).indices.items()}
+        return self._name
+
+    @property
+    def option_index(self) -> dict:
+        if self._opt is None:
+            ot = self._col("option_type")
+            rows = np.flatnonzero(ot != "")
+            und = self._col("underlying_symbol")[rows]
+            exp = self._col("expiry")[rows]
+            k = self._col("strike")[rows]
+            self._opt = {(u, e, float(s), o): int(i)
+                         for u, e, s, o, i in zip(und, exp, k, ot[rows], rows)}
+        return self._opt
+
+    # ---- lookups ------------------------------------------------------------------
+    def row(self, i: int) -> dict:
+        return {c: self.table.column(c)[i].as_py() for c in COLUMNS}
+
+    def by_sid(self, sid):
+        try:
+            i = self.sid_index.get(int(sid))
+        except (TypeError, ValueError):
+            return None
+        return None if i is None else self.row(i)
+
+    def by_symbol(self, name, exchange_segment=None):
+        """First row whose symbol / trading symbol / display / symbol name equals N(name)."""
+        rows = self.name_index.get(N(name))
+        for i in (() if rows is None else rows.tolist()):
+            if exchange_segment is None or self.table.column("exchange_segment")[i].as_py() == exchange_segment:
+                return self.row(i)
+        return None
+
+    def option(self, underlying, expiry, strike, option_type):
+        i = self.option_index.get((str(underlying).strip().upper(), str(expiry)[:10], float(strike),
+                                   str(option_type).upper()))
+        return None if i is None else self.row(i)
+
+    def search(self, text) -> pd.DataFrame:
+        """Rows where any name (incl. underlying) equals or contains N(text), in master order."""
+        t = N(text)
+        hit = np.zeros(len(self), dtype=bool)
+        if t:
+            for c in _SEARCH_KEYS:
+                hit |= pd.Series(self._col("k_" + c)).str.contains(t, regex=False).to_numpy()
+        return self.frame()[hit]
+
+    def frame(self) -> pd.DataFrame:
+        """Whole master as a DataFrame (built once per instance; treat as read-only)."""
+        if self._frame is None:
+            self._frame = self.table.select(list(COLUMNS)).to_pandas()
+        return self._frame
+
+
+_CACHE = {}
+
+
+def master(csv=None, cache_dir: Path = CACHE_DIR) -> InstrumentMaster:
+    """
+    Process-wide master for `csv` (default MASTER_CSV). Re-stats the CSV at most every
+    RECHECK_SECS and reopens when it changed. Missing/unreadable CSV -> empty master + [WARN].
+    """
+    csv = Path(csv or MASTER_CSV)
+    key = str(csv)
+    hit = _CACHE.get(key)
+    now = time.monotonic()
+    if hit is not None and now - hit[1] < RECHECK_SECS:
+        return hit[0]
+    try:
+        fp = _fingerprint(csv) if csv.stat().st_size else None
+    except OSError:
+        fp = None
+    if hit is not None and hit[2] == fp:
+        _CACHE[key] = (hit[0], now, fp)
+        return hit[0]
+    if fp is None:
+        print(f"[WARN] instrument master missing/empty at {csv}; continuing with empty master.")
+        m = InstrumentMaster.empty()
+    else:
+        try:
+            m = InstrumentMaster.open(csv, cache_dir)
+        except Exception as e:
+            print(f"[WARN] instrument master load failed ({e}); continuing with empty master.")
+            m, fp = InstrumentMaster.empty(), None
+    _CACHE[key] = (m, now, fp)
+    return m
+
+
+def main():
+    ap = argparse.ArgumentParser(description="instrument master cache")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("--csv", default=str(MASTER_CSV))
+    b.add_argument("--cache-dir", default=str(CACHE_DIR))
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    path = build_cache(Path(args.csv), Path(args.cache_dir))
+    m = InstrumentMaster.open(Path(args.csv), Path(args.cache_dir))
+    print(f"[OK] {path} rows={len(m)} ({time.perf_counter() - t0:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
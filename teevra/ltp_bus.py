@@ -0,0 +1,88 @@
+# C:\teevra18\teevra\ltp_bus.py
+"""
+Localhost push channel for LTP updates (feeder -> M9).
+
+UDP datagrams to LTP_BUS_ADDR (default 127.0.0.1:47018, "" disables). Each
+datagram is a JSON array of [symbol, ts_ms, ltp] triples, normally one decoded
+WS frame. Publishing is fire-and-forget: it never blocks the feed and packets
+are dropped when nobody listens, so ltp_ticks (teevra.ltp_store) stays the
+durable record and consumers tail it to catch up on anything the bus missed. One listener per
+address (the port is bound by the consumer).
+
+    pub = LtpPublisher()
+    pub.send([("NIFTY 24500 CE", 1726131000123, 112.5), ...])
+
+    sub = LtpSubscriber()
+    for sym, ts_ms, ltp in sub.recv(timeout=0.25):
+        ...
+"""
+import os
+import json
+import socket
+import select
+
+BUS_ADDR = os.getenv("LTP_BUS_ADDR", "127.0.0.1:47018")
+MAX_PER_DATAGRAM = 400          # ~60 bytes per triple, well under the 64 KB UDP limit
+MAX_DRAIN = 1000                # datagrams read per recv() call
+
+
+def _addr(addr: str):
+    host, _, port = (addr or "").rpartition(":")
+    return (host or "127.0.0.1", int(port)) if port else None
+
+
+class LtpPublisher:
+    def __init__(self, addr: str = BUS_ADDR):
+        self.addr = _addr(addr)
+        self.sock = None
+        self.sent = 0
+        self.errors = 0
+        if self.addr:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def send(self, ticks):
+        """ticks: iterable of (symbol, ts_ms, ltp)."""
+        if self.sock is None:
+            return
+        ticks = [[s, int(t), float(p)] for s, t, p in ticks]
+        for i in range(0, len(ticks), MAX_PER_DATAGRAM):
+            try:
+                self.sock.sendto(json.dumps(ticks[i:i + MAX_PER_DATAGRAM]).encode("utf-8"), self.addr)
+                self.sent += 1
+            except OSError:
+                # no listener (Windows reports ICMP port-unreachable) or a full buffer
+                self.errors += 1
+
+
+class LtpSubscriber:
+    def __init__(self, addr: str = BUS_ADDR):
+        self.addr = _addr(addr)
+        if not self.addr:
+            raise ValueError("LTP bus disabled (LTP_BUS_ADDR is empty)")
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind(self.addr)
+        self.sock.setblocking(False)
+        self.bad = 0
+
+    def recv(self, timeout: float = 0.0) -> list:
+        """Wait up to `timeout` for the first datagram, then drain whatever else is queued."""
+        out = []
+        if not select.select([self.sock], [], [], max(0.0, timeout))[0]:
+            return out
+        for _ in range(MAX_DRAIN):
+            try:
+                data = self.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                continue   # Windows: ICMP reset from an earlier send on this socket
+            try:
+                out.extend((s, int(t), float(p)) for s, t, p in json.loads(data))
+            except Exception:
+                self.bad += 1
+        return out
+
+    def close(self):
+        self.sock.close()
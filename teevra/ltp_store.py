@@ -0,0 +1,238 @@
+# C:\teevra18\teevra\ltp_store.py
+"""
+LTP history keyed by (symbol, epoch ms), shared by the feeder, M9 and the backtester.
+
+    ltp_ticks(id INTEGER PRIMARY KEY, symbol, ts_ms, ltp)
+        idx_ltp_ticks_sym_ts(symbol, ts_ms, ltp)   covering: as-of / next-after are one
+                                                   O(log n) index probe, however many days
+                                                   of ticks are kept
+        id is append order, so consumers tail new ticks with id > last_id
+    ltp_1m(symbol, t_ms, open, high, low, close, n)
+        1-minute rollup that outlives the raw ticks (retention: LTP_KEEP_DAYS)
+
+    from teevra import ltp_store
+    ltp_store.submit([(sym, ts_ms, ltp), ...])            # bulk append via the shared writer
+    ltp_store.next_after(conn, sym, ts_ms)                 # -> (ts_ms, ltp) | None, first tick >= ts
+    ltp_store.as_of(conn, sym, ts_ms)                      # -> (ts_ms, ltp) | None, last tick <= ts
+    s = ltp_store.LtpSeries.load(conn, syms, t0, t1)       # in-memory sorted arrays
+    s.as_of(sym, ts_ms_array)                              # vectorised lookups
+
+Usage:
+    python -m teevra.ltp_store migrate [--drop]            # copy legacy ltp_cache rows
+    python -m teevra.ltp_store rollup [--keep-days 3]      # roll old ticks into ltp_1m, then delete them
+"""
+import os
+import time
+import sqlite3
+import argparse
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+DB_PATH = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
+KEEP_DAYS = float(os.getenv("LTP_KEEP_DAYS", "3"))
+
+DDL = """
+CREATE TABLE IF NOT EXISTS ltp_ticks (
+  id     INTEGER PRIMARY KEY,
+  symbol TEXT    NOT NULL,
+  ts_ms  INTEGER NOT NULL,
+  ltp    REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ltp_ticks_sym_ts ON ltp_ticks(symbol, ts_ms, ltp);
+CREATE TABLE IF NOT EXISTS ltp_1m (
+  symbol TEXT    NOT NULL,
+  t_ms   INTEGER NOT NULL,
+  open   REAL, high REAL, low REAL, close REAL,
+  n      INTEGER NOT NULL,
+  PRIMARY KEY (symbol, t_ms)
+) WITHOUT ROWID;
+"""
+
+INSERT_SQL = "INSERT INTO ltp_ticks(symbol, ts_ms, ltp) VALUES(?,?,?)"
+MINUTE_MS = 60_000
+
+
+def ensure_schema(conn):
+    conn.executescript(DDL)
+
+
+def to_ms(t) -> int:
+    """epoch ms from a datetime, 'YYYY-MM-DD HH:MM:SS' (UTC) text, or epoch seconds."""
+    if isinstance(t, (int, np.integer)) and t > 10**11:
+        return int(t)
+    if isinstance(t, (int, float, np.integer, np.floating)):
+        return int(round(float(t) * 1000))
+    if isinstance(t, str):
+        t = dt.datetime.fromisoformat(t.replace("Z", "+00:00"))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=dt.timezone.utc)
+    return int(round(t.timestamp() * 1000))
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+# ---- writes -------------------------------------------------------------------
+def append(conn, rows):
+    """rows: iterable of (symbol, ts_ms, ltp); one executemany, caller commits."""
+    conn.executemany(INSERT_SQL, [(s, int(t), float(p)) for s, t, p in rows])
+
+
+def submit(rows, db_path: Path = None):
+    """Queue rows on the process-wide batched writer (teevra.db_writer)."""
+    from teevra.db_writer import get_writer
+    rows = [(s, int(t), float(p)) for s, t, p in rows]
+    if rows:
+        get_writer(db_path or DB_PATH).submit(INSERT_SQL, rows)
+
+
+# ---- point lookups ------------------------------------------------------------
+def next_after(conn, symbol: str, ts_ms: int):
+    """First tick at or after ts_ms -> (ts_ms, ltp), or None."""
+    return conn.execute("SELECT ts_ms, ltp FROM ltp_ticks WHERE symbol=? AND ts_ms>=? ORDER BY ts_ms LIMIT 1",
+                        (symbol, int(ts_ms))).fetchone()
+
+
+def as_of(conn, symbol: str, ts_ms: int):
+    """Last tick at or before ts_ms -> (ts_ms, ltp), or None."""
+    return conn.execute("SELECT ts_ms, ltp FROM ltp_ticks WHERE symbol=? AND ts_ms<=? ORDER BY ts_ms DESC LIMIT 1",
+                        (symbol, int(ts_ms))).fetchone()
+
+
+def latest(conn, symbol: str):
+    return conn.execute("SELECT ts_ms, ltp FROM ltp_ticks WHERE symbol=? ORDER BY ts_ms DESC LIMIT 1",
+                        (symbol,)).fetchone()
+
+
+def max_id(conn) -> int:
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM ltp_ticks").fetchone()[0]
+
+
+def tail(conn, last_id: int, limit: int = 5000):
+    """Ticks appended after last_id, in append order: [(id, symbol, ts_ms, ltp), ...]."""
+    return conn.execute("SELECT id, symbol, ts_ms, ltp FROM ltp_ticks WHERE id > ? ORDER BY id LIMIT ?",
+                        (int(last_id), int(limit))).fetchall()
+
+
+# ---- ranges / in-memory -------------------------------------------------------
+def load_range(conn, symbols=None, start_ms=None, end_ms=None):
+    """(symbol, ts_ms, ltp) arrays for [start_ms, end_ms), sorted by (symbol, ts_ms)."""
+    where, args = [], []
+    if symbols:
+        symbols = list(symbols)
+        where.append(f"symbol IN ({','.join('?' * len(symbols))})"); args.extend(symbols)
+    if start_ms is not None:
+        where.append("ts_ms >= ?"); args.append(int(start_ms))
+    if end_ms is not None:
+        where.append("ts_ms < ?"); args.append(int(end_ms))
+    sql = "SELECT symbol, ts_ms, ltp FROM ltp_ticks"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    rows = conn.execute(sql + " ORDER BY symbol, ts_ms", args).fetchall()
+    if not rows:
+        return np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    sym, ts, px = zip(*rows)
+    return np.array(sym, dtype=object), np.array(ts, dtype=np.int64), np.array(px, dtype=np.float64)
+
+
+class LtpSeries:
+    """Per-symbol sorted (ts_ms, ltp) arrays; lookups are np.searchsorted over whole query arrays."""
+
+    def __init__(self, symbol, ts_ms, ltp):
+        symbol, ts_ms, ltp = np.asarray(symbol, dtype=object), np.asarray(ts_ms, dtype=np.int64), \
+            np.asarray(ltp, dtype=np.float64)
+        order = np.lexsort((ts_ms, symbol.astype(str))) if len(symbol) else np.array([], dtype=np.int64)
+        symbol, ts_ms, ltp = symbol[order], ts_ms[order], ltp[order]
+        starts = np.flatnonzero(np.r_[True, symbol[1:] != symbol[:-1]]) if len(symbol) else []
+        ends = np.r_[starts[1:], len(symbol)] if len(symbol) else []
+        self.series = {symbol[a]: (ts_ms[a:b], ltp[a:b]) for a, b in zip(starts, ends)}
+
+    @classmethod
+    def load(cls, conn, symbols=None, start_ms=None, end_ms=None):
+        return cls(*load_range(conn, symbols, start_ms, end_ms))
+
+    def get(self, symbol):
+        return self.series.get(symbol, (np.array([], dtype=np.int64), np.array([], dtype=np.float64)))
+
+    def as_of(self, symbol, ts_ms):
+        """Last price at or before each ts (NaN before the first tick)."""
+        t, p = self.get(symbol)
+        q = np.asarray(ts_ms, dtype=np.int64)
+        i = np.searchsorted(t, q, side="right") - 1
+        return np.where(i >= 0, p[np.clip(i, 0, None)] if len(p) else np.nan, np.nan)
+
+    def next_after(self, symbol, ts_ms):
+        """(ts_ms, price) of the first tick at or after each ts (-1 / NaN past the last tick)."""
+        t, p = self.get(symbol)
+        q = np.asarray(ts_ms, dtype=np.int64)
+        i = np.searchsorted(t, q, side="left")
+        ok = i < len(t)
+        j = np.clip(i, 0, max(len(t) - 1, 0))
+        return (np.where(ok, t[j] if len(t) else -1, -1),
+                np.where(ok, p[j] if len(p) else np.nan, np.nan))
+
+
+# ---- maintenance --------------------------------------------------------------
+def rollup(conn, keep_days: float = KEEP_DAYS) -> dict:
+    """Fold ticks older than keep_days (whole minutes) into ltp_1m, then delete them."""
+    cutoff = (now_ms() - int(keep_days * 86400_000)) // MINUTE_MS * MINUTE_MS
+    with conn:
+        cur = conn.execute(f"""
+            INSERT INTO ltp_1m(symbol, t_ms, open, high, low, close, n)
+            SELECT g.symbol, g.b,
+                   (SELECT ltp FROM ltp_ticks x WHERE x.symbol=g.symbol AND x.ts_ms=g.t0 LIMIT 1),
+                   g.hi, g.lo,
+                   (SELECT ltp FROM ltp_ticks x WHERE x.symbol=g.symbol AND x.ts_ms=g.t1 LIMIT 1),
+                   g.n
+            FROM (SELECT symbol, (ts_ms / {MINUTE_MS}) * {MINUTE_MS} AS b, MIN(ts_ms) AS t0, MAX(ts_ms) AS t1,
+                         MAX(ltp) AS hi, MIN(ltp) AS lo, COUNT(*) AS n
+                  FROM ltp_ticks WHERE ts_ms < ? GROUP BY symbol, b) g
+            WHERE true
+            ON CONFLICT(symbol, t_ms) DO UPDATE SET
+              high=MAX(high, excluded.high), low=MIN(low, excluded.low), close=excluded.close, n=n+excluded.n
+        """, (cutoff,))
+        bars = cur.rowcount
+        deleted = conn.execute("DELETE FROM ltp_ticks WHERE ts_ms < ?", (cutoff,)).rowcount
+    return {"cutoff_ms": cutoff, "bars": bars, "ticks_deleted": deleted}
+
+
+def migrate_legacy(conn, drop: bool = False) -> int:
+    """Copy the text-timestamped ltp_cache table (if any) into ltp_ticks."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='ltp_cache'").fetchone():
+        return 0
+    with conn:
+        n = conn.execute("""
+            INSERT INTO ltp_ticks(symbol, ts_ms, ltp)
+            SELECT option_symbol, CAST(strftime('%s', ts_utc) AS INTEGER) * 1000, ltp
+            FROM ltp_cache
+            WHERE option_symbol IS NOT NULL AND ltp IS NOT NULL AND strftime('%s', ts_utc) IS NOT NULL
+            ORDER BY rowid""").rowcount
+        if drop:
+            conn.execute("DROP TABLE ltp_cache")
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Teevra18 LTP store maintenance")
+    ap.add_argument("--db", default=str(DB_PATH))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate")
+    m.add_argument("--drop", action="store_true", help="drop ltp_cache after copying")
+    r = sub.add_parser("rollup")
+    r.add_argument("--keep-days", type=float, default=KEEP_DAYS)
+    args = ap.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    ensure_schema(conn)
+    if args.cmd == "migrate":
+        print(f"[OK] copied {migrate_legacy(conn, args.drop)} ltp_cache rows into ltp_ticks")
+    elif args.cmd == "rollup":
+        print("[OK] rollup:", rollup(conn, args.keep_days))
+    conn.close()
+
+if __name__ == "__main__":
+    main()
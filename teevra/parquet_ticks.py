@@ -0,0 +1,285 @@
+# C:\teevra18\teevra\parquet_ticks.py
+"""
+Rolling Parquet tick writer + end-of-day compaction.
+
+Live layout (one long-lived ParquetWriter per (ds, exchange_segment)):
+    data\\parquet\\ticks_roll\\ds=YYYY-MM-DD\\exchange_segment=N\\roll-HHMMSS-<seq>.parquet
+    data\\parquet\\ticks_roll\\ds=YYYY-MM-DD\\exchange_segment=N\\_manifest.json
+
+Each flush appends one row group; files rotate on size/age. A file only gets
+its footer on rotate/close, so the manifest marks it closed=true then; files
+still open (or orphaned by a crash) are skipped by compaction.
+
+Compacted layout (same hive layout M1 always used, one sorted file per instrument-day):
+    data\\parquet\\ticks\\ds=YYYY-MM-DD\\exchange_segment=N\\security_id=S\\part-0.parquet
+Compaction merges into an existing part-0 and drops repeated ticks, so it is
+safe to re-run (e.g. after --keep left the inputs in place).
+
+Usage:
+    python -m teevra.parquet_ticks compact --ds 2025-09-01 [--segment 2] [--keep]
+    python -m teevra.parquet_ticks manifest --ds 2025-09-01
+"""
+import os
+import json
+import time
+import glob
+import argparse
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\teevra18\data"))
+ROLL_DIR = DATA_DIR / "parquet" / "ticks_roll"
+COMPACT_DIR = DATA_DIR / "parquet" / "ticks"
+
+ROLL_MAX_BYTES = int(os.getenv("TICK_PARQUET_ROLL_MB", "128")) * 1024 * 1024
+ROLL_MAX_SECS = float(os.getenv("TICK_PARQUET_ROLL_SECS", "3600"))
+COMPACT_ROW_GROUP = int(os.getenv("TICK_PARQUET_ROW_GROUP", "131072"))
+COMPRESSION = os.getenv("TICK_PARQUET_COMPRESSION", "zstd")
+
+TICK_SCHEMA = pa.schema([
+    ("ts_utc", pa.string()),
+    ("exchange_segment", pa.int32()),
+    ("security_id", pa.int64()),
+    ("mode", pa.string()),
+    ("ltt_epoch", pa.int64()),
+    ("ltp", pa.float64()),
+    ("atp", pa.float64()),
+    ("last_qty", pa.int64()),
+    ("volume", pa.int64()),
+    ("buy_qty_total", pa.int64()),
+    ("sell_qty_total", pa.int64()),
+    ("oi", pa.int64()),
+    ("day_open", pa.float64()),
+    ("day_high", pa.float64()),
+    ("day_low", pa.float64()),
+    ("day_close", pa.float64()),
+    ("prev_close", pa.float64()),
+    ("recv_ts_utc", pa.string()),
+    ("ds", pa.string()),
+])
+PARTITION_COLS = ("ds", "exchange_segment", "security_id")
+# a tick is the same tick when all of these match (re-runs with --keep re-read the same inputs)
+DEDUPE_COLS = ("ts_utc", "recv_ts_utc", "mode", "ltt_epoch", "ltp", "last_qty", "volume", "oi")
+
+
+def _part_dir(root: Path, ds: str, seg: int) -> Path:
+    return root / f"ds={ds}" / f"exchange_segment={int(seg)}"
+
+
+# ---- Manifest ----------------------------------------------------------------
+def load_manifest(part_dir: Path) -> dict:
+    p = part_dir / "_manifest.json"
+    if p.exists():
+        try:
+            return json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    return {"files": []}
+
+def save_manifest(part_dir: Path, man: dict):
+    part_dir.mkdir(parents=True, exist_ok=True)
+    tmp = part_dir / "_manifest.json.tmp"
+    tmp.write_text(json.dumps(man, indent=1), encoding="utf-8")
+    os.replace(tmp, part_dir / "_manifest.json")
+
+
+# ---- Rolling writer ----------------------------------------------------------
+class _OpenFile:
+    def __init__(self, part_dir: Path, seq: int):
+        self.path = part_dir / f"roll-{time.strftime('%H%M%S', time.gmtime())}-{seq:04d}.parquet"
+        self.writer = pq.ParquetWriter(str(self.path), TICK_SCHEMA, compression=COMPRESSION)
+        self.opened = time.time()
+        self.rows = 0
+        self.row_groups = 0
+        self.bytes = 0
+        self.ts_min = None
+        self.ts_max = None
+
+    def write(self, table: pa.Table):
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+        self.row_groups += 1
+        self.bytes += table.nbytes
+        mm = pc.min_max(table["ts_utc"])
+        lo, hi = mm["min"].as_py(), mm["max"].as_py()
+        self.ts_min = lo if self.ts_min is None or lo < self.ts_min else self.ts_min
+        self.ts_max = hi if self.ts_max is None or hi > self.ts_max else self.ts_max
+
+    def entry(self, closed: bool) -> dict:
+        return {"path": self.path.name, "rows": self.rows, "row_groups": self.row_groups,
+                "bytes_in": self.bytes, "ts_min": self.ts_min, "ts_max": self.ts_max,
+                "opened_utc": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.opened)),
+                "closed": closed}
+
+
+class RollingTickWriter:
+    """Appends tick tables as row groups to one open file per (ds, exchange_segment)."""
+
+    def __init__(self, root: Path = ROLL_DIR):
+        self.root = Path(root)
+        self.open = {}   # (ds, seg) -> _OpenFile
+
+    def write(self, table: pa.Table):
+        if table.num_rows == 0:
+            return
+        table = table.select(TICK_SCHEMA.names).cast(TICK_SCHEMA)
+        keys = pa.table({"ds": table["ds"], "seg": table["exchange_segment"]}) \
+                 .group_by(["ds", "seg"]).aggregate([]).to_pylist()
+        if len(keys) == 1:
+            self._append(keys[0]["ds"], keys[0]["seg"], table)
+            return
+        for k in keys:
+            mask = pc.and_(pc.equal(table["ds"], k["ds"]), pc.equal(table["exchange_segment"], k["seg"]))
+            self._append(k["ds"], k["seg"], table.filter(mask))
+
+    def _append(self, ds: str, seg: int, table: pa.Table):
+        key = (ds, int(seg))
+        f = self.open.get(key)
+        if f is not None and (f.bytes >= ROLL_MAX_BYTES or time.time() - f.opened >= ROLL_MAX_SECS):
+            self._close(key)
+            f = None
+        if f is None:
+            # a new day means yesterday's writers are done
+            for old in [k for k in self.open if k[0] != ds]:
+                self._close(old)
+            part_dir = _part_dir(self.root, ds, seg)
+            part_dir.mkdir(parents=True, exist_ok=True)
+            man = load_manifest(part_dir)
+            f = _OpenFile(part_dir, len(man["files"]))
+            man["files"].append(f.entry(closed=False))
+            save_manifest(part_dir, man)
+            self.open[key] = f
+        f.write(table)
+
+    def _close(self, key):
+        f = self.open.pop(key, None)
+        if f is None:
+            return
+        f.writer.close()
+        part_dir = f.path.parent
+        man = load_manifest(part_dir)
+        man["files"] = [e for e in man["files"] if e["path"] != f.path.name] + [f.entry(closed=True)]
+        save_manifest(part_dir, man)
+
+    def close(self):
+        for key in list(self.open):
+            self._close(key)
+
+
+# ---- Compaction --------------------------------------------------------------
+def _read_legacy(sid_dir: Path, ds: str, seg: int, sid: int):
+    """Tiny files from the old write_to_dataset layout (partition cols stripped)."""
+    tables, used = [], []
+    for p in sorted(sid_dir.glob("*.parquet")):
+        if p.name == "part-0.parquet":
+            continue
+        try:
+            t = pq.read_table(p)
+            n = t.num_rows
+            for name, val, typ in (("ds", ds, pa.string()), ("exchange_segment", seg, pa.int32()),
+                                   ("security_id", sid, pa.int64())):
+                if name not in t.column_names:
+                    t = t.append_column(name, pa.array([val] * n, type=typ))
+            cols = [t[f.name].cast(f.type) if f.name in t.column_names else pa.nulls(n, f.type)
+                    for f in TICK_SCHEMA]
+            tables.append(pa.Table.from_arrays(cols, schema=TICK_SCHEMA))
+            used.append(p)
+        except Exception as e:
+            print(f"[SKIP] legacy {p}: {e}")
+    return tables, used
+
+def _read_prev(path: Path, ds: str, seg: int, sid: int) -> pa.Table:
+    """Existing compacted file: add back the partition columns stripped on write."""
+    t = pq.read_table(path)
+    n = t.num_rows
+    t = t.append_column("ds", pa.array([ds] * n, type=pa.string())) \
+         .append_column("exchange_segment", pa.array([seg] * n, type=pa.int32())) \
+         .append_column("security_id", pa.array([sid] * n, type=pa.int64()))
+    return t.select(TICK_SCHEMA.names).cast(TICK_SCHEMA)
+
+def _dedupe_sorted(t: pa.Table) -> pa.Table:
+    """Sort by (ts_utc, recv_ts_utc) and drop repeats of the same tick (first copy wins)."""
+    t = t.sort_by([("ts_utc", "ascending"), ("recv_ts_utc", "ascending")])
+    dup = t.select(list(DEDUPE_COLS)).to_pandas().duplicated().to_numpy()
+    return t.filter(pa.array(~dup)) if dup.any() else t
+
+def compact_day(ds: str, segment: int = None, keep: bool = False) -> dict:
+    stats = {"instruments": 0, "rows": 0, "files_in": 0}
+    seg_dirs = sorted((ROLL_DIR / f"ds={ds}").glob("exchange_segment=*"))
+    seg_dirs += [d for d in sorted((COMPACT_DIR / f"ds={ds}").glob("exchange_segment=*"))
+                 if not (ROLL_DIR / f"ds={ds}" / d.name).exists()]
+    for seg_dir in seg_dirs:
+        seg = int(seg_dir.name.split("=", 1)[1])
+        if segment is not None and seg != int(segment):
+            continue
+        roll_dir = _part_dir(ROLL_DIR, ds, seg)
+        man = load_manifest(roll_dir)
+        closed = [roll_dir / e["path"] for e in man["files"] if e.get("closed")]
+        skipped = [e["path"] for e in man["files"] if not e.get("closed")]
+        if skipped:
+            print(f"[WARN] {roll_dir}: skipping {len(skipped)} open/unfinished file(s): {skipped}")
+        roll = pa.concat_tables([pq.read_table(p, schema=TICK_SCHEMA) for p in closed]) if closed \
+            else TICK_SCHEMA.empty_table()
+        stats["files_in"] += len(closed)
+
+        out_seg = _part_dir(COMPACT_DIR, ds, seg)
+        sids = set(pc.unique(roll["security_id"]).to_pylist()) if roll.num_rows else set()
+        sids |= {int(d.name.split("=", 1)[1]) for d in out_seg.glob("security_id=*")}
+        for sid in sorted(sids):
+            sid_dir = out_seg / f"security_id={sid}"
+            parts = [roll.filter(pc.equal(roll["security_id"], sid))] if roll.num_rows else []
+            legacy, used = _read_legacy(sid_dir, ds, seg, sid)
+            parts += legacy
+            stats["files_in"] += len(used)
+            if not any(p.num_rows for p in parts):
+                continue   # nothing new for this instrument-day
+            prev = sid_dir / "part-0.parquet"
+            if prev.exists():
+                parts.append(_read_prev(prev, ds, seg, sid))
+            t = pa.concat_tables([p for p in parts if p.num_rows]) if parts else None
+            if t is None or t.num_rows == 0:
+                continue
+            t = _dedupe_sorted(t)
+            sid_dir.mkdir(parents=True, exist_ok=True)
+            tmp = sid_dir / "part-0.parquet.tmp"
+            pq.write_table(t.drop(list(PARTITION_COLS)), str(tmp),
+                           row_group_size=COMPACT_ROW_GROUP, compression=COMPRESSION)
+            os.replace(tmp, prev)
+            if not keep:
+                for p in used:
+                    p.unlink(missing_ok=True)
+            stats["instruments"] += 1
+            stats["rows"] += t.num_rows
+
+        if not keep and closed:
+            for p in closed:
+                p.unlink(missing_ok=True)
+            man["files"] = [e for e in man["files"] if not e.get("closed")]
+            save_manifest(roll_dir, man)
+    return stats
+
+def main():
+    ap = argparse.ArgumentParser(description="Teevra18 tick Parquet maintenance")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact")
+    c.add_argument("--ds", required=True, help="YYYY-MM-DD")
+    c.add_argument("--segment", type=int, default=None)
+    c.add_argument("--keep", action="store_true", help="keep rolling/legacy inputs")
+    m = sub.add_parser("manifest")
+    m.add_argument("--ds", required=True)
+    args = ap.parse_args()
+
+    if args.cmd == "compact":
+        print("[OK] compacted:", compact_day(args.ds, args.segment, args.keep))
+    elif args.cmd == "manifest":
+        for d in sorted(glob.glob(str(ROLL_DIR / f"ds={args.ds}" / "exchange_segment=*"))):
+            man = load_manifest(Path(d))
+            for e in man["files"]:
+                print(f"{Path(d).name} {e['path']} rows={e['rows']} rg={e['row_groups']} "
+                      f"{e['ts_min']}..{e['ts_max']} closed={e['closed']}")
+
+if __name__ == "__main__":
+    main()
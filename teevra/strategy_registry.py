@@ -0,0 +1,304 @@
+# C:\teevra18\teevra\strategy_registry.py
+"""
+Strategy registry with compiled, vectorised rule expressions.
+
+A strategy is declared once as indicator inputs + boolean rules:
+
+    {
+      "inputs": {"ema_fast": {"fn": "ema", "src": "c", "length": 9},
+                 "ema_slow": {"fn": "ema", "src": "c", "length": 21}},
+      "vars":   {"spread": "ema_fast - ema_slow"},
+      "long":   "c > h1 and spread > 0",
+      "short":  "c < l1 and spread < 0",
+      "stop_long": "l1", "stop_short": "h1",
+      "reasons": {"long": "ema_up_breakout", "short": "ema_dn_breakdown"}
+    }
+
+Names available to expressions: o/h/l/c for the current bar, o1/h1/l1/c1 ...
+for N bars back, every input and every earlier var. `and`/`or`/`not` and
+chained comparisons work element-wise; max/min/abs/where/sqrt/log map to NumPy.
+
+compile_spec() turns a spec into a CompiledStrategy once (cached by config
+hash). evaluate(bars) runs it over the whole universe, where bars is the
+columnar dict from svc_strategy_core.fetch_lastn: {"o","h","l","c": (m, N)}.
+The same object serves live M7, backtests and the Strategy Lab preview.
+"""
+import ast
+import json
+import hashlib
+import re
+
+import numpy as np
+
+LONG, SHORT = 1, -1
+
+_FUNCS = {"abs": np.abs, "max": np.maximum, "min": np.minimum, "where": np.where,
+          "sqrt": np.sqrt, "log": np.log}
+_SERIES = re.compile(r"^([ohlc])(\d*)$")
+_ALLOWED = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call,
+            ast.Name, ast.Load, ast.Constant, ast.IfExp,
+            ast.And, ast.Or, ast.Not, ast.USub, ast.UAdd,
+            ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+            ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq, ast.BitAnd, ast.BitOr, ast.Invert)
+
+
+# ---- Indicator inputs (vectorised along the bar axis) ------------------------
+def _sma(x, n):
+    return x[:, -n:].mean(axis=1)
+
+def _ema(x, n):
+    a = 2.0 / (n + 1.0)
+    out = x[:, 0].astype(np.float64)
+    for j in range(1, x.shape[1]):
+        out = a * x[:, j] + (1 - a) * out
+    return out
+
+def _wilder(x, n):
+    out = x[:, :n].mean(axis=1)
+    for j in range(n, x.shape[1]):
+        out = (out * (n - 1) + x[:, j]) / n
+    return out
+
+def _true_range(bars):
+    h, l, c = bars["h"], bars["l"], bars["c"]
+    prev_c = np.concatenate([c[:, :1], c[:, :-1]], axis=1)
+    return np.maximum(h - l, np.maximum(np.abs(h - prev_c), np.abs(l - prev_c)))
+
+def _input_value(bars, fn, src, n):
+    x = bars.get(src)
+    if fn == "sma":
+        return _sma(x, n)
+    if fn == "ema":
+        return _ema(x, n)
+    if fn == "highest":
+        return x[:, -n:].max(axis=1)
+    if fn == "lowest":
+        return x[:, -n:].min(axis=1)
+    if fn == "atr":
+        return _wilder(_true_range(bars)[:, 1:], n)
+    if fn == "rsi":
+        d = np.diff(x, axis=1)
+        up, dn = _wilder(np.clip(d, 0, None), n), _wilder(np.clip(-d, 0, None), n)
+        rs = np.divide(up, dn, out=np.full_like(up, np.inf), where=dn != 0)
+        return 100.0 - 100.0 / (1.0 + rs)
+    raise ValueError(f"unknown input fn '{fn}'")
+
+# bars each input needs (EMA/RSI/ATR get a warm-up window)
+_WARMUP = {"sma": 1, "highest": 1, "lowest": 1, "ema": 3, "rsi": 3, "atr": 3}
+
+
+# ---- Expression compiler -----------------------------------------------------
+class _Vectorise(ast.NodeTransformer):
+    """and/or/not -> &/|/~ and a<b<c -> (a<b)&(b<c) so rules act element-wise."""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        expr = node.values[0]
+        for v in node.values[1:]:
+            expr = ast.BinOp(left=expr, op=op, right=v)
+        return expr
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        expr = parts[0]
+        for p in parts[1:]:
+            expr = ast.BinOp(left=expr, op=ast.BitAnd(), right=p)
+        return expr
+
+def compile_expr(text: str):
+    """Validate + compile one rule expression; returns (code, referenced names)."""
+    tree = ast.parse(str(text), mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED):
+            raise ValueError(f"unsupported syntax in rule '{text}': {type(node).__name__}")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in _FUNCS):
+            raise ValueError(f"unsupported function in rule '{text}'")
+    names = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name)} - set(_FUNCS)
+    tree = ast.fix_missing_locations(_Vectorise().visit(tree))
+    return compile(tree, f"<rule:{text}>", "eval"), names
+
+
+# ---- Compiled strategy -------------------------------------------------------
+def spec_hash(spec: dict) -> str:
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+class CompiledStrategy:
+    def __init__(self, strategy_id: str, spec: dict):
+        self.id = strategy_id
+        self.spec = spec
+        self.hash = spec_hash(spec)
+        self.inputs = {}
+        need = 2
+        for name, cfg in (spec.get("inputs") or {}).items():
+            fn = str(cfg.get("fn", name.split("_")[0])).lower()
+            if fn not in _WARMUP:
+                raise ValueError(f"{strategy_id}: unknown input fn '{fn}' for '{name}' (supported: {sorted(_WARMUP)})")
+            n = int(cfg.get("length", 14))
+            self.inputs[name] = (fn, str(cfg.get("src", "c")).lower(), n)
+            need = max(need, n * _WARMUP.get(fn, 1) + 1)
+        self.vars = [(k, *compile_expr(v)) for k, v in (spec.get("vars") or {}).items()]
+        self.long = compile_expr(spec["long"]) if spec.get("long") else None
+        self.short = compile_expr(spec["short"]) if spec.get("short") else None
+        self.stop_long = compile_expr(spec.get("stop_long", "l1"))
+        self.stop_short = compile_expr(spec.get("stop_short", "h1"))
+        reasons = spec.get("reasons") or {}
+        self.reasons = {LONG: reasons.get("long", f"{strategy_id}_long"),
+                        SHORT: reasons.get("short", f"{strategy_id}_short")}
+        known = set(self.inputs)
+        for k, _, names in self.vars:
+            need = max(need, self._lag_need(names))
+            self._check(names, known, k)
+            known.add(k)
+        for part in (self.long, self.short, self.stop_long, self.stop_short):
+            if part is not None:
+                need = max(need, self._lag_need(part[1]))
+                self._check(part[1], known, self.id)
+        self.bars_needed = need
+
+    @staticmethod
+    def _lag_need(names):
+        lags = [int(m.group(2) or 0) for m in map(_SERIES.match, names) if m]
+        return max(lags, default=0) + 1
+
+    @staticmethod
+    def _check(names, known, where):
+        bad = [n for n in names if n not in known and not _SERIES.match(n)]
+        if bad:
+            raise ValueError(f"{where}: unknown name(s) {bad}")
+
+    def namespace(self, bars) -> dict:
+        ns = dict(_FUNCS)
+        n = bars["c"].shape[1]
+        for key in ("o", "h", "l", "c"):
+            mat = bars[key]
+            for lag in range(min(n, self.bars_needed)):
+                ns[f"{key}{lag or ''}"] = mat[:, -1 - lag]
+        for name, (fn, src, length) in self.inputs.items():
+            ns[name] = _input_value(bars, fn, src, length)
+        for name, code, _ in self.vars:
+            ns[name] = eval(code, {"__builtins__": {}}, ns)
+        return ns
+
+    def evaluate(self, bars, ns=None) -> np.ndarray:
+        """Side per instrument: +1 LONG, -1 SHORT, 0 none (long wins ties)."""
+        m = len(bars["c"])
+        if not m or bars["c"].shape[1] < self.bars_needed:
+            return np.zeros(m, dtype=np.int8)
+        ns = ns or self.namespace(bars)
+        zero = np.zeros(m, dtype=bool)
+        lg = np.asarray(eval(self.long[0], {"__builtins__": {}}, ns), dtype=bool) if self.long else zero
+        sh = np.asarray(eval(self.short[0], {"__builtins__": {}}, ns), dtype=bool) if self.short else zero
+        return np.where(lg, LONG, np.where(sh, SHORT, 0)).astype(np.int8)
+
+    def stops(self, bars, side, ns=None) -> np.ndarray:
+        ns = ns or self.namespace(bars)
+        sl = np.broadcast_to(eval(self.stop_long[0], {"__builtins__": {}}, ns), side.shape)
+        ss = np.broadcast_to(eval(self.stop_short[0], {"__builtins__": {}}, ns), side.shape)
+        return np.where(side == LONG, sl, ss).astype(np.float64)
+
+
+_CACHE = {}
+
+def compile_spec(strategy_id: str, spec: dict) -> CompiledStrategy:
+    """Compile once per (id, config hash); later calls return the cached evaluator."""
+    key = (strategy_id, spec_hash(spec))
+    cs = _CACHE.get(key)
+    if cs is None:
+        cs = _CACHE[key] = CompiledStrategy(strategy_id, spec)
+    return cs
+
+
+# ---- Registry ----------------------------------------------------------------
+BUILTIN_SPECS = {
+    "BO2": {"long": "c > h1", "short": "c < l1", "stop_long": "l1", "stop_short": "h1",
+            "reasons": {"long": "close>prev_high", "short": "close<prev_low"}},
+    "RB1": {"vars": {"rng": "max(1e-9, h1 - l1)", "upper": "h1 - 0.1 * rng", "lower": "l1 + 0.1 * rng"},
+            "long": "c <= lower", "short": "c >= upper", "stop_long": "l1", "stop_short": "h1",
+            "reasons": {"long": "close<=lower10%", "short": "close>=upper10%"}},
+}
+
+def spec_from_lab(params: dict) -> dict:
+    """
+    Strategy Lab payload -> registry spec. Lab saves {INDICATOR: {"params": {...}}};
+    a strategy additionally carries a "rules" mapping (long/short/stop_*/vars/reasons).
+    Indicator keys the rules reference become lowercase input names; fn defaults
+    to the key prefix. Indicators the rules never use are left out.
+    """
+    params = dict(params or {})
+    rules = params.pop("rules", None) or params.pop("RULES", None)
+    if not rules:
+        return None
+    used = set()
+    for text in [rules.get(k) for k in ("long", "short", "stop_long", "stop_short")] + \
+                list((rules.get("vars") or {}).values()):
+        if text:
+            used |= compile_expr(text)[1]
+    inputs = {}
+    for key, cfg in params.items():
+        if key.lower() not in used:
+            continue
+        p = dict((cfg or {}).get("params", cfg or {}))
+        p.setdefault("fn", key.split("_")[0].lower())
+        inputs[key.lower()] = p
+    spec = dict(rules)
+    spec["inputs"] = {**inputs, **(rules.get("inputs") or {})}
+    return spec
+
+class StrategyRegistry:
+    def __init__(self):
+        self.specs = dict(BUILTIN_SPECS)
+
+    def register(self, strategy_id: str, spec: dict) -> CompiledStrategy:
+        cs = compile_spec(strategy_id, spec)   # validate before accepting
+        self.specs[strategy_id] = spec
+        return cs
+
+    def get(self, strategy_id: str):
+        spec = self.specs.get(strategy_id)
+        return compile_spec(strategy_id, spec) if spec is not None else None
+
+    def load_catalog(self, conn) -> int:
+        """Register Strategy Lab saves that carry rules; plain indicator sets are skipped."""
+        n = 0
+        try:
+            rows = conn.execute("SELECT strategy_id, params_json FROM strategies_catalog WHERE enabled=1").fetchall()
+        except Exception:
+            return 0
+        for sid, pj in rows:
+            try:
+                spec = spec_from_lab(json.loads(pj or "{}"))
+                if spec:
+                    self.register(str(sid), spec)
+                    n += 1
+            except Exception as e:
+                print(f"[WARN] strategy {sid}: {e}")
+        return n
+
+    def load_config(self, groups_cfg) -> int:
+        """Inline specs from configs\\m7_strategy.json: {"id": "X", "spec": {...}}."""
+        n = 0
+        for grp in groups_cfg or []:
+            for st in grp.get("strategies", []):
+                if st.get("spec"):
+                    self.register(st.get("id", "NA"), st["spec"])
+                    n += 1
+        return n
+
+    def bars_needed(self, ids) -> int:
+        return max([2] + [self.get(i).bars_needed for i in ids if self.get(i) is not None])
+
+
+REGISTRY = StrategyRegistry()
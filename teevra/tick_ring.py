@@ -0,0 +1,133 @@
+# C:\teevra18\teevra\tick_ring.py
+"""
+Preallocated columnar ring buffer for M1 ticks.
+
+The ingestor writes parsed fields straight into per-column NumPy arrays; the
+SQLite and Parquet flushers each own a read cursor and consume zero-copy
+slices. Memory is fixed at startup (TICK_RING_CAPACITY rows). If the slowest
+consumer falls a full ring behind, new ticks are dropped and counted rather
+than overwriting slots a flusher may still be reading.
+"""
+import os
+import threading
+
+import numpy as np
+
+TICK_RING_CAPACITY = int(os.getenv("TICK_RING_CAPACITY", "262144"))
+
+INT_NULL = np.iinfo(np.int64).min   # stand-in for NULL in integer columns
+
+# (column, dtype) in ticks_raw order; ts_utc/recv_ts_utc are kept as epoch seconds
+COLUMNS = (
+    ("ts_epoch",         np.int64),
+    ("exchange_segment", np.int32),
+    ("security_id",      np.int64),
+    ("mode",             "S1"),
+    ("ltt_epoch",        np.int64),
+    ("ltp",              np.float64),
+    ("atp",              np.float64),
+    ("last_qty",         np.int64),
+    ("volume",           np.int64),
+    ("buy_qty_total",    np.int64),
+    ("sell_qty_total",   np.int64),
+    ("oi",               np.int64),
+    ("day_open",         np.float64),
+    ("day_high",         np.float64),
+    ("day_low",          np.float64),
+    ("day_close",        np.float64),
+    ("prev_close",       np.float64),
+    ("recv_epoch",       np.int64),
+)
+COLUMN_NAMES = tuple(c for c, _ in COLUMNS)
+
+
+class TickRing:
+    def __init__(self, capacity: int = TICK_RING_CAPACITY, consumers=("sqlite", "parquet")):
+        self.capacity = int(capacity)
+        self.cols = {name: np.empty(self.capacity, dtype=dt) for name, dt in COLUMNS}
+        self._col_list = [self.cols[n] for n in COLUMN_NAMES]
+        self.head = 0                                   # total rows ever written
+        self.tails = {name: 0 for name in consumers}    # total rows consumed per reader
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    # --- producer -------------------------------------------------------------
+    def append(self, values) -> bool:
+        """
+        Write one tick. `values` follows COLUMN_NAMES; None becomes NaN for
+        float columns and INT_NULL for integer columns. Returns False if dropped.
+        """
+        with self.lock:
+            if self.head - min(self.tails.values()) >= self.capacity:
+                self.dropped += 1
+                return False
+            i = self.head % self.capacity
+            for arr, v in zip(self._col_list, values):
+                if v is None:
+                    v = INT_NULL if arr.dtype.kind == "i" else (np.nan if arr.dtype.kind == "f" else b"")
+                arr[i] = v
+            self.head += 1
+        return True
+
+    # --- consumers ------------------------------------------------------------
+    def pending(self, consumer: str) -> int:
+        return self.head - self.tails[consumer]
+
+    def peek(self, consumer: str, max_rows: int = None):
+        """
+        Return (n, segments) where each segment is a dict of column views.
+        At most two segments (when the range wraps). Slots stay reserved until
+        advance(consumer, n) is called, so the views are safe to read meanwhile.
+        """
+        with self.lock:
+            start, stop = self.tails[consumer], self.head
+        if max_rows is not None:
+            stop = min(stop, start + int(max_rows))
+        n = stop - start
+        if n <= 0:
+            return 0, []
+        a, b = start % self.capacity, stop % self.capacity
+        if a < b or b == 0:
+            spans = [(a, b or self.capacity)]
+        else:
+            spans = [(a, self.capacity), (0, b)]
+        return n, [{name: arr[s:e] for name, arr in self.cols.items()} for s, e in spans]
+
+    def advance(self, consumer: str, n: int):
+        with self.lock:
+            self.tails[consumer] += int(n)
+
+
+# ---- Column helpers ----------------------------------------------------------
+def epoch_to_iso(col: np.ndarray) -> np.ndarray:
+    """Epoch seconds -> 'YYYY-MM-DDTHH:MM:SS' (same format as _now_utc_iso)."""
+    return col.astype("datetime64[s]").astype(str)
+
+def to_pylist(col: np.ndarray) -> list:
+    """Column slice -> Python list with NULL sentinels mapped back to None."""
+    kind = col.dtype.kind
+    if kind == "i":
+        mask = col == INT_NULL
+        out = col.tolist()
+        if mask.any():
+            for j in np.flatnonzero(mask):
+                out[j] = None
+        return out
+    if kind == "f":
+        mask = np.isnan(col)
+        out = col.tolist()
+        if mask.any():
+            for j in np.flatnonzero(mask):
+                out[j] = None
+        return out
+    if kind == "S":
+        return col.astype(str).tolist()
+    return col.tolist()
+
+def null_mask(col: np.ndarray):
+    kind = col.dtype.kind
+    if kind == "i":
+        return col == INT_NULL
+    if kind == "f":
+        return np.isnan(col)
+    return None
@@ -11,6 +11,11 @@ import os, sys, csv, sqlite3, re
 import datetime as dt
 from pathlib import Path
 
+ROOT = r"C:\teevra18"
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from teevra.instruments import master
+
 DB_PATH  = Path(os.getenv("DB_PATH", r"C:\teevra18\data\teevra18.db"))
 CSV_PATH = Path(r"C:\teevra18\data\api-scrip-master-detailed.csv")
 
@@ -113,12 +118,30 @@ def row_text(row):
     """Concatenate all values for fuzzy search."""
     return " ".join([U(v) for v in row.values()])
 
-def main():
-    if not CSV_PATH.exists():
-        print("CSV not found:", CSV_PATH); sys.exit(1)
-
-    ensure_table()
+def resolve_from_master():
+    """(idx_sid, fut_sid) via the shared instrument master (hash lookups); None where it has no match."""
+    m = master(CSV_PATH)
+    if not len(m):
+        return None, None
+    idx = m.by_symbol("NIFTY 50", "IDX_I")
+    idx_sid = None
+    if idx:
+        idx_sid = str(idx["security_id"])
+        upsert("IDX_I:NIFTY50", "IDX_I", "INDEX", "NIFTY 50", "", None, idx_sid)
+    df = m.frame()
+    fut = df[(df["instrument"] == "FUTIDX")
+             & ((df["underlying_symbol"] == "NIFTY") | df["symbol_name"].str.upper().str.match(r"NIFTY[- ]"))
+             & (df["expiry"] >= TODAY.isoformat())].sort_values("expiry", kind="stable")
+    fut_sid = None
+    if not fut.empty:
+        best = fut.iloc[0]
+        fut_sid = str(best["security_id"])
+        expcode = int(best["expiry"].replace("-", ""))
+        upsert("NSE_FNO:FUTIDX:NIFTY:NEAR", "NSE_FNO", "FUTIDX", "NIFTY", "NIFTY", expcode, fut_sid)
+    return idx_sid, fut_sid
 
+def scan_csv(want_idx=True, want_fut=True):
+    """Header-agnostic full-text scan; used only for what the master lookup could not resolve."""
     # open with tolerant encodings
     reader = None
     for enc in ("utf-8","utf-8-sig","latin-1"):
@@ -131,7 +154,7 @@ def main():
             except: pass
             continue
     if reader is None:
-        print("Unable to read CSV in utf-8/latin-1"); sys.exit(1)
+        print("Unable to read CSV in utf-8/latin-1"); return None, None
 
     idx_sid = None
     fut_candidates = []  # list[(expiry_date or None, sid, preview_dict)]
@@ -143,14 +166,14 @@ def main():
         sym = U(up.get("SYMBOL_NAME") or up.get("SYMBOL") or up.get("DISPLAY_NAME") or up.get("TRADING_SYMBOL"))
         inst= U(up.get("INSTRUMENT") or up.get("SEM_INSTRUMENT_NAME") or up.get("PRODUCT"))
         # simple index detection
-        if ("NIFTY 50" in sym) and ("INDEX" in inst or inst == "" or "SPOT" in inst or "IDX" in inst):
+        if want_idx and ("NIFTY 50" in sym) and ("INDEX" in inst or inst == "" or "SPOT" in inst or "IDX" in inst):
             sid = find_security_id(up)
             if sid:
                 idx_sid = sid
                 upsert("IDX_I:NIFTY50", "IDX_I", "INDEX", "NIFTY 50", "", None, sid)
         # build future candidates — we’ll also do a 2nd pass with full-text scan
         txt = row_text(up)
-        if ("NIFTY" in txt) and ("FUT" in txt):
+        if want_fut and ("NIFTY" in txt) and ("FUT" in txt):
             sid = find_security_id(up)
             if sid:
                 # try expiry from any plausible field
@@ -171,7 +194,7 @@ def main():
     except: pass
 
     # If nothing yet, do a 2nd pass purely text-based (some dumps use very alien headers)
-    if not fut_candidates and not fallback_candidates:
+    if want_fut and not fut_candidates and not fallback_candidates:
         for enc in ("utf-8","utf-8-sig","latin-1"):
             try:
                 f2 = open(CSV_PATH, newline="", encoding=enc)
@@ -213,6 +236,18 @@ def main():
         best = fallback_candidates[0]
         fut_sid = best[1]
         upsert("NSE_FNO:FUTIDX:NIFTY:NEAR", "NSE_FNO", "FUTIDX", "NIFTY", "NIFTY", None, fut_sid)
+    return idx_sid, fut_sid
+
+def main():
+    if not CSV_PATH.exists():
+        print("CSV not found:", CSV_PATH); sys.exit(1)
+
+    ensure_table()
+
+    idx_sid, fut_sid = resolve_from_master()
+    if idx_sid is None or fut_sid is None:
+        scan_idx, scan_fut = scan_csv(want_idx=idx_sid is None, want_fut=fut_sid is None)
+        idx_sid, fut_sid = idx_sid or scan_idx, fut_sid or scan_fut
 
     print("Resolved:", {
         "IDX_I:NIFTY50": idx_sid,